@@ -0,0 +1,317 @@
+# admission.py
+# 后端感知的准入控制：同时提交给后端的任务数由 AIMD 根据后端反馈自动调整
+# （任务顺利开跑且已用满容量时 +1/capacity，后端报告过载（读超时、429/503）或提交后迟迟不出帧时 ×0.7；
+# 熔断、4xx 等与负载无关的失败不影响容量），
+# 后端提供容量接口时以接口为准。超出容量的请求在前端排队，排队者能看到自己的位置和预计等待时间；
+# 队列过长时直接拒绝新请求，如果有相同参数（或同场景）的历史结果则返回缓存的结果。
+# 排队顺序按用户(IP)做亏空轮询(DRR)：每轮每个有请求在排队的用户放行一个，
+# 同一个 IP 连续提交的请求不会挤占其他用户；内置示例可以配置更高的权重。
+import os
+import time
+import threading
+from collections import deque, Counter, OrderedDict
+from typing import Optional
+
+import requests
+from config import EXAMPLES
+from metrics import counter, gauge, histogram
+
+ADMISSION_INITIAL_CAPACITY = int(os.getenv("ADMISSION_INITIAL_CAPACITY", "4"))
+ADMISSION_MIN_CAPACITY = 1
+ADMISSION_MAX_CAPACITY = int(os.getenv("ADMISSION_MAX_CAPACITY", "16"))
+# 前端队列最多排多少个请求、预计等待超过多少秒时拒绝新请求
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "20"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "600"))
+# 提交后超过这么久才出现第一帧，说明任务在后端排队，视为过载
+ADMISSION_TARGET_START = float(os.getenv("ADMISSION_TARGET_START", "30"))
+# 后端的容量接口（返回 {"capacity": n}），为空则只靠反馈学习
+ADMISSION_CAPACITY_URL = os.getenv("ADMISSION_CAPACITY_URL", "")
+ADMISSION_CAPACITY_POLL = 30
+# 单个任务占用后端的时长初始估计(秒)，之后按指数滑动平均更新
+DEFAULT_SERVICE_SECONDS = 90.0
+RESULT_CACHE_SIZE = 100
+# 内置示例请求在公平队列里的权重，1 表示不优先，必须大于 0
+ADMISSION_PRIORITY_WEIGHT = float(os.getenv("ADMISSION_PRIORITY_WEIGHT", "2"))
+
+# user_class: light 为提交时该用户没有其他排队/运行中的请求，heavy 反之，priority 为内置示例
+ADMISSION_WAIT = histogram("nav_admission_wait_seconds", "Time requests spent in the frontend admission queue",
+                           ("user_class",))
+ADMISSION_SHED = counter("nav_admission_shed_total", "Requests rejected because the admission queue was full",
+                         ("served_from_cache",))
+
+
+class Ticket:
+    def __init__(self, key: str, priority: bool = False):
+        self.key = key
+        self.priority = priority
+        self.user_class = "priority" if priority else "light"
+        self.enqueued = time.monotonic()
+        self.admitted = None
+        self.released = False
+        self._event = threading.Event()
+
+    def wait(self, timeout: float) -> bool:
+        """等待被放行，超时返回 False"""
+        return self._event.wait(timeout)
+
+
+class FifoQueue:
+    def __init__(self):
+        self._items = deque()
+
+    def push(self, ticket: Ticket):
+        self._items.append(ticket)
+
+    def pop(self) -> Ticket:
+        return self._items.popleft()
+
+    def remove(self, ticket: Ticket):
+        try:
+            self._items.remove(ticket)
+        except ValueError:
+            pass
+
+    def position(self, ticket: Ticket) -> int:
+        try:
+            return self._items.index(ticket)
+        except ValueError:
+            return -1
+
+    def has_key(self, key: str) -> bool:
+        return any(t.key == key for t in self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+
+class FairQueue:
+    """按 ticket.key 分流的亏空轮询队列。每个流每轮获得等于权重的额度，每放行一个请求消耗 1；
+    流内优先级请求排在普通请求之前，流的权重取决于队首请求是否为优先级请求"""
+
+    def __init__(self, priority_weight: float = ADMISSION_PRIORITY_WEIGHT):
+        # 权重为 0 的流永远攒不够额度，pop 会一直轮询下去
+        if priority_weight <= 0:
+            raise ValueError(f"priority weight must be positive, got {priority_weight}")
+        self.priority_weight = priority_weight
+        # 仍有请求的流，按轮询顺序排列，队首是当前正在服务的流
+        self._flows = OrderedDict()
+        self._deficit = {}
+        self._current = None
+        self._size = 0
+
+    def _weight(self, flow: deque) -> float:
+        return self.priority_weight if flow[0].priority else 1.0
+
+    def push(self, ticket: Ticket):
+        flow = self._flows.get(ticket.key)
+        if flow is None:
+            flow = self._flows[ticket.key] = deque()
+        if ticket.priority:
+            # 插到本流最后一个优先级请求之后
+            index = sum(1 for t in flow if t.priority)
+            flow.insert(index, ticket)
+        else:
+            flow.append(ticket)
+        self._size += 1
+
+    def pop(self) -> Ticket:
+        if not self._size:
+            raise IndexError("pop from an empty queue")
+        while True:
+            key = next(iter(self._flows))
+            flow = self._flows[key]
+            if self._current != key:
+                self._current = key
+                self._deficit[key] = self._deficit.get(key, 0.0) + self._weight(flow)
+            if self._deficit[key] >= 1:
+                self._deficit[key] -= 1
+                self._size -= 1
+                ticket = flow.popleft()
+                if not flow:
+                    del self._flows[key]
+                    self._deficit.pop(key, None)
+                    self._current = None
+                return ticket
+            self._flows.move_to_end(key)
+            self._current = None
+
+    def remove(self, ticket: Ticket):
+        flow = self._flows.get(ticket.key)
+        if flow is None or ticket not in flow:
+            return
+        flow.remove(ticket)
+        self._size -= 1
+        if not flow:
+            del self._flows[ticket.key]
+            self._deficit.pop(ticket.key, None)
+            if self._current == ticket.key:
+                self._current = None
+
+    def _clone(self) -> "FairQueue":
+        clone = FairQueue(self.priority_weight)
+        clone._flows = OrderedDict((key, deque(flow)) for key, flow in self._flows.items())
+        clone._deficit = dict(self._deficit)
+        clone._current = self._current
+        clone._size = self._size
+        return clone
+
+    def position(self, ticket: Ticket) -> int:
+        """在副本上按当前状态模拟出队，得到 ticket 前面还有几个请求"""
+        if ticket.key not in self._flows or ticket not in self._flows[ticket.key]:
+            return -1
+        clone = self._clone()
+        for position in range(self._size):
+            if clone.pop() is ticket:
+                return position
+        return -1
+
+    def has_key(self, key: str) -> bool:
+        return key in self._flows
+
+    def flows(self) -> int:
+        return len(self._flows)
+
+    def __len__(self):
+        return self._size
+
+
+class AdmissionController:
+    def __init__(self, queue=None, initial_capacity: int = ADMISSION_INITIAL_CAPACITY,
+                 max_queue: int = ADMISSION_MAX_QUEUE, max_wait: float = ADMISSION_MAX_WAIT):
+        self._lock = threading.Lock()
+        self.queue = queue if queue is not None else FairQueue()
+        self.capacity = float(initial_capacity)
+        self.backend_capacity = None
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.running = 0
+        # 每个 key 已放行且未归还的请求数，用于区分轻/重度用户
+        self._running_by_key = Counter()
+        self.service_seconds = DEFAULT_SERVICE_SECONDS
+        self._results = OrderedDict()
+
+    @property
+    def limit(self) -> int:
+        if self.backend_capacity is not None:
+            return max(ADMISSION_MIN_CAPACITY, self.backend_capacity)
+        return max(ADMISSION_MIN_CAPACITY, int(self.capacity))
+
+    def estimated_wait(self, position: int) -> float:
+        """排在第 position 位(从 0 开始)的请求预计还要等多久"""
+        return (position // self.limit + 1) * self.service_seconds
+
+    def try_enqueue(self, key: str, priority: bool = False) -> Optional[Ticket]:
+        """申请一个后端名额；队列已满时返回 None（应当拒绝或降级），否则返回 Ticket，用 wait() 等待放行"""
+        ticket = Ticket(key, priority)
+        with self._lock:
+            if not priority and (self._running_by_key[key] or self.queue.has_key(key)):
+                ticket.user_class = "heavy"
+            if not len(self.queue) and self.running < self.limit:
+                self._admit(ticket)
+                return ticket
+            if len(self.queue) >= self.max_queue or self.estimated_wait(len(self.queue)) > self.max_wait:
+                return None
+            self.queue.push(ticket)
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """当前排队位置(从 0 开始)，已放行返回 -1"""
+        with self._lock:
+            return -1 if ticket.admitted is not None else self.queue.position(ticket)
+
+    def cancel(self, ticket: Ticket):
+        """请求放弃（出错或客户端断开）：未放行的移出队列，已放行的归还名额且不影响容量估计"""
+        with self._lock:
+            if ticket.admitted is None:
+                self.queue.remove(ticket)
+                return
+        self.release(ticket)
+
+    def release(self, ticket: Ticket, overloaded: bool = False, service_seconds: Optional[float] = None):
+        """归还名额。overloaded 表示后端有过载迹象；service_seconds 为任务实际占用后端的时长"""
+        with self._lock:
+            if ticket.admitted is None or ticket.released:
+                return
+            ticket.released = True
+            saturated = self.running >= self.limit
+            self.running -= 1
+            self._running_by_key[ticket.key] -= 1
+            if self._running_by_key[ticket.key] <= 0:
+                del self._running_by_key[ticket.key]
+            if overloaded:
+                self.capacity = max(ADMISSION_MIN_CAPACITY, self.capacity * 0.7)
+            elif service_seconds is not None:
+                self.service_seconds = 0.8 * self.service_seconds + 0.2 * service_seconds
+                # 只有用满容量时跑得顺利才说明还能再多放一个
+                if saturated:
+                    self.capacity = min(ADMISSION_MAX_CAPACITY, self.capacity + 1 / self.capacity)
+            self._dispatch()
+
+    def _admit(self, ticket: Ticket):
+        self.running += 1
+        self._running_by_key[ticket.key] += 1
+        ticket.admitted = time.monotonic()
+        ADMISSION_WAIT.labels(ticket.user_class).observe(ticket.admitted - ticket.enqueued)
+        ticket._event.set()
+
+    def _dispatch(self):
+        while len(self.queue) and self.running < self.limit:
+            self._admit(self.queue.pop())
+
+    def poll_backend_capacity(self, url: str = ADMISSION_CAPACITY_URL, interval: float = ADMISSION_CAPACITY_POLL):
+        """启动后台线程定期读取后端容量；没有配置容量接口时不启动。由 main.py 启动时调用，导入本模块不会启动线程"""
+        if not url:
+            return
+
+        def run():
+            while True:
+                try:
+                    capacity = requests.get(url, timeout=5).json().get("capacity")
+                    with self._lock:
+                        self.backend_capacity = int(capacity) if capacity is not None else None
+                        self._dispatch()
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        threading.Thread(target=run, name="admission-capacity", daemon=True).start()
+
+    def remember_result(self, scene: str, model: str, mode: str, prompt: str, video_path: str):
+        """记录成功的结果，过载拒绝时用来兜底"""
+        with self._lock:
+            self._results[(scene, model, mode, prompt.strip())] = video_path
+            self._results.move_to_end((scene, model, mode, prompt.strip()))
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def cached_result(self, scene: str, model: str, mode: str, prompt: str) -> tuple:
+        """返回 (视频路径, 是否参数完全相同)；没有参数相同的结果时退而取同场景最近的一个"""
+        with self._lock:
+            exact = self._results.get((scene, model, mode, prompt.strip()))
+            same_scene = [path for key, path in reversed(self._results.items()) if key[0] == scene]
+        if exact and os.path.exists(exact):
+            return exact, True
+        for path in same_scene:
+            if os.path.exists(path):
+                return path, False
+        return None, False
+
+
+def is_example(scene: str, model: str, mode: str, prompt: str) -> bool:
+    return [scene, model, mode, (prompt or "").strip()] in EXAMPLES
+
+
+def format_queue_status(controller: AdmissionController, position: int) -> str:
+    wait = controller.estimated_wait(position)
+    minutes, seconds = divmod(int(wait), 60)
+    return (f"⏳ Waiting for a simulation slot: **#{position + 1}** in line, "
+            f"estimated wait ~{minutes}m{seconds:02d}s "
+            f"({controller.running}/{controller.limit} slots busy)")
+
+
+ADMISSION = AdmissionController()
+gauge("nav_admission_capacity", "Concurrent backend tasks currently allowed").set_function(lambda: ADMISSION.limit)
+gauge("nav_admission_running", "Backend tasks currently admitted").set_function(lambda: ADMISSION.running)
+gauge("nav_admission_queue_length", "Requests waiting in the admission queue").set_function(lambda: len(ADMISSION.queue))
+gauge("nav_admission_queued_users", "Distinct users with requests in the admission queue").set_function(
+    lambda: ADMISSION.queue.flows())
@@ -0,0 +1,191 @@
+# analytics.py
+# 使用情况统计：随 log_submission 增量更新成功率、失败原因和按场景/模型/模式的计数，
+# 启动时可用流式解析从提交日志（含归档段）重建，查询时不再扫描日志。
+# 被拒绝（限流、队列满、熔断）、被取消和交给重新连接（detached）的记录单独计数，不算进成功率和失败原因；
+# detached 的运行接上后会另记一条最终结果，这样每次运行只算一次。
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+# 按小时聚合的时间序列最多保留多少个小时
+HOURLY_BUCKETS = 24 * 30
+# 最多单独统计多少种失败原因，其余归入 "other"
+MAX_FAILURE_REASONS = 50
+
+# 报错里的颜色码和换行有时是转义后的字面量（如 "\\x1b[36m"、"\\n"）
+_ANSI = re.compile(r"(\x1b|\\x1b)\[[0-9;]*m")
+_NUMBER = re.compile(r"\d+")
+
+
+def outcome(res) -> str:
+    """提交记录的结果分类：success / failed / rejected / cancelled / detached"""
+    res = str(res or "")
+    if res == "success":
+        return "success"
+    if res == "detached":
+        return "detached"
+    if res == "IP blocked temporarily" or res.startswith("Rejected:"):
+        return "rejected"
+    if res.startswith(("Cancelled while queued", "cancelled (")):
+        return "cancelled"
+    return "failed"
+
+
+def failure_reason(res) -> str:
+    """把后端返回的报错归一成简短的原因：去掉颜色码和引号，只保留第一行，数字替换为 N"""
+    text = _ANSI.sub("", str(res or "unknown")).replace("\\n", "\n").strip().strip("'\"")
+    first_line = next((line.strip() for line in text.splitlines() if line.strip()), "unknown")
+    first_line = _NUMBER.sub("N", first_line)
+    return first_line if len(first_line) <= 80 else first_line[:77] + "..."
+
+
+class UsageAnalytics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self._rebuilding = False
+        self._pending = []
+
+    def _reset(self):
+        self.total = 0
+        self.succeeded = 0
+        # 真正运行（成功或失败）的次数，成功率的分母
+        self.completed = 0
+        self.outcomes = Counter()
+        self.failure_reasons = Counter()
+        # 以下均只统计真正运行的记录。维度 -> 取值 -> [运行数, 成功数]
+        self.by_dimension = {dim: defaultdict(lambda: [0, 0]) for dim in ("scene", "model", "mode")}
+        # "YYYY-MM-DD HH" -> [总数, 成功数]
+        self.hourly = OrderedDict()
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    def record(self, entry: dict):
+        with self._lock:
+            if self._rebuilding:
+                self._pending.append(entry)
+            self._apply(entry)
+
+    def _apply(self, entry: dict):
+        kind = outcome(entry.get("res"))
+        self.total += 1
+        self.outcomes[kind] += 1
+        ts = entry.get("timestamp", "")
+        if ts:
+            self.first_timestamp = self.first_timestamp or ts
+            self.last_timestamp = max(self.last_timestamp or ts, ts)
+        if kind not in ("success", "failed"):
+            return
+        success = kind == "success"
+        self.completed += 1
+        self.succeeded += success
+        if not success:
+            reason = failure_reason(entry.get("res"))
+            if reason in self.failure_reasons or len(self.failure_reasons) < MAX_FAILURE_REASONS:
+                self.failure_reasons[reason] += 1
+            else:
+                self.failure_reasons["other"] += 1
+        for dim, counts in self.by_dimension.items():
+            bucket = counts[entry.get(dim) or "unknown"]
+            bucket[0] += 1
+            bucket[1] += success
+        if ts:
+            hour = ts[:13]
+            bucket = self.hourly.get(hour)
+            if bucket is None:
+                bucket = self.hourly[hour] = [0, 0]
+                if len(self.hourly) > HOURLY_BUCKETS:
+                    self.hourly.popitem(last=False)
+            bucket[0] += 1
+            bucket[1] += success
+
+    def rebuild(self, log_path: str):
+        """从提交日志（含已轮转的归档段）流式重建统计。重建期间到来的新记录按时间戳补上"""
+        import log_archive
+        fresh = UsageAnalytics()
+        with self._lock:
+            self._rebuilding = True
+            self._pending = []
+        try:
+            for entry in log_archive.iter_range(log_path):
+                if entry.get("type", "submission") == "submission":
+                    fresh._apply(entry)
+        finally:
+            with self._lock:
+                last = fresh.last_timestamp or ""
+                for entry in self._pending:
+                    # 早于日志末尾时间的记录已在重建时读到
+                    if entry.get("timestamp", "") > last:
+                        fresh._apply(entry)
+                self.total, self.succeeded = fresh.total, fresh.succeeded
+                self.completed, self.outcomes = fresh.completed, fresh.outcomes
+                self.failure_reasons, self.by_dimension = fresh.failure_reasons, fresh.by_dimension
+                self.hourly = fresh.hourly
+                self.first_timestamp, self.last_timestamp = fresh.first_timestamp, fresh.last_timestamp
+                self._rebuilding = False
+                self._pending = []
+
+    def rebuild_async(self, log_path: str) -> threading.Thread:
+        thread = threading.Thread(target=self.rebuild, args=(log_path,), name="analytics-rebuild", daemon=True)
+        thread.start()
+        return thread
+
+    def snapshot(self, hours: int = 48) -> dict:
+        with self._lock:
+            rate = lambda counts: round(counts[1] / counts[0], 4) if counts[0] else None
+            return {
+                "total": self.total,
+                "completed": self.completed,
+                "succeeded": self.succeeded,
+                "failed": self.completed - self.succeeded,
+                "success_rate": rate([self.completed, self.succeeded]),
+                "outcomes": dict(self.outcomes),
+                "first_timestamp": self.first_timestamp,
+                "last_timestamp": self.last_timestamp,
+                "failure_reasons": dict(self.failure_reasons.most_common()),
+                **{
+                    f"by_{dim}": {value: {"total": c[0], "succeeded": c[1], "success_rate": rate(c)}
+                                  for value, c in sorted(counts.items())}
+                    for dim, counts in self.by_dimension.items()
+                },
+                "hourly": [{"hour": hour, "total": c[0], "succeeded": c[1]}
+                           for hour, c in list(self.hourly.items())[-hours:]],
+                "rebuilding": self._rebuilding,
+            }
+
+
+def format_analytics_for_display(stats: dict) -> str:
+    if not stats["total"]:
+        return "No submission record"
+    rate = lambda r: "-" if r is None else f"{r * 100:.1f}%"
+    lines = [
+        "### Usage Analytics\n",
+        f"Submissions: **{stats['total']}**, ran: **{stats['completed']}**, succeeded: **{stats['succeeded']}**, "
+        f"success rate: **{rate(stats['success_rate'])}**  ",
+        "Not run: " + ", ".join(f"{kind} {stats['outcomes'].get(kind, 0)}"
+                                for kind in ("rejected", "cancelled", "detached")) + "  ",
+        f"From {stats['first_timestamp']} to {stats['last_timestamp']}"
+        + (" (rebuilding from log...)" if stats["rebuilding"] else ""),
+        "",
+    ]
+    for dim in ("scene", "model", "mode"):
+        lines.append(f"| {dim.capitalize()} | Total | Succeeded | Success rate |")
+        lines.append("|------|------|------|------|")
+        for value, c in stats[f"by_{dim}"].items():
+            lines.append(f"| {value} | {c['total']} | {c['succeeded']} | {rate(c['success_rate'])} |")
+        lines.append("")
+    if stats["failure_reasons"]:
+        lines.append("| Failure reason | Count |")
+        lines.append("|------|------|")
+        for reason, count in list(stats["failure_reasons"].items())[:10]:
+            lines.append(f"| {reason.replace('|', '/')} | {count} |")
+        lines.append("")
+    if stats["hourly"]:
+        lines.append("| Hour | Total | Succeeded |")
+        lines.append("|------|------|------|")
+        for bucket in reversed(stats["hourly"][-24:]):
+            lines.append(f"| {bucket['hour']}:00 | {bucket['total']} | {bucket['succeeded']} |")
+    return "\n".join(lines)
+
+
+USAGE_ANALYTICS = UsageAnalytics()
@@ -1,53 +1,167 @@
-# backend_api.py
-# 后端API交互相关
-import requests
-import uuid
-import json
-from typing import Optional
-from config import API_ENDPOINTS
-
-def submit_to_backend(scene: str, prompt: str, mode: str, model_type: str, user: str = "Gradio-user") -> dict:
-    job_id = str(uuid.uuid4())
-    data = {
-        "model_type": model_type,
-        "instruction": prompt,
-        "episode_type": scene,
-        "mode": mode,
-    }
-    payload = {
-        "user": user,
-        "task": "robot_navigation",
-        "job_id": job_id,
-        "data": json.dumps(data)
-    }
-    try:
-        headers = {"Content-Type": "application/json"}
-        response = requests.post(
-            API_ENDPOINTS["submit_task"],
-            json=payload,
-            headers=headers,
-            timeout=200
-        )
-        return response.json()
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
-
-def get_task_status(task_id: str) -> dict:
-    try:
-        response = requests.get(f"{API_ENDPOINTS['query_status']}/{task_id}", timeout=5)
-        try:
-            return response.json()
-        except json.JSONDecodeError:
-            return {"status": "error", "message": response.text}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
-
-def get_task_result(task_id: str) -> Optional[dict]:
-    try:
-        response = requests.get(
-            f"{API_ENDPOINTS['get_result']}/{task_id}",
-            timeout=5
-        )
-        return response.json()
-    except Exception as e:
-        return None
+# backend_api.py
+# 后端API交互相关
+import os
+import time
+import random
+import requests
+import uuid
+import json
+from typing import Optional
+from metrics import counter, histogram
+from circuit_breaker import CircuitOpenError
+from backend_pool import BACKEND_POOL, Backend
+from job_registry import JOB_REGISTRY
+
+BACKEND_LATENCY = histogram("nav_backend_request_seconds", "Latency of backend API calls", ("endpoint",))
+BACKEND_ERRORS = counter("nav_backend_request_errors_total", "Backend API calls that raised or returned an error", ("endpoint",))
+
+BACKEND_RETRIES = counter("nav_backend_submit_retries_total", "Submissions retried with the same job_id")
+
+# 提交失败（连接失败、5xx）时的重试次数和退避上限(秒)
+SUBMIT_RETRIES = int(os.getenv("SUBMIT_RETRIES", "3"))
+SUBMIT_BACKOFF_BASE = 1.0
+SUBMIT_BACKOFF_CAP = 10.0
+
+def submit_to_backend(scene: str, prompt: str, mode: str, model_type: str, user: str = "Gradio-user",
+                      job_id: Optional[str] = None) -> dict:
+    job_id = job_id or str(uuid.uuid4())
+    data = {
+        "model_type": model_type,
+        "instruction": prompt,
+        "episode_type": scene,
+        "mode": mode,
+    }
+    payload = {
+        "user": user,
+        "task": "robot_navigation",
+        "job_id": job_id,
+        "data": json.dumps(data)
+    }
+    # job_id 是幂等键：同一 job_id 已提交成功或正在提交时不会再发起新的后端任务
+    return JOB_REGISTRY.submit(job_id, lambda: _route_submission(payload, scene))
+
+def _backoff(attempt: int) -> float:
+    """full jitter 指数退避"""
+    return random.uniform(0, min(SUBMIT_BACKOFF_CAP, SUBMIT_BACKOFF_BASE * 2 ** attempt))
+
+def _route_submission(payload: dict, scene: str) -> dict:
+    """选择后端提交，成功后记录 task_id 所在的后端。
+    连接失败或熔断时请求没有到达后端，换一个还没试过的后端重试；
+    5xx 时后端可能已经收到请求，只在同一个后端上用同一个 job_id 重试，由后端按 job_id 去重"""
+    backend = BACKEND_POOL.choose(scene)
+    tried = {backend.url}
+    error = None
+    for attempt in range(SUBMIT_RETRIES + 1):
+        if attempt:
+            BACKEND_RETRIES.inc()
+            time.sleep(_backoff(attempt - 1))
+        try:
+            result = _post_submission(backend, payload)
+        except (requests.ConnectionError, CircuitOpenError) as e:
+            error = e
+            other = BACKEND_POOL.choose(scene, exclude=tuple(tried))
+            if other is None:
+                if isinstance(e, CircuitOpenError):
+                    return {"status": "error", "message": str(e)}
+                continue
+            backend = other
+            tried.add(backend.url)
+            continue
+        except requests.HTTPError as e:
+            error = e
+            continue
+        if result.get("status") == "pending" and result.get("task_id"):
+            BACKEND_POOL.assign(result["task_id"], backend, scene)
+        return result
+    # 只有后端明确表示忙（503）才算过载；连接失败、熔断等不应压低准入容量
+    overloaded = isinstance(error, requests.HTTPError) and error.response is not None \
+        and error.response.status_code == 503
+    return {"status": "error", "message": f"{error} (after {SUBMIT_RETRIES + 1} attempts)", "overloaded": overloaded}
+
+def _post_submission(backend: Backend, payload: dict) -> dict:
+    """提交一次。连接失败（ConnectTimeout 属于 ConnectionError）、熔断和 5xx 抛出异常由调用方重试；
+    读超时不重试：后端可能已经收到请求并在运行，重发只能依赖后端按 job_id 去重，而且每次都要再等满读超时。
+    读超时和 429 说明后端过载，返回的错误带 "overloaded": True，供准入控制降低容量"""
+    headers = {"Content-Type": "application/json"}
+    try:
+        with BACKEND_LATENCY.labels("submit").time():
+            response = backend.breaker.call(
+                "submit",
+                requests.post,
+                backend.endpoint("submit_task"),
+                json=payload,
+                headers=headers,
+                # 连接超时单独设短，后端不可达时尽快换后端重试
+                timeout=(5, 200)
+            )
+    except CircuitOpenError:
+        raise
+    except requests.ConnectionError:
+        BACKEND_ERRORS.labels("submit").inc()
+        raise
+    except requests.Timeout as e:
+        BACKEND_ERRORS.labels("submit").inc()
+        return {"status": "error", "message": str(e), "overloaded": True}
+    except Exception as e:
+        BACKEND_ERRORS.labels("submit").inc()
+        return {"status": "error", "message": str(e)}
+    if response.status_code >= 500:
+        BACKEND_ERRORS.labels("submit").inc()
+        raise requests.HTTPError(f"HTTP {response.status_code}: {response.text[:200]}", response=response)
+    if response.status_code == 429:
+        BACKEND_ERRORS.labels("submit").inc()
+        return {"status": "error", "message": f"HTTP 429: {response.text[:200]}", "overloaded": True}
+    try:
+        return response.json()
+    except Exception as e:
+        BACKEND_ERRORS.labels("submit").inc()
+        return {"status": "error", "message": str(e)}
+
+def get_task_status(task_id: str) -> dict:
+    backend = BACKEND_POOL.backend_for(task_id)
+    try:
+        with BACKEND_LATENCY.labels("status").time():
+            response = backend.breaker.call("status", requests.get, f"{backend.endpoint('query_status')}/{task_id}", timeout=5)
+        try:
+            status = response.json()
+            BACKEND_POOL.observe_status(task_id, status.get("status"))
+            return status
+        except json.JSONDecodeError:
+            BACKEND_ERRORS.labels("status").inc()
+            return {"status": "error", "message": response.text}
+    except CircuitOpenError as e:
+        return {"status": "error", "message": str(e)}
+    except Exception as e:
+        BACKEND_ERRORS.labels("status").inc()
+        return {"status": "error", "message": str(e)}
+
+def get_task_result(task_id: str) -> Optional[dict]:
+    backend = BACKEND_POOL.backend_for(task_id)
+    try:
+        with BACKEND_LATENCY.labels("result").time():
+            response = backend.breaker.call(
+                "result",
+                requests.get,
+                f"{backend.endpoint('get_result')}/{task_id}",
+                timeout=5
+            )
+        return response.json()
+    except CircuitOpenError:
+        return None
+    except Exception as e:
+        BACKEND_ERRORS.labels("result").inc()
+        return None
+
+def terminate_task(task_id: str) -> bool:
+    """请求创建该任务的后端终止任务，返回请求是否成功发出"""
+    backend = BACKEND_POOL.backend_for(task_id)
+    try:
+        with BACKEND_LATENCY.labels("terminate").time():
+            backend.breaker.call("terminate", requests.post, f"{backend.endpoint('terminate')}/{task_id}", timeout=3)
+        BACKEND_POOL.finish(task_id)
+        return True
+    except CircuitOpenError:
+        return False
+    except Exception:
+        BACKEND_ERRORS.labels("terminate").inc()
+        return False
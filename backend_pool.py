@@ -0,0 +1,162 @@
+# backend_pool.py
+# 多后端路由：每个后端有自己的熔断器和探活，新任务按进行中任务数最少(least_loaded)分配，
+# 或优先分配给最近跑过同一场景、场景已加载的后端(scene_affinity)，只要它不比最空闲的后端忙太多。
+# 记录 task_id -> 后端，状态查询、取结果和终止都发往创建该任务的后端；
+# 归属同时写入共享状态存储，其他前端进程（如会话清理落在另一个进程时）也能找到任务所在的后端。
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import (BACKEND_URLS, API_PATHS, BACKEND_HEALTH_PATH, BACKEND_ROUTING, BACKEND_AFFINITY_SLACK,
+                    BACKEND_BREAKER_FAILURES, BACKEND_BREAKER_RESET)
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN
+from metrics import counter, gauge
+from state_store import DURABLE_STORE
+
+# 每个后端记住最近跑过的几个场景
+AFFINITY_SCENES = 3
+# 最多记录多少个 task_id 的归属，已结束的任务超出后按时间淘汰
+MAX_TASK_ROUTES = 10000
+# 进行中的任务超过这么久(秒)没有结束也不再计入负载
+TASK_ROUTE_TTL = 3600
+# 后台检查超时任务的间隔(秒)
+ROUTE_EXPIRE_INTERVAL = 60
+
+TERMINAL_STATUSES = {"completed", "failed", "terminated"}
+
+ROUTED_TASKS = counter("nav_backend_routed_tasks_total", "Tasks routed to each backend", ("backend", "affinity"))
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url
+        self.breaker = CircuitBreaker(url, BACKEND_BREAKER_FAILURES, BACKEND_BREAKER_RESET)
+        self.outstanding = 0
+        self.recent_scenes = OrderedDict()
+
+    def endpoint(self, name: str) -> str:
+        return f"{self.url}{API_PATHS[name]}"
+
+    @property
+    def available(self) -> bool:
+        return not self.breaker.is_open()
+
+    def add_scene(self, scene: str):
+        self.recent_scenes[scene] = True
+        self.recent_scenes.move_to_end(scene)
+        while len(self.recent_scenes) > AFFINITY_SCENES:
+            self.recent_scenes.popitem(last=False)
+
+
+class BackendPool:
+    def __init__(self, urls: list, routing: str = BACKEND_ROUTING, affinity_slack: int = BACKEND_AFFINITY_SLACK):
+        self.backends = [Backend(url) for url in urls]
+        self.routing = routing
+        self.affinity_slack = affinity_slack
+        self._lock = threading.Lock()
+        # task_id -> [后端, 开始时间, 是否已结束]
+        self._routes = OrderedDict()
+        for backend in self.backends:
+            gauge("nav_backend_outstanding_tasks", "Unfinished tasks per backend", ("backend",)) \
+                .labels(backend.url).set_function(lambda b=backend: b.outstanding)
+
+    def start(self):
+        """启动各后端的探活线程和超时任务的清理线程，由 main 显式调用（导入本模块的压测脚本不启动）"""
+        for backend in self.backends:
+            backend.breaker.start_probe(f"{backend.url}{BACKEND_HEALTH_PATH}")
+
+        def run():
+            while True:
+                time.sleep(ROUTE_EXPIRE_INTERVAL)
+                with self._lock:
+                    self._expire()
+
+        threading.Thread(target=run, name="backend-route-expire", daemon=True).start()
+
+    def choose(self, scene: str, exclude: tuple = ()) -> Optional[Backend]:
+        """为新任务选择后端；全部熔断时返回最空闲的一个，由熔断器快速失败。
+        exclude 为本次提交已经连不上的后端，排除后没有可用的后端时返回 None"""
+        with self._lock:
+            candidates = [b for b in self.backends if b.available and b.url not in exclude]
+            if not candidates:
+                if exclude:
+                    return None
+                candidates = self.backends
+            best = min(candidates, key=lambda b: b.outstanding)
+            if self.routing == "scene_affinity":
+                warm = [b for b in candidates if scene in b.recent_scenes]
+                if warm:
+                    best_warm = min(warm, key=lambda b: b.outstanding)
+                    if best_warm.outstanding <= best.outstanding + self.affinity_slack:
+                        return best_warm
+            return best
+
+    def assign(self, task_id: str, backend: Backend, scene: str):
+        """任务提交成功后记录归属并计入负载"""
+        with self._lock:
+            if task_id in self._routes:
+                return
+            ROUTED_TASKS.labels(backend.url, "yes" if scene in backend.recent_scenes else "no").inc()
+            backend.outstanding += 1
+            backend.add_scene(scene)
+            self._routes[task_id] = [backend, time.monotonic(), False]
+            DURABLE_STORE.set("task_backend", task_id, backend.url, ttl=TASK_ROUTE_TTL)
+            while len(self._routes) > MAX_TASK_ROUTES:
+                _, (old, _, finished) = self._routes.popitem(last=False)
+                if not finished:
+                    old.outstanding -= 1
+
+    def backend_for(self, task_id: str) -> Backend:
+        """任务所在的后端；本进程没有记录时查共享存储，仍没有（如重启前提交的任务）时用第一个后端"""
+        route = self._routes.get(task_id)
+        if route is not None:
+            return route[0]
+        url = DURABLE_STORE.get("task_backend", task_id)
+        return next((b for b in self.backends if b.url == url), self.backends[0])
+
+    def observe_status(self, task_id: str, status: str):
+        if status in TERMINAL_STATUSES:
+            self.finish(task_id)
+
+    def finish(self, task_id: str):
+        with self._lock:
+            route = self._routes.get(task_id)
+            if route is not None and not route[2]:
+                route[2] = True
+                route[0].outstanding -= 1
+
+    def _expire(self):
+        now = time.monotonic()
+        for route in self._routes.values():
+            if not route[2] and now - route[1] > TASK_ROUTE_TTL:
+                route[2] = True
+                route[0].outstanding -= 1
+
+    def unavailable(self) -> bool:
+        """所有后端都处于熔断中"""
+        return all(not b.available for b in self.backends)
+
+    def describe(self) -> str:
+        if len(self.backends) == 1:
+            return self.backends[0].breaker.describe()
+        down = [b for b in self.backends if not b.available]
+        return f"{len(down)}/{len(self.backends)} backends unavailable"
+
+
+def format_pool_status(pool: BackendPool) -> str:
+    troubled = [b for b in pool.backends if b.breaker.state != CLOSED]
+    if not troubled:
+        return ""
+    icon = lambda b: "🔴" if b.breaker.state == OPEN else "🟡"
+    if len(pool.backends) == 1:
+        b = troubled[0]
+        return f"{icon(b)} {b.breaker.describe()}. New simulations are paused until the backend responds."
+    if pool.unavailable():
+        header = "🔴 All backends are unavailable, new simulations are paused until one responds."
+    else:
+        header = f"🟡 {len(pool.backends) - len(troubled)}/{len(pool.backends)} backends healthy."
+    return "\n".join([header] + [f"- {icon(b)} `{b.url}`: {b.breaker.describe()}" for b in troubled])
+
+
+BACKEND_POOL = BackendPool(BACKEND_URLS)
@@ -0,0 +1,90 @@
+# benchmarks/bench_read_logs.py
+# read_logs 基准测试：生成数百万行的 access/submission 日志，对比全量读取排序与倒序块读取+堆归并
+#
+# 用法: python benchmarks/bench_read_logs.py --lines 2000000 --repeat 5
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import logging_utils
+
+
+def generate_logs(directory: str, lines: int):
+    access_path = os.path.join(directory, "access.log")
+    submission_path = os.path.join(directory, "submissions.log")
+    start = datetime(2025, 1, 1)
+    with open(access_path, "w") as fa, open(submission_path, "w") as fs:
+        for i in range(lines):
+            ts = (start + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S")
+            fa.write(json.dumps({
+                "timestamp": ts,
+                "type": "access",
+                "user_ip": f"10.0.{i % 256}.{i % 97}",
+                "user_agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+            }) + "\n")
+            fs.write(json.dumps({
+                "timestamp": ts,
+                "type": "submission",
+                "user": f"10.0.{i % 256}.{i % 97}",
+                "scene": f"demo{i % 5 + 1}",
+                "prompt": "Walk past the left side of the bed and stop in the doorway.",
+                "model": "rdp" if i % 2 else "cma",
+                "res": "success"
+            }) + "\n")
+    return access_path, submission_path
+
+
+def read_logs_full_scan(access_path: str, submission_path: str, max_entries: int = 50) -> list:
+    # 旧实现：逐行解析两个文件后整体排序
+    logs = []
+    for path in (access_path, submission_path):
+        with open(path, "r") as f:
+            for line in f:
+                logs.append(json.loads(line.strip()))
+    logs.sort(key=lambda x: x["timestamp"], reverse=True)
+    return logs[:max_entries]
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark read_logs on large log files")
+    parser.add_argument("--lines", type=int, default=2_000_000, help="lines per log file")
+    parser.add_argument("--max-entries", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-full-scan", action="store_true", help="only time the tail reader")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"generating 2 x {args.lines} log lines in {tmp} ...")
+        access_path, submission_path = generate_logs(tmp, args.lines)
+        size_mb = (os.path.getsize(access_path) + os.path.getsize(submission_path)) / 1e6
+        logging_utils.ACCESS_LOG = access_path
+        logging_utils.SUBMISSION_LOG = submission_path
+
+        tail = timeit(lambda: logging_utils.read_logs("all", args.max_entries), args.repeat)
+        print(f"log size: {size_mb:.1f} MB")
+        print(f"tail read + heap merge : {tail * 1000:10.2f} ms")
+        if not args.skip_full_scan:
+            expected = read_logs_full_scan(access_path, submission_path, args.max_entries)
+            got = logging_utils.read_logs("all", args.max_entries)
+            assert [e["timestamp"] for e in got] == [e["timestamp"] for e in expected]
+            full = timeit(lambda: read_logs_full_scan(access_path, submission_path, args.max_entries), 1)
+            print(f"full scan + sort       : {full * 1000:10.2f} ms")
+            print(f"speedup                : {full / tail:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmarks/bench_video_pipeline.py
+# 帧到视频流水线的微基准：结果目录扫描、cv2.imread (PNG/JPEG)、create_video_segment (按分段帧数)、
+# convert_to_h264 (按 x264 preset)，在几种分辨率的合成帧上分别计时。
+# 结果存为 JSON；指定 --baseline 时与之前保存的结果逐项对比，变慢超过阈值则以非零状态退出，
+# 可在部署前检查编码或 I/O 是否退化。
+#
+# 用法: python benchmarks/bench_video_pipeline.py --output bench.json
+#       python benchmarks/bench_video_pipeline.py --baseline bench.json --threshold 0.2
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import simulation
+from stub_backend import synthetic_frame
+
+RESOLUTIONS = ["320x240", "640x480", "1280x720"]
+SEGMENT_SIZES = [6, 12, 24, 48]
+PRESETS = ["ultrafast", "veryfast", "medium", "slow"]
+
+
+def timeit(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_dir_scan(tmp: str, files: int, repeat: int) -> dict:
+    folder = os.path.join(tmp, "scan")
+    os.makedirs(folder)
+    for i in range(files):
+        open(os.path.join(folder, f"{i:05d}.png"), "wb").close()
+    seconds = timeit(lambda: simulation.list_frame_files(folder), repeat)
+    return {f"dir_scan/{files}": {"seconds": seconds, "items": files}}
+
+
+def bench_imread(tmp: str, frames: dict, count: int, repeat: int) -> dict:
+    results = {}
+    for resolution, images in frames.items():
+        for ext in ("png", "jpg"):
+            folder = os.path.join(tmp, f"imread-{resolution}-{ext}")
+            os.makedirs(folder)
+            paths = []
+            for i in range(count):
+                path = os.path.join(folder, f"{i:05d}.{ext}")
+                cv2.imwrite(path, images[i % len(images)])
+                paths.append(path)
+            seconds = timeit(lambda: [cv2.imread(p) for p in paths], repeat)
+            size = sum(os.path.getsize(p) for p in paths)
+            results[f"imread/{ext}/{resolution}"] = {"seconds": seconds, "items": count, "bytes": size}
+    return results
+
+
+def bench_segments(frames: dict, repeat: int) -> dict:
+    results = {}
+    for resolution, images in frames.items():
+        height, width = images[0].shape[:2]
+        for size in SEGMENT_SIZES:
+            segment = [images[i % len(images)] for i in range(size)]
+            seconds = timeit(lambda: simulation.create_video_segment(segment, 6, width, height), repeat)
+            results[f"segment/{size}/{resolution}"] = {"seconds": seconds, "items": size}
+    return results
+
+
+def bench_h264(tmp: str, frames: dict, episode_frames: int, repeat: int) -> dict:
+    if shutil.which("ffmpeg") is None and not os.path.exists("/root/anaconda3/envs/gradio/bin/ffmpeg"):
+        print("ffmpeg not found, skipping convert_to_h264")
+        return {}
+    results = {}
+    for resolution, images in frames.items():
+        height, width = images[0].shape[:2]
+        source = simulation.create_video_segment(
+            [images[i % len(images)] for i in range(episode_frames)], 6, width, height)
+        for preset in PRESETS:
+            runs = []
+            for i in range(repeat):
+                # 每次转码用一份新的输入，避免 ffmpeg 遇到已存在的输出文件
+                copy = os.path.join(tmp, f"h264-{resolution}-{preset}-{i}.mp4")
+                shutil.copy(source, copy)
+                start = time.perf_counter()
+                output = simulation.convert_to_h264(copy, preset=preset)
+                runs.append(time.perf_counter() - start)
+            results[f"h264/{preset}/{resolution}"] = {
+                "seconds": min(runs), "items": episode_frames, "bytes": os.path.getsize(output)}
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """返回变慢超过 threshold 的项 [(名称, 基线每项耗时, 当前每项耗时)]，同时打印逐项对比"""
+    regressions = []
+    print(f"\n{'benchmark':<28} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(results) & set(baseline)):
+        old = baseline[name]["seconds"] / baseline[name]["items"]
+        new = results[name]["seconds"] / results[name]["items"]
+        change = new / old - 1 if old else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:<28} {old * 1000:10.3f}ms {new * 1000:10.3f}ms {change * 100:+7.1f}%{flag}")
+        if flag:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the frame-to-video pipeline in simulation.py")
+    parser.add_argument("--resolutions", nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--scan-files", type=int, default=10_000)
+    parser.add_argument("--imread-frames", type=int, default=60)
+    parser.add_argument("--episode-frames", type=int, default=120, help="frames in the video passed to ffmpeg")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-h264", action="store_true")
+    parser.add_argument("--output", help="save results as JSON")
+    parser.add_argument("--baseline", help="JSON saved by a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown per item, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        simulation.VIDEO_CHUNK_DIR = os.path.join(tmp, "video_chunk")
+        frames = {}
+        for resolution in args.resolutions:
+            width, height = (int(v) for v in resolution.split("x"))
+            frames[resolution] = [synthetic_frame(i, width, height) for i in range(12)]
+
+        results = {}
+        results.update(bench_dir_scan(tmp, args.scan_files, args.repeat))
+        results.update(bench_imread(tmp, frames, args.imread_frames, args.repeat))
+        results.update(bench_segments(frames, args.repeat))
+        if not args.skip_h264:
+            results.update(bench_h264(tmp, frames, args.episode_frames, args.repeat))
+
+    for name, r in results.items():
+        rate = r["items"] / r["seconds"] if r["seconds"] else float("inf")
+        print(f"{name:<28} {r['seconds'] * 1000:10.2f} ms  {rate:10.1f} items/s")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold * 100:.0f}%")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
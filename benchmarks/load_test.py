@@ -0,0 +1,136 @@
+# benchmarks/load_test.py
+# 端到端压测：用 N 个并发客户端通过 Gradio API 调用 run_simulation，
+# 统计吞吐、首段视频时间(time-to-first-segment)和完成时间的分位数。
+#
+# 先启动模拟后端和前端（前端的 IP 限流需要放开，否则同一台压测机很快被拦）:
+#   python benchmarks/stub_backend.py --port 8000
+#   BACKEND_URL=http://localhost:8000 IP_LIMIT=100000 python main.py
+# 用法: python benchmarks/load_test.py --url http://localhost:55005 --clients 16 --requests 64
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+
+from gradio_client import Client
+
+SCENES = ["demo1", "demo2", "demo3", "demo4", "demo5"]
+MODELS = ["rdp", "cma"]
+MODES = ["vlnPE", "vlnCE"]
+PROMPT = "Walk past the left side of the bed and stop in the doorway."
+
+
+def percentile(values: list, q: float):
+    """最近秩法分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def run_request(client: Client, scene: str, model: str, mode: str, prompt: str) -> dict:
+    """发起一次 run_simulation，返回 {ok, first_segment, total, error}"""
+    start = time.monotonic()
+    first_segment = None
+    try:
+        job = client.submit(scene, model, mode, prompt, api_name="/run_simulation")
+        for output in job:
+            video = output[0] if isinstance(output, (list, tuple)) else output
+            if first_segment is None and video:
+                first_segment = time.monotonic() - start
+        job.result()
+        return {"ok": True, "first_segment": first_segment, "total": time.monotonic() - start, "error": None}
+    except Exception as e:
+        return {"ok": False, "first_segment": first_segment, "total": time.monotonic() - start,
+                "error": str(e).splitlines()[0][:120] if str(e) else type(e).__name__}
+
+
+class LoadReport:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.results = []
+        self.started = time.monotonic()
+
+    def add(self, result: dict):
+        with self._lock:
+            self.results.append(result)
+
+    def summary(self) -> dict:
+        with self._lock:
+            results = list(self.results)
+        elapsed = time.monotonic() - self.started
+        ok = [r for r in results if r["ok"]]
+        first = [r["first_segment"] for r in results if r["first_segment"] is not None]
+        total = [r["total"] for r in ok]
+        stats = lambda values: {f"p{q}": _round(percentile(values, q)) for q in (50, 90, 99)}
+        return {
+            "requests": len(results),
+            "succeeded": len(ok),
+            "failed": len(results) - len(ok),
+            "elapsed_seconds": round(elapsed, 1),
+            "throughput_per_minute": round(len(ok) / elapsed * 60, 2) if elapsed else 0,
+            "time_to_first_segment": stats(first),
+            "completion_seconds": stats(total),
+            "errors": dict(Counter(r["error"] for r in results if r["error"]).most_common(10)),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def print_summary(summary: dict):
+    print(f"requests   : {summary['requests']} ({summary['succeeded']} ok, {summary['failed']} failed) "
+          f"in {summary['elapsed_seconds']}s")
+    print(f"throughput : {summary['throughput_per_minute']} completed/min")
+    for name in ("time_to_first_segment", "completion_seconds"):
+        values = "  ".join(f"{q}={v}s" for q, v in summary[name].items())
+        print(f"{name:<22}: {values}")
+    for error, count in summary["errors"].items():
+        print(f"  {count:5d} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive run_simulation with concurrent clients")
+    parser.add_argument("--url", default="http://localhost:55005")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent sessions")
+    parser.add_argument("--requests", type=int, default=32, help="total requests across all clients")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between requests of one client")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    # 预先生成请求序列，同一个 seed 每次压测的请求组合相同
+    plan = [(rng.choice(SCENES), rng.choice(MODELS), rng.choice(MODES), PROMPT) for _ in range(args.requests)]
+    plan_lock = threading.Lock()
+    report = LoadReport()
+
+    def client_loop():
+        # 每个线程一个 Client，对应前端的一个独立 session
+        client = Client(args.url, verbose=False)
+        while True:
+            with plan_lock:
+                if not plan:
+                    return
+                request = plan.pop()
+            report.add(run_request(client, *request))
+            if args.think_time:
+                time.sleep(args.think_time)
+
+    threads = [threading.Thread(target=client_loop, daemon=True) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = report.summary()
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
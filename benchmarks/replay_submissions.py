@@ -0,0 +1,157 @@
+# benchmarks/replay_submissions.py
+# 按提交日志（含已轮转的归档段）重放真实流量：同样的场景/模型/模式/指令、同样的用户分组和到达间隔，
+# 可按原速、加速(--speed)或放大(--scale)重放到模拟后端或预发环境，统计前端的延迟和错误率。
+# 与 load_test.py 的均匀合成负载相比，能复现同一指令被连续提交、多人同时到达之类的突发。
+#
+# 用法: python benchmarks/replay_submissions.py --url http://localhost:55005 --speed 60 --max-gap 30
+#       python benchmarks/replay_submissions.py --start "2025-07-21 00:00:00" --end "2025-07-22 00:00:00" --scale 10
+# 前端需以较大的 IP_LIMIT 启动，否则重放的请求都来自同一 IP 会被限流。
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+from gradio_client import Client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import log_archive
+from config import SCENE_CONFIGS, MODEL_CHOICES, MODE_CHOICES
+from load_test import LoadReport, percentile, print_summary, run_request
+
+DEFAULT_LOG = "/opt/nav-fronted/logs/submissions.log"
+
+
+def normalize(entry: dict):
+    """把历史记录转成当前前端接受的参数，无法映射的返回 None。早期日志的场景名是 scene_N"""
+    scene = entry.get("scene", "")
+    if scene.startswith("scene_"):
+        scene = "demo" + scene[len("scene_"):]
+    model = (entry.get("model") or "").lower()
+    mode = entry.get("mode") or MODE_CHOICES[0]
+    if scene not in SCENE_CONFIGS or model not in MODEL_CHOICES or mode not in MODE_CHOICES:
+        return None
+    prompt = entry.get("prompt") or SCENE_CONFIGS[scene]["default_instruction"]
+    return scene, model, mode, prompt
+
+
+def build_schedule(entries: list, speed: float, scale: int, max_gap: float, jitter: float, rng) -> list:
+    """返回按发送时间排序的 [(相对开始的秒数, 会话 key, 请求参数, 原始结果)]"""
+    schedule = []
+    offset, previous = 0.0, None
+    for entry in entries:
+        ts = datetime.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S")
+        if previous is not None:
+            gap = (ts - previous).total_seconds()
+            offset += min(gap, max_gap) if max_gap else gap
+        previous = ts
+        for copy in range(scale):
+            # 放大时每份副本当作不同的用户，并在 jitter 内错开
+            at = offset / speed + (rng.uniform(0, jitter) if copy else 0.0)
+            schedule.append((at, f"{entry.get('user', 'unknown')}#{copy}", entry["request"], entry.get("res")))
+    schedule.sort(key=lambda x: x[0])
+    return schedule
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded submissions against a frontend")
+    parser.add_argument("--url", default="http://localhost:55005")
+    parser.add_argument("--log", default=DEFAULT_LOG)
+    parser.add_argument("--start", help='e.g. "2025-07-21 00:00:00"')
+    parser.add_argument("--end", help='e.g. "2025-07-28 00:00:00"')
+    parser.add_argument("--speed", type=float, default=1.0, help="time compression, 10 = ten times faster")
+    parser.add_argument("--scale", type=int, default=1, help="issue each recorded request this many times")
+    parser.add_argument("--max-gap", type=float, default=0.0, help="cap idle gaps (recorded seconds), 0 = keep")
+    parser.add_argument("--jitter", type=float, default=1.0, help="spread of scaled copies, seconds")
+    parser.add_argument("--max-in-flight", type=int, default=64)
+    parser.add_argument("--limit", type=int, help="replay at most this many recorded submissions")
+    parser.add_argument("--include-rejected", action="store_true", help="also replay rate-limited submissions")
+    parser.add_argument("--output", help="write the summary as JSON to this file")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    entries, skipped = [], 0
+    for entry in log_archive.iter_range(args.log, args.start, args.end):
+        if entry.get("type", "submission") != "submission":
+            continue
+        if entry.get("res") == "IP blocked temporarily" and not args.include_rejected:
+            continue
+        request = normalize(entry)
+        if request is None:
+            skipped += 1
+            continue
+        entries.append({**entry, "request": request})
+        if args.limit and len(entries) >= args.limit:
+            break
+    if not entries:
+        print("no submissions to replay")
+        return
+    schedule = build_schedule(entries, args.speed, args.scale, args.max_gap, args.jitter, random.Random(args.seed))
+    print(f"replaying {len(schedule)} requests ({len(entries)} recorded, {skipped} skipped) "
+          f"over {schedule[-1][0]:.0f}s")
+
+    clients, clients_lock = {}, threading.Lock()
+    in_flight = threading.Semaphore(args.max_in_flight)
+    report = LoadReport()
+    lags = []
+    by_scene = defaultdict(Counter)
+    recorded = Counter()
+
+    def client_for(session: str) -> Client:
+        # 原日志里的每个用户对应一个独立的 Gradio session
+        with clients_lock:
+            client = clients.get(session)
+        if client is None:
+            client = Client(args.url, verbose=False)
+            with clients_lock:
+                client = clients.setdefault(session, client)
+        return client
+
+    def fire(session, request):
+        try:
+            result = run_request(client_for(session), *request)
+        except Exception as e:
+            result = {"ok": False, "first_segment": None, "total": 0.0, "error": str(e)[:120]}
+        finally:
+            in_flight.release()
+        report.add(result)
+        with clients_lock:
+            by_scene[request[0]]["ok" if result["ok"] else "failed"] += 1
+
+    threads = []
+    started = time.monotonic()
+    for at, session, request, res in schedule:
+        delay = started + at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        in_flight.acquire()
+        # 实际发出时间比计划晚多少，说明压测端自身是否跟得上
+        lags.append(time.monotonic() - started - at)
+        recorded["success" if res == "success" else "failed"] += 1
+        thread = threading.Thread(target=fire, args=(session, request), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    summary = report.summary()
+    summary["dispatch_lag_p99"] = round(percentile(lags, 99), 2)
+    summary["recorded_success_rate"] = round(recorded["success"] / sum(recorded.values()), 3)
+    summary["by_scene"] = {scene: dict(counts) for scene, counts in sorted(by_scene.items())}
+    print_summary(summary)
+    print(f"dispatch lag p99 : {summary['dispatch_lag_p99']}s")
+    print(f"success rate     : {summary['succeeded'] / max(1, summary['requests']):.3f} "
+          f"(recorded {summary['recorded_success_rate']})")
+    for scene, counts in summary["by_scene"].items():
+        print(f"  {scene}: {counts.get('ok', 0)} ok, {counts.get('failed', 0)} failed")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
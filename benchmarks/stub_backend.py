@@ -0,0 +1,196 @@
+# benchmarks/stub_backend.py
+# 本地模拟后端：实现 /predict/video、/predict/task/{id}、/predict/terminate/{id}，
+# 按设定的速率往结果目录里写合成帧，可模拟接口延迟、提交失败、任务中途失败和卡死，
+# 用于在没有 GPU 后端的机器上对 main.py 做端到端压测。
+#
+# 用法: python benchmarks/stub_backend.py --port 8000 --frame-rate 6 --frames 120 --max-running 4
+#       BACKEND_URL=http://localhost:8000 IP_LIMIT=100000 python main.py
+import os
+import time
+import uuid
+import random
+import argparse
+import threading
+
+import cv2
+import numpy as np
+import uvicorn
+from fastapi import FastAPI
+
+# 结果目录需要在 main.py 的 allowed_paths (/opt) 之下，前端才能返回最终视频
+DEFAULT_ROOT = "/opt/nav-stub-backend/results"
+
+
+class StubTask:
+    def __init__(self, task_id: str, job_id: str, result_folder: str, frames: int):
+        self.task_id = task_id
+        self.job_id = job_id
+        self.result_folder = result_folder
+        self.frames = frames
+        self.status = "pending"
+        self.result = result_folder
+        self.written = 0
+        self.terminate = threading.Event()
+
+
+class StubBackend:
+    def __init__(self, args):
+        self.args = args
+        self.tasks = {}
+        # job_id -> task_id，同一 job_id 的重复提交返回同一个任务
+        self.jobs = {}
+        self._lock = threading.Lock()
+        # 同时运行的任务数上限，超出的任务保持 pending，模拟 GPU 排队
+        self._slots = threading.Semaphore(args.max_running) if args.max_running > 0 else None
+
+    def submit(self, payload: dict) -> dict:
+        time.sleep(self.args.submit_latency)
+        if random.random() < self.args.submit_error_rate:
+            return {"status": "error", "message": "stub: injected submission failure"}
+        job_id = payload.get("job_id", "")
+        with self._lock:
+            if job_id and job_id in self.jobs:
+                return {"status": "pending", "task_id": self.jobs[job_id]}
+        task_id = uuid.uuid4().hex
+        result_folder = os.path.join(self.args.root, task_id)
+        os.makedirs(os.path.join(result_folder, "images"), exist_ok=True)
+        task = StubTask(task_id, payload.get("job_id", ""), result_folder, self.args.frames)
+        with self._lock:
+            if job_id and job_id in self.jobs:
+                return {"status": "pending", "task_id": self.jobs[job_id]}
+            self.tasks[task_id] = task
+            if job_id:
+                self.jobs[job_id] = task_id
+        threading.Thread(target=self._simulate, args=(task,), name=f"stub-{task_id[:8]}", daemon=True).start()
+        return {"status": "pending", "task_id": task_id}
+
+    def status(self, task_id: str) -> dict:
+        time.sleep(self.args.status_latency)
+        task = self.tasks.get(task_id)
+        if task is None:
+            return {"status": "error", "message": f"unknown task {task_id}"}
+        return {"status": task.status, "result": task.result}
+
+    def terminate(self, task_id: str) -> dict:
+        task = self.tasks.get(task_id)
+        if task is None:
+            return {"status": "error", "message": f"unknown task {task_id}"}
+        task.terminate.set()
+        return {"status": "success", "task_id": task_id}
+
+    def _simulate(self, task: StubTask):
+        if self._slots is not None:
+            while not self._slots.acquire(timeout=0.5):
+                if task.terminate.is_set():
+                    task.status = "terminated"
+                    return
+        try:
+            task.status = "running"
+            fail_at = random.randint(1, task.frames) if random.random() < self.args.failure_rate else None
+            hang_at = random.randint(1, task.frames) if random.random() < self.args.hang_rate else None
+            frames = []
+            for i in range(task.frames):
+                if task.terminate.wait(1.0 / self.args.frame_rate):
+                    task.status = "terminated"
+                    return
+                if i == fail_at:
+                    task.status = "failed"
+                    task.result = "stub: injected episode failure"
+                    return
+                if i == hang_at:
+                    # 卡死：不再产生新帧也不结束，直到被终止
+                    task.terminate.wait()
+                    task.status = "terminated"
+                    return
+                frame = synthetic_frame(i, self.args.width, self.args.height)
+                path = os.path.join(task.result_folder, "images", f"{i:05d}.{self.args.image_format}")
+                cv2.imwrite(path + ".tmp", frame, [cv2.IMWRITE_PNG_COMPRESSION, 1]
+                            if self.args.image_format == "png" else [cv2.IMWRITE_JPEG_QUALITY, 90])
+                # 先写临时文件再改名，前端不会读到写了一半的帧
+                os.replace(path + ".tmp", path)
+                frames.append(frame)
+                task.written += 1
+            write_video(os.path.join(task.result_folder, "output.mp4"), frames, self.args.frame_rate)
+            task.status = "completed"
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+def synthetic_frame(index: int, width: int, height: int) -> np.ndarray:
+    """渐变背景上一个移动的方块，保证相邻帧不同，编码器不会把它压成静止画面"""
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = x[None, :, None]
+    frame[..., 1] = (index * 7) % 256
+    size = max(8, height // 8)
+    left = (index * 9) % max(1, width - size)
+    top = (index * 5) % max(1, height - size)
+    frame[top:top + size, left:left + size] = (0, 0, 255)
+    cv2.putText(frame, f"{index:05d}", (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+    return frame
+
+
+def write_video(path: str, frames: list, fps: float):
+    if not frames:
+        return
+    height, width = frames[0].shape[:2]
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for frame in frames:
+        out.write(frame)
+    out.release()
+
+
+def create_app(args) -> FastAPI:
+    backend = StubBackend(args)
+    app = FastAPI()
+
+    # 与真实后端一样是同步接口，由线程池执行，注入的延迟不会阻塞事件循环
+    @app.post("/predict/video")
+    def predict_video(payload: dict):
+        return backend.submit(payload)
+
+    @app.get("/predict/task/{task_id}")
+    def task_status(task_id: str):
+        return backend.status(task_id)
+
+    @app.post("/predict/terminate/{task_id}")
+    def terminate(task_id: str):
+        return backend.terminate(task_id)
+
+    @app.get("/stub/stats")
+    def stub_stats():
+        counts = {}
+        for task in list(backend.tasks.values()):
+            counts[task.status] = counts.get(task.status, 0) + 1
+        return {"tasks": len(backend.tasks), "by_status": counts}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub navigation backend for load testing the frontend")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="where result folders are created")
+    parser.add_argument("--frames", type=int, default=120, help="frames per episode")
+    parser.add_argument("--frame-rate", type=float, default=6.0, help="frames written per second per task")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--image-format", choices=["png", "jpg"], default="png")
+    parser.add_argument("--max-running", type=int, default=0, help="concurrent episodes, 0 = unlimited")
+    parser.add_argument("--submit-latency", type=float, default=0.2, help="seconds")
+    parser.add_argument("--status-latency", type=float, default=0.01, help="seconds")
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="episodes failing mid-way")
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="episodes that stop producing frames")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    os.makedirs(args.root, exist_ok=True)
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# broadcast.py
+# 一次运行、多人观看：运行中的任务已把推送过的视频片段记在 INFLIGHT 里，
+# 观看者打开 ?watch=<task_id> 时只读取这些片段（后加入的先收到已有的全部片段），
+# 不再各自解码帧、编码视频。观看者的在线状态放在共享状态存储里，任何进程都能统计每个任务的观看人数。
+# 每个任务的观看者单独一个命名空间，统计人数只读该任务的记录，结果在本进程内缓存几秒供所有观看连接共用。
+import os
+import time
+import uuid
+import asyncio
+import threading
+from typing import AsyncIterator, Optional, Tuple
+
+from inflight import INFLIGHT, InflightTasks
+from metrics import gauge
+from session_registry import CancelScope
+from state_store import STATE_STORE, StateStore
+
+# 观看者检查新片段的间隔(秒)
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "1"))
+# 观看者多久(秒)没有刷新在线状态就不再计入人数
+VIEWER_TTL = 15
+# 观看人数在本进程内缓存多久(秒)
+VIEWER_COUNT_TTL = 5
+
+NAMESPACE = "task_viewers"
+
+# 按任务区分的人数标签没有上限，Prometheus 只导出本进程的观看连接总数
+WATCHERS = gauge("nav_broadcast_watchers", "Open watch-link streams served by this process")
+
+
+class BroadcastHub:
+    def __init__(self, inflight: InflightTasks = INFLIGHT, store: StateStore = STATE_STORE):
+        self.inflight = inflight
+        self.store = store
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    @staticmethod
+    def _namespace(task_id: str) -> str:
+        return f"{NAMESPACE}:{task_id}"
+
+    def viewers(self, task_id: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(task_id)
+            if cached is not None and now - cached[1] < VIEWER_COUNT_TTL:
+                return cached[0]
+        count = self.store.count(self._namespace(task_id))
+        with self._lock:
+            self._counts = {t: c for t, c in self._counts.items() if now - c[1] < VIEWER_COUNT_TTL}
+            self._counts[task_id] = (count, now)
+        return count
+
+    async def watch(self, task_id: str, cancel: Optional[CancelScope] = None,
+                    viewer_id: Optional[str] = None) -> AsyncIterator[Tuple[str, str]]:
+        """依次产出 ("segment", 片段路径)，任务完成时产出 ("done", 最终视频) 后结束；
+        任务失败、被终止或记录已过期时直接结束。
+        异步轮询，等待新片段时不占用线程池，观看人数不受工作线程数限制；存储访问放到线程里执行"""
+        namespace = self._namespace(task_id)
+        key = viewer_id or uuid.uuid4().hex
+        sent = 0
+        WATCHERS.inc()
+        try:
+            while cancel is None or not cancel.cancelled:
+                record = await asyncio.to_thread(self.inflight.get, task_id)
+                if record is None:
+                    return
+                await asyncio.to_thread(self.store.set, namespace, key, True, VIEWER_TTL)
+                for path in record["segments"][sent:]:
+                    sent += 1
+                    if os.path.exists(path):
+                        yield "segment", path
+                if record.get("final_video"):
+                    yield "done", record["final_video"]
+                    return
+                await asyncio.sleep(WATCH_POLL_INTERVAL)
+        finally:
+            WATCHERS.dec()
+            await asyncio.to_thread(self.store.pop, namespace, key)
+
+BROADCAST = BroadcastHub()
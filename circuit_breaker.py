@@ -0,0 +1,120 @@
+# circuit_breaker.py
+# 后端熔断：连续失败（超时、连接错误、5xx）达到阈值后断开，断开期间的调用立即失败，
+# 不再让每个请求都卡满超时；后台探活线程定期访问后端，探活成功或冷却时间到后进入半开状态，
+# 放行一个试探请求，成功则恢复，失败则重新断开。
+import time
+import threading
+
+import requests
+from metrics import counter, gauge
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = gauge("nav_backend_circuit_state", "Backend circuit breaker state (0 closed, 1 half-open, 2 open)",
+                      ("backend",))
+BREAKER_TRANSITIONS = counter("nav_backend_circuit_transitions_total", "Backend circuit breaker state changes",
+                              ("backend", "state"))
+BREAKER_REJECTED = counter("nav_backend_circuit_rejected_total", "Backend calls failed fast while the circuit was open",
+                           ("backend", "endpoint"))
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name: str = "default", failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error = ""
+        self._trial_in_flight = False
+        BREAKER_STATE.labels(name).set(_STATE_VALUES[CLOSED])
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            self.state = state
+            BREAKER_STATE.labels(self.name).set(_STATE_VALUES[state])
+            BREAKER_TRANSITIONS.labels(self.name, state).inc()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def is_open(self) -> bool:
+        """断开且冷却未结束（不消耗半开状态的试探名额）"""
+        return self.state == OPEN and self.retry_after() > 0
+
+    def allow(self) -> bool:
+        """是否放行一次调用；半开状态只放行一个试探请求"""
+        with self._lock:
+            if self.state == OPEN and self.retry_after() <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self, error: str = ""):
+        with self._lock:
+            self.failures += 1
+            self.last_error = error
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def call(self, endpoint: str, fn, *args, **kwargs):
+        """通过熔断器执行 fn；断开时抛 CircuitOpenError。fn 抛异常或返回 5xx 响应都计为失败"""
+        if not self.allow():
+            BREAKER_REJECTED.labels(self.name, endpoint).inc()
+            raise CircuitOpenError(self.describe())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        status_code = getattr(result, "status_code", None)
+        if status_code is not None and status_code >= 500:
+            self.record_failure(f"HTTP {status_code}")
+        else:
+            self.record_success()
+        return result
+
+    def describe(self) -> str:
+        if self.state == CLOSED:
+            return "Backend is available"
+        if self.state == HALF_OPEN or self.retry_after() <= 0:
+            return "Backend is recovering, testing with one request"
+        return (f"Backend is unavailable ({self.last_error or 'repeated failures'}), "
+                f"retrying in {self.retry_after():.0f}s")
+
+    def start_probe(self, url: str, interval: float = 10.0, timeout: float = 2.0):
+        """后台探活：仅在断开时访问 url，收到任何非 5xx 响应就提前进入半开状态"""
+        def run():
+            while True:
+                time.sleep(interval)
+                if self.state != OPEN:
+                    continue
+                try:
+                    ok = requests.get(url, timeout=timeout).status_code < 500
+                except Exception:
+                    ok = False
+                if ok:
+                    with self._lock:
+                        if self.state == OPEN:
+                            self._set_state(HALF_OPEN)
+
+        threading.Thread(target=run, name=f"health-probe-{self.name}", daemon=True).start()
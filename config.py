@@ -1,46 +1,73 @@
-# config.py
-# 配置相关：API、场景等
-import os
-
-BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
-API_ENDPOINTS = {
-    "submit_task": f"{BACKEND_URL}/predict/video",
-    "query_status": f"{BACKEND_URL}/predict/task",
-    "get_result": f"{BACKEND_URL}//predict"
-}
-
-SCENE_CONFIGS = {
-    "demo1": {
-        "description": "Demo 1",
-        "objects": ["bedroom", "kitchen", "living room", ""],
-        "preview_image": "/opt/nav-fronted/assets/scene_1.png",
-        "default_instruction": "Walk past the left side of the bed and stop in the doorway."
-    },
-    "demo2": {
-        "description": "Demo 2",
-        "objects": ["office", "meeting room", "corridor"],
-        "preview_image": "/opt/nav-fronted/assets/scene_2.png",
-        "default_instruction": "Walk through the bathroom, past the sink and toilet. Stop in front of the counter with the two suitcase."
-    },
-    "demo3": {
-        "description": "Demo 3",
-        "objects": ["garage", "workshop", "storage"],
-        "preview_image": "/opt/nav-fronted/assets/scene_3.png",
-        "default_instruction": "Do a U-turn. Walk forward through the kitchen, heading to the black door. Walk out of the door and take a right onto the deck. Walk out on to the deck and stop."
-    },
-    "demo4": {
-        "description": "Demo 4",
-        "objects": ["garden", "patio", "pool"],
-        "preview_image": "/opt/nav-fronted/assets/scene_4.png",
-        "default_instruction": "Walk out of bathroom and stand on white bath mat."
-    },
-    "demo5": {
-        "description": "Demo 5",
-        "objects": ["library", "hall", "lounge"],
-        "preview_image": "/opt/nav-fronted/assets/scene_5.png",
-        "default_instruction": "Walk straight through the double wood doors, follow the red carpet straight to the next doorway and stop where the carpet splits off."
-    },
-}
-
-MODEL_CHOICES = ["rdp", "cma"]
-MODE_CHOICES = ["vlnPE", "vlnCE"]
+# config.py
+# 配置相关：API、场景等
+import os
+import json
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+# 多个 GPU 后端用逗号分隔，未设置时只用 BACKEND_URL
+BACKEND_URLS = [url.strip().rstrip("/") for url in os.getenv("BACKEND_URLS", BACKEND_URL).split(",") if url.strip()]
+# 各接口相对后端地址的路径
+API_PATHS = {
+    "submit_task": "/predict/video",
+    "query_status": "/predict/task",
+    "get_result": "//predict",
+    "terminate": "/predict/terminate",
+}
+# 熔断器探活路径：断开期间定期访问，收到非 5xx 响应即认为后端已恢复
+BACKEND_HEALTH_PATH = os.getenv("BACKEND_HEALTH_PATH", "/predict/task/health-probe")
+# 路由策略：least_loaded 选进行中任务最少的后端；scene_affinity 优先选最近跑过同一场景的后端
+BACKEND_ROUTING = os.getenv("BACKEND_ROUTING", "scene_affinity")
+# 亲和后端比最空闲的后端最多多几个进行中任务时仍选亲和后端
+BACKEND_AFFINITY_SLACK = int(os.getenv("BACKEND_AFFINITY_SLACK", "2"))
+# 连续失败多少次后熔断、熔断后多久(秒)放行试探请求
+BACKEND_BREAKER_FAILURES = int(os.getenv("BACKEND_BREAKER_FAILURES", "5"))
+BACKEND_BREAKER_RESET = float(os.getenv("BACKEND_BREAKER_RESET", "30"))
+# 任务多久(秒)既没有新帧也没有状态变化视为卡住并终止；可按 "场景/模式"、场景或模式单独配置，
+# 如 STALL_TIMEOUTS='{"demo3": 120, "demo1/vlnCE": 150}'
+STALL_TIMEOUT = float(os.getenv("STALL_TIMEOUT", "90"))
+STALL_TIMEOUTS = json.loads(os.getenv("STALL_TIMEOUTS", "{}"))
+
+SCENE_CONFIGS = {
+    "demo1": {
+        "description": "Demo 1",
+        "objects": ["bedroom", "kitchen", "living room", ""],
+        "preview_image": "/opt/nav-fronted/assets/scene_1.png",
+        "default_instruction": "Walk past the left side of the bed and stop in the doorway."
+    },
+    "demo2": {
+        "description": "Demo 2",
+        "objects": ["office", "meeting room", "corridor"],
+        "preview_image": "/opt/nav-fronted/assets/scene_2.png",
+        "default_instruction": "Walk through the bathroom, past the sink and toilet. Stop in front of the counter with the two suitcase."
+    },
+    "demo3": {
+        "description": "Demo 3",
+        "objects": ["garage", "workshop", "storage"],
+        "preview_image": "/opt/nav-fronted/assets/scene_3.png",
+        "default_instruction": "Do a U-turn. Walk forward through the kitchen, heading to the black door. Walk out of the door and take a right onto the deck. Walk out on to the deck and stop."
+    },
+    "demo4": {
+        "description": "Demo 4",
+        "objects": ["garden", "patio", "pool"],
+        "preview_image": "/opt/nav-fronted/assets/scene_4.png",
+        "default_instruction": "Walk out of bathroom and stand on white bath mat."
+    },
+    "demo5": {
+        "description": "Demo 5",
+        "objects": ["library", "hall", "lounge"],
+        "preview_image": "/opt/nav-fronted/assets/scene_5.png",
+        "default_instruction": "Walk straight through the double wood doors, follow the red carpet straight to the next doorway and stop where the carpet splits off."
+    },
+}
+
+MODEL_CHOICES = ["rdp", "cma"]
+MODE_CHOICES = ["vlnPE", "vlnCE"]
+
+# 页面上的内置示例：[场景, 模型, 模式, 指令]
+EXAMPLES = [
+    ["demo1", "rdp", "vlnPE", "Walk past the left side of the bed and stop in the doorway."],
+    ["demo2", "rdp", "vlnPE", "Walk through the bathroom, past the sink and toilet. Stop in front of the counter with the two suitcase."],
+    ["demo3", "rdp", "vlnPE", "Do a U-turn. Walk forward through the kitchen, heading to the black door. Walk out of the door and take a right onto the deck. Walk out on to the deck and stop."],
+    ["demo4", "rdp", "vlnPE", "Walk out of bathroom and stand on white bath mat."],
+    ["demo5", "rdp", "vlnPE", "Walk straight through the double wood doors, follow the red carpet straight to the next doorway and stop where the carpet splits off."]
+]
@@ -0,0 +1,107 @@
+# inflight.py
+# 进行中任务的持久化记录：task_id、结果目录、已推送给前端的视频片段等放在 DURABLE_STORE 里（默认 SQLite 文件），
+# 页面刷新后带 ?task=<task_id>&key=<resume_key> 重新打开、或前端进程重启后，可以接上仍在运行的后端任务，
+# 先重放已编码的片段再继续推流，而不是重新提交。
+# 页面关闭后不立即终止任务，留 RESUME_GRACE 秒给用户重新连接；收到 SIGTERM 时先停止接收新任务，
+# 等进行中的任务跑完（最多 DRAIN_TIMEOUT 秒）再退出。
+import os
+import time
+import secrets
+import warnings
+import threading
+from typing import Callable, List, Optional
+
+from state_store import DURABLE_STORE, MemoryStore, StateStore
+
+# 页面关闭后多久(秒)没有重新连接才终止后端任务，0 表示立即终止
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", "45"))
+# 任务完成后记录再保留多久(秒)，期间打开观看链接仍能看到最终视频
+COMPLETED_TTL = float(os.getenv("COMPLETED_TTL", "600"))
+# 收到 SIGTERM 后最多等多久(秒)让进行中的任务结束
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "300"))
+# 记录最多保留多久(秒)
+INFLIGHT_TTL = 3600
+
+NAMESPACE = "inflight_tasks"
+
+# 设置后拒绝新的仿真请求
+DRAINING = threading.Event()
+
+
+class InflightTasks:
+    def __init__(self, store: StateStore = DURABLE_STORE):
+        self.store = store
+        if RESUME_GRACE > 0 and isinstance(store, MemoryStore):
+            warnings.warn("in-flight tasks are kept in memory (DURABLE_STORE_URL=memory://): "
+                          "tasks cannot be resumed after a frontend restart", RuntimeWarning)
+
+    def start(self, task_id: str, **meta) -> str:
+        """登记任务，meta 为重新连接时需要的信息（场景、模型、结果目录等）。
+        返回随机的 resume_key：重新连接必须带上它，task_id 本身会出现在公开的观看链接里"""
+        resume_key = secrets.token_urlsafe(16)
+        self.store.set(NAMESPACE, task_id,
+                       dict(meta, task_id=task_id, resume_key=resume_key, segments=[], started=time.time()),
+                       ttl=INFLIGHT_TTL)
+        return resume_key
+
+    def resume_key(self, task_id: str) -> Optional[str]:
+        return (self.get(task_id) or {}).get("resume_key")
+
+    def get_for_resume(self, task_id: str, resume_key: str) -> Optional[dict]:
+        """resume_key 正确时返回任务记录"""
+        record = self.get(task_id)
+        if record is None or not resume_key or not secrets.compare_digest(record.get("resume_key", ""), resume_key):
+            return None
+        return record
+
+    def add_segment(self, task_id: str, segment_path: str):
+        record = self.store.get(NAMESPACE, task_id)
+        if record is not None:
+            record["segments"].append(segment_path)
+            self.store.set(NAMESPACE, task_id, record, ttl=INFLIGHT_TTL)
+
+    def get(self, task_id: str) -> Optional[dict]:
+        return self.store.get(NAMESPACE, task_id)
+
+    def complete(self, task_id: str, video_path: str):
+        """任务已完成并转码：记下最终视频，记录保留 COMPLETED_TTL 秒"""
+        record = self.store.get(NAMESPACE, task_id)
+        if record is not None:
+            record["final_video"] = video_path
+            self.store.set(NAMESPACE, task_id, record, ttl=COMPLETED_TTL)
+
+    def finish(self, task_id: str):
+        """任务结束后删除记录；已完成的保留到过期，供观看链接使用"""
+        record = self.store.get(NAMESPACE, task_id)
+        if record is not None and not record.get("final_video"):
+            self.store.pop(NAMESPACE, task_id)
+
+    def segments(self, task_id: str) -> List[str]:
+        """已推送过的、仍在磁盘上的片段"""
+        record = self.get(task_id) or {}
+        return [path for path in record.get("segments", []) if os.path.exists(path)]
+
+
+def install_drain(server, active: Callable[[], float], timeout: float = DRAIN_TIMEOUT):
+    """接管 uvicorn.Server 的退出信号：第一次 SIGTERM/SIGINT 进入排空模式，
+    进行中的任务结束或超时后再让 uvicorn 退出；排空期间再收到一次信号则立即退出"""
+    original = server.handle_exit
+
+    def drain(sig, frame):
+        deadline = time.monotonic() + timeout
+        while active() > 0 and time.monotonic() < deadline and not server.should_exit:
+            time.sleep(1)
+        if not server.should_exit:
+            original(sig, frame)
+
+    def handle_exit(sig, frame):
+        if DRAINING.is_set():
+            original(sig, frame)
+            return
+        DRAINING.set()
+        threading.Thread(target=drain, args=(sig, frame), name="drain", daemon=True).start()
+
+    server.handle_exit = handle_exit
+
+
+INFLIGHT = InflightTasks()
@@ -0,0 +1,122 @@
+# job_registry.py
+# 提交去重：job_id 是提交给后端的幂等键。进行中的任务按 (会话, 场景, 模型, 模式, 指令) 登记，
+# 同一会话重复提交相同的请求时复用已有的 job_id；同一 job_id 只真正提交一次，
+# 已拿到 task_id 的直接返回该任务，正在提交（包括重试中）的等待同一次提交的结果。
+# 提交结果不确定（读超时、出错但没有 task_id）时，运行结束后仍保留登记 UNCERTAIN_JOB_TTL 秒：
+# 后端可能已经收到请求并在运行，用户再点一次时用同一个 job_id 提交，由后端按 job_id 去重。
+import os
+import time
+import uuid
+import threading
+
+# 登记的任务最多保留多久(秒)，防止异常退出时没有 release
+JOB_TTL = 3600
+# 结果不确定的提交在运行结束后保留多久(秒)
+UNCERTAIN_JOB_TTL = float(os.getenv("UNCERTAIN_JOB_TTL", "900"))
+
+
+class _Job:
+    __slots__ = ("job_id", "fingerprint", "refs", "task_id", "result", "submitting", "done", "expires")
+
+    def __init__(self, job_id: str, fingerprint: tuple, ttl: float):
+        self.job_id = job_id
+        self.fingerprint = fingerprint
+        self.refs = 0
+        self.task_id = None
+        self.result = None
+        self.submitting = False
+        self.done = threading.Event()
+        self.expires = time.monotonic() + ttl
+
+
+class JobRegistry:
+    def __init__(self, ttl: float = JOB_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._by_fingerprint = {}
+
+    def _expire(self):
+        now = time.monotonic()
+        for job in [job for job in self._jobs.values() if now > job.expires]:
+            self._remove(job)
+
+    def _remove(self, job: _Job):
+        self._jobs.pop(job.job_id, None)
+        if self._by_fingerprint.get(job.fingerprint) is job:
+            del self._by_fingerprint[job.fingerprint]
+
+    def acquire(self, fingerprint: tuple) -> str:
+        """返回这次请求使用的 job_id：相同请求仍在进行时复用它的 job_id。用完后调用 release"""
+        with self._lock:
+            self._expire()
+            job = self._by_fingerprint.get(fingerprint)
+            if job is None:
+                job = _Job(str(uuid.uuid4()), fingerprint, self.ttl)
+                self._jobs[job.job_id] = job
+                self._by_fingerprint[fingerprint] = job
+            elif not job.refs:
+                # 重新用上之前保留的登记
+                job.expires = time.monotonic() + self.ttl
+            job.refs += 1
+            return job.job_id
+
+    def release(self, job_id: str) -> bool:
+        """返回是否是最后一个使用该 job_id 的请求。已提交但没有拿到 task_id 的保留一段时间，
+        下次相同的请求复用该 job_id"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return True
+            job.refs -= 1
+            if job.refs <= 0:
+                if job.result is not None and not job.task_id:
+                    job.expires = time.monotonic() + UNCERTAIN_JOB_TTL
+                else:
+                    self._remove(job)
+                return True
+            return False
+
+    def task_id(self, job_id: str):
+        job = self._jobs.get(job_id)
+        return job.task_id if job is not None else None
+
+    def submit(self, job_id: str, submit_fn) -> dict:
+        """同一 job_id 只调用一次 submit_fn（返回后端的响应 dict），没有登记的 job_id 直接提交"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                wait = False
+            elif job.task_id:
+                return {"status": "pending", "task_id": job.task_id, "deduplicated": True}
+            elif job.submitting:
+                wait, done = True, job.done
+            else:
+                wait = False
+                job.submitting = True
+                job.done = threading.Event()
+        if job is None:
+            return submit_fn()
+        if wait:
+            done.wait()
+            with self._lock:
+                if job.task_id:
+                    return {"status": "pending", "task_id": job.task_id, "deduplicated": True}
+                return dict(job.result or {"status": "error", "message": "submission failed"})
+        result = {"status": "error", "message": "submission failed"}
+        try:
+            result = submit_fn()
+            return result
+        finally:
+            with self._lock:
+                job.submitting = False
+                job.result = result
+                if result.get("status") == "pending" and result.get("task_id"):
+                    job.task_id = result["task_id"]
+                job.done.set()
+
+    def outstanding(self) -> int:
+        return len(self._jobs)
+
+
+JOB_REGISTRY = JobRegistry()
@@ -0,0 +1,284 @@
+# log_archive.py
+# 日志轮转与归档：按大小/时间把日志切成 gzip 压缩段，并为每段生成时间索引
+#
+# 每个压缩段由多个独立的 gzip member 组成，每个 member 存 ARCHIVE_BLOCK_LINES 行；
+# 索引里记录每个 member 在压缩文件中的字节偏移和首行时间戳，
+# 按时间范围查询时只需 seek 到对应 member 解压，不必解压整个段。
+import os
+import json
+import zlib
+import fcntl
+import glob
+import bisect
+import threading
+from datetime import datetime
+from typing import Optional
+
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(64 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = int(os.getenv("LOG_ROTATE_SECONDS", str(24 * 3600)))
+ARCHIVE_BLOCK_LINES = int(os.getenv("ARCHIVE_BLOCK_LINES", "1000"))
+ARCHIVE_DIRNAME = "archive"
+ROTATING_SUFFIX = ".rotating"
+
+_INDEX_CACHE = {}
+_INDEX_LOCK = threading.Lock()
+
+
+def archive_dir(log_path: str) -> str:
+    return os.path.join(os.path.dirname(log_path), ARCHIVE_DIRNAME)
+
+
+def _timestamp_key(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+def first_timestamp(log_path: str) -> Optional[str]:
+    try:
+        with open(log_path, "rb") as f:
+            line = f.readline()
+        return json.loads(line).get("timestamp")
+    except (OSError, ValueError):
+        return None
+
+
+def should_rotate(log_path: str, now: Optional[datetime] = None) -> bool:
+    try:
+        size = os.path.getsize(log_path)
+    except OSError:
+        return False
+    if size == 0:
+        return False
+    if LOG_ROTATE_BYTES and size >= LOG_ROTATE_BYTES:
+        return True
+    if LOG_ROTATE_SECONDS:
+        first = first_timestamp(log_path)
+        if first:
+            try:
+                opened = datetime.strptime(first, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                return False
+            return ((now or datetime.now()) - opened).total_seconds() >= LOG_ROTATE_SECONDS
+    return False
+
+
+def detach(log_path: str) -> Optional[str]:
+    """把当前日志文件改名为待压缩文件，之后的写入会创建新文件。多进程下只有一个能改名成功"""
+    pending = f"{log_path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ROTATING_SUFFIX}"
+    try:
+        os.rename(log_path, pending)
+    except FileNotFoundError:
+        return None
+    return pending
+
+
+def compress_segment(pending_path: str, block_lines: int = ARCHIVE_BLOCK_LINES) -> Optional[str]:
+    """把待压缩文件写成多 member 的 gzip 段并生成索引，完成后删除原文件，返回段路径"""
+    log_name = os.path.basename(pending_path)[:-len(ROTATING_SUFFIX)]
+    out_dir = os.path.join(os.path.dirname(pending_path), ARCHIVE_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+    segment_path = os.path.join(out_dir, f"{log_name}.gz")
+    index_path = os.path.join(out_dir, f"{log_name}.idx.json")
+    blocks = []
+    lines = 0
+    raw_bytes = 0
+    first_ts = last_ts = None
+    block = []
+    block_first = None
+
+    def flush_block(out):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        offset = out.tell()
+        out.write(compressor.compress(b"".join(block)) + compressor.flush())
+        blocks.append([offset, lines - len(block), block_first])
+
+    try:
+        src = open(pending_path, "rb")
+    except FileNotFoundError:
+        return None
+    with src:
+        # 多个进程可能同时处理同一个遗留文件，拿不到锁或文件已被处理完就跳过
+        try:
+            fcntl.flock(src, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        if not os.path.exists(pending_path):
+            return None
+        with open(segment_path + ".tmp", "wb") as out:
+            for line in src:
+                if not line.strip():
+                    continue
+                if not line.endswith(b"\n"):
+                    line += b"\n"
+                try:
+                    ts = json.loads(line).get("timestamp")
+                except ValueError:
+                    ts = None
+                if ts:
+                    first_ts = first_ts or ts
+                    last_ts = ts
+                    if block_first is None:
+                        block_first = ts
+                block.append(line)
+                lines += 1
+                raw_bytes += len(line)
+                if len(block) >= block_lines:
+                    flush_block(out)
+                    block = []
+                    block_first = None
+            if block:
+                flush_block(out)
+        index = {
+            "log": log_name.rsplit(".", 1)[0],
+            "segment": os.path.basename(segment_path),
+            "first_timestamp": first_ts,
+            "last_timestamp": last_ts,
+            "lines": lines,
+            "bytes": raw_bytes,
+            "block_lines": block_lines,
+            # [压缩文件内偏移, 起始行号, 首行时间戳]
+            "blocks": blocks,
+        }
+        os.replace(segment_path + ".tmp", segment_path)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(index_path + ".tmp", index_path)
+        os.remove(pending_path)
+    return segment_path
+
+
+def rotate(log_path: str) -> Optional[str]:
+    pending = detach(log_path)
+    if pending is None:
+        return None
+    return compress_segment(pending)
+
+
+def pending_files(log_path: str) -> list:
+    return sorted(glob.glob(f"{glob.escape(log_path)}.*{ROTATING_SUFFIX}"))
+
+
+def compress_pending(log_path: str):
+    """压缩上次退出前遗留的待压缩文件"""
+    for pending in pending_files(log_path):
+        compress_segment(pending)
+
+
+def _load_index(index_path: str) -> Optional[dict]:
+    with _INDEX_LOCK:
+        index = _INDEX_CACHE.get(index_path)
+    if index is None:
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        index["path"] = os.path.join(os.path.dirname(index_path), index["segment"])
+        with _INDEX_LOCK:
+            _INDEX_CACHE[index_path] = index
+    return index
+
+
+def list_segments(log_path: str) -> list:
+    """返回该日志的所有归档段索引，按时间从旧到新排列"""
+    pattern = os.path.join(archive_dir(log_path), f"{glob.escape(os.path.basename(log_path))}.*.idx.json")
+    segments = [index for index in map(_load_index, glob.glob(pattern)) if index and index["lines"]]
+    segments.sort(key=lambda x: (x["first_timestamp"] or "", x["segment"]))
+    return segments
+
+
+def _decompress_members(f, offset: int, count: Optional[int] = None):
+    """从 offset 开始逐个解压 gzip member，每次产出一个 member 内的全部行"""
+    f.seek(offset)
+    remaining = b""
+    while count is None or count > 0:
+        decompressor = zlib.decompressobj(31)
+        data = b""
+        while not decompressor.eof:
+            chunk = remaining or f.read(64 * 1024)
+            remaining = b""
+            if not chunk:
+                return
+            data += decompressor.decompress(chunk)
+        remaining = decompressor.unused_data
+        yield data.splitlines()
+        if count is not None:
+            count -= 1
+
+
+def _parse(lines):
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def iter_segment_reversed(index: dict):
+    """倒序产出一个归档段的条目（最新在前），按 member 逐块解压"""
+    with open(index["path"], "rb") as f:
+        for offset, _, _ in reversed(index["blocks"]):
+            for lines in _decompress_members(f, offset, 1):
+                yield from _parse(reversed(lines))
+
+
+def iter_range(log_path: str, start=None, end=None):
+    """按时间顺序产出 [start, end] 内的条目，只解压时间范围内的段和 member"""
+    start, end = _timestamp_key(start), _timestamp_key(end)
+    for index in list_segments(log_path):
+        if start and index["last_timestamp"] and index["last_timestamp"] < start:
+            continue
+        if end and index["first_timestamp"] and index["first_timestamp"] > end:
+            break
+        blocks = index["blocks"]
+        first = 0
+        if start:
+            # 找到最后一个首行时间早于 start 的 member，范围内的条目可能从它开始
+            keys = [b[2] or "" for b in blocks]
+            first = max(bisect.bisect_left(keys, start) - 1, 0)
+        with open(index["path"], "rb") as f:
+            for lines in _decompress_members(f, blocks[first][0]):
+                for entry in _parse(lines):
+                    ts = entry.get("timestamp", "")
+                    if start and ts < start:
+                        continue
+                    if end and ts > end:
+                        return
+                    yield entry
+    for path in pending_files(log_path) + [log_path]:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            continue
+        with f:
+            for entry in _parse(f):
+                ts = entry.get("timestamp", "")
+                if start and ts < start:
+                    continue
+                if end and ts > end:
+                    return
+                yield entry
+
+
+if __name__ == "__main__":
+    import argparse
+    from logging_utils import ACCESS_LOG, SUBMISSION_LOG
+
+    logs = {"access": ACCESS_LOG, "submission": SUBMISSION_LOG}
+    parser = argparse.ArgumentParser(description="Rotate or query archived nav-fronted logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rotate_parser = sub.add_parser("rotate", help="rotate and compress a log now")
+    rotate_parser.add_argument("log", choices=list(logs))
+    query_parser = sub.add_parser("query", help="print entries in a time range as JSON lines")
+    query_parser.add_argument("log", choices=list(logs))
+    query_parser.add_argument("--start", help='e.g. "2025-07-21 00:00:00"')
+    query_parser.add_argument("--end", help='e.g. "2025-07-28 00:00:00"')
+    args = parser.parse_args()
+    if args.command == "rotate":
+        print(rotate(logs[args.log]) or "nothing to rotate")
+    else:
+        for entry in iter_range(logs[args.log], args.start, args.end):
+            print(json.dumps(entry, ensure_ascii=False))
@@ -0,0 +1,493 @@
+# log_index.py
+# JSONL 日志的稀疏字节偏移索引：每 INDEX_STRIDE 行记录一次字节偏移和该块的摘要，
+# 随日志追加增量构建，用于日志查看器的分页跳转和按条件过滤，不必每次从头扫描文件。
+#
+# - 不带过滤条件时，任意一页都只需 seek 到对应块再读一页，代价与日志总长度无关；
+# - 时间范围先在块首时间戳上二分，再在块内二分，转成行号区间；
+# - 按 IP/场景/模型/结果过滤时用块摘要跳过不可能匹配的块，已写满的块的匹配数会被缓存，
+#   翻到后面的页时可以整块跳过。
+#
+# 轮转出去的旧日志也在查询范围内：一个日志按时间顺序由归档段、待压缩文件和当前文件拼成，
+# 归档段用 log_archive 生成的 member 索引（每个 member 的起始行号和首行时间戳）随机读取，
+# 段不会再变化，整段的过滤匹配数按条件缓存。
+import os
+import json
+import heapq
+import bisect
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
+
+import log_archive
+
+INDEX_STRIDE = int(os.getenv("LOG_INDEX_STRIDE", "256"))
+# 块摘要里每个字段最多记录多少个不同值，超过后该字段不再用于跳块
+SUMMARY_MAX_VALUES = 32
+# 每个索引最多缓存多少种过滤条件的块匹配数
+COUNT_CACHE_SIZE = 32
+# 最多缓存多少个已解压的归档 member
+MEMBER_CACHE_SIZE = 16
+
+VALUE_FIELDS = ("user", "scene", "model", "mode", "result")
+# 只有提交记录才有的字段，带这些条件时可以直接跳过访问日志
+SUBMISSION_FIELDS = {"scene", "model", "mode", "result", "failed"}
+
+
+def _timestamp_key(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+def entry_fields(entry: dict) -> dict:
+    is_access = entry.get("type") == "access"
+    return {
+        "user": entry.get("user_ip") if is_access else entry.get("user"),
+        "scene": entry.get("scene"),
+        "model": entry.get("model"),
+        "mode": entry.get("mode"),
+        "result": entry.get("res"),
+    }
+
+
+def _filter_key(filters: dict) -> tuple:
+    return tuple(sorted((k, v) for k, v in filters.items() if k in VALUE_FIELDS or k == "failed"))
+
+
+def matches(entry: dict, filters: dict) -> bool:
+    """filters 可包含 user, scene, model, mode, result, failed, start, end，值为空的条件忽略"""
+    fields = entry_fields(entry)
+    for key, value in filters.items():
+        if value is None or value == "":
+            continue
+        if key == "failed":
+            if entry.get("type") != "submission" or (entry.get("res") == "success") == bool(value):
+                return False
+        elif key == "start":
+            if entry.get("timestamp", "") < _timestamp_key(value):
+                return False
+        elif key == "end":
+            if entry.get("timestamp", "") > _timestamp_key(value):
+                return False
+        elif fields.get(key) != value:
+            return False
+    return True
+
+
+class _BlockSummary:
+    __slots__ = ("first", "last", "values", "succeeded", "failed")
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+        self.values = {field: set() for field in VALUE_FIELDS}
+        self.succeeded = False
+        self.failed = False
+
+    def add(self, entry: dict):
+        ts = entry.get("timestamp")
+        if ts:
+            self.first = self.first or ts
+            self.last = ts
+        for field, value in entry_fields(entry).items():
+            seen = self.values[field]
+            if seen is not None:
+                seen.add(value)
+                if len(seen) > SUMMARY_MAX_VALUES:
+                    self.values[field] = None
+        if entry.get("type") == "submission":
+            if entry.get("res") == "success":
+                self.succeeded = True
+            else:
+                self.failed = True
+
+    def may_match(self, filters: dict) -> bool:
+        for field in VALUE_FIELDS:
+            value = filters.get(field)
+            seen = self.values[field]
+            if value and seen is not None and value not in seen:
+                return False
+        failed = filters.get("failed")
+        if failed is not None and not (self.failed if failed else self.succeeded):
+            return False
+        return True
+
+
+class _LineSource:
+    """按行号随机读取的日志来源的公共方法，子类提供 lines 和 read()"""
+
+    lines = 0
+
+    def read(self, start: int, count: int) -> list:
+        raise NotImplementedError
+
+    def timestamp_at(self, line: int) -> str:
+        entries = self.read(line, 1)
+        return entries[0].get("timestamp", "") if entries else ""
+
+    def line_range(self, start=None, end=None) -> tuple:
+        lo = self.bisect_time(_timestamp_key(start)) if start else 0
+        hi = self.bisect_time(_timestamp_key(end), right=True) if end else self.lines
+        return lo, max(lo, hi)
+
+    def read_reversed(self, lo: int, hi: int, skip: int, limit: int) -> list:
+        """从新到旧跳过 skip 条后取 limit 条（不过滤）"""
+        stop = hi - skip
+        start = max(lo, stop - limit)
+        return list(reversed(self.read(start, stop - start))) if stop > start else []
+
+
+class SparseLogIndex(_LineSource):
+    """单个 JSONL 日志文件的稀疏行索引。文件被轮转（inode 变化）或截断时自动重建"""
+
+    def __init__(self, path: str, stride: int = INDEX_STRIDE):
+        self.path = path
+        self.stride = stride
+        self._lock = threading.RLock()
+        self._reset(None)
+
+    def _reset(self, inode):
+        self._inode = inode
+        self._end = 0
+        self.lines = 0
+        self.offsets = []
+        self.blocks = []
+        self._count_cache = OrderedDict()
+
+    def refresh(self):
+        """把上次之后追加的完整行纳入索引"""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset(None)
+                return
+            if st.st_ino != self._inode or st.st_size < self._end:
+                self._reset(st.st_ino)
+            if st.st_size == self._end:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(self._end)
+                data = f.read(st.st_size - self._end)
+            pos = self._end
+            for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):
+                if line.strip():
+                    if self.lines % self.stride == 0:
+                        self.offsets.append(pos)
+                        self.blocks.append(_BlockSummary())
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = {}
+                    self.blocks[-1].add(entry)
+                    self.lines += 1
+                pos += len(line)
+            self._end = pos
+
+    def read(self, start: int, count: int) -> list:
+        """读取第 [start, start + count) 行（按文件顺序）"""
+        with self._lock:
+            count = min(count, self.lines - start)
+            if count <= 0 or start < 0:
+                return []
+            offset = self.offsets[start // self.stride]
+            end = self._end
+        skip = start % self.stride
+        entries = []
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while len(entries) < count and f.tell() < end:
+                line = f.readline()
+                if not line.strip():
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    entries.append({})
+        return entries
+
+    def bisect_time(self, ts: str, right: bool = False) -> int:
+        """返回第一条时间戳 >= ts（right=True 时 > ts）的行号"""
+        with self._lock:
+            firsts = [block.first or "" for block in self.blocks]
+            lines = self.lines
+        find = bisect.bisect_right if right else bisect.bisect_left
+        block = max(find(firsts, ts) - 1, 0)
+        start = block * self.stride
+        keys = [entry.get("timestamp", "") for entry in self.read(start, self.stride)]
+        return min(start + find(keys, ts), lines)
+
+    def count(self, block: int, filters: dict, lo: int, hi: int) -> int:
+        """统计第 block 块在行区间 [lo, hi) 内满足条件的条数，写满的整块结果会缓存"""
+        b_lo, b_hi = max(block * self.stride, lo), min((block + 1) * self.stride, hi)
+        if b_lo >= b_hi or not self.blocks[block].may_match(filters):
+            return 0
+        whole = b_lo == block * self.stride and b_hi == (block + 1) * self.stride
+        key = _filter_key(filters)
+        if whole:
+            with self._lock:
+                cached = self._count_cache.get(key)
+                if cached is not None and block in cached:
+                    self._count_cache.move_to_end(key)
+                    return cached[block]
+        count = sum(1 for entry in self.read(b_lo, b_hi - b_lo) if matches(entry, filters))
+        if whole:
+            with self._lock:
+                cached = self._count_cache.setdefault(key, {})
+                cached[block] = count
+                self._count_cache.move_to_end(key)
+                while len(self._count_cache) > COUNT_CACHE_SIZE:
+                    self._count_cache.popitem(last=False)
+        return count
+
+    def count_range(self, filters: dict, lo: int, hi: int) -> int:
+        if hi <= lo:
+            return 0
+        return sum(self.count(block, filters, lo, hi) for block in range(lo // self.stride, (hi - 1) // self.stride + 1))
+
+    def iter_filtered_reversed(self, filters: dict, lo: int, hi: int, skip: int = 0):
+        """从新到旧产出 [lo, hi) 内满足条件的条目，先按缓存的块匹配数跳过 skip 条"""
+        if hi <= lo:
+            return
+        for block in range((hi - 1) // self.stride, lo // self.stride - 1, -1):
+            if not self.blocks[block].may_match(filters):
+                continue
+            b_lo, b_hi = max(block * self.stride, lo), min((block + 1) * self.stride, hi)
+            if skip:
+                count = self.count(block, filters, lo, hi)
+                if count <= skip:
+                    skip -= count
+                    continue
+            matched = [e for e in reversed(self.read(b_lo, b_hi - b_lo)) if matches(e, filters)]
+            yield from matched[skip:]
+            skip = 0
+
+
+_MEMBERS = OrderedDict()
+_MEMBERS_LOCK = threading.Lock()
+
+
+class SegmentLogIndex(_LineSource):
+    """一个已压缩的归档段，按 member 解压读取；最近用过的 member 在进程内缓存"""
+
+    def __init__(self, index: dict):
+        self.path = index["path"]
+        self.lines = index["lines"]
+        self.first_timestamp = index["first_timestamp"] or ""
+        self.last_timestamp = index["last_timestamp"] or ""
+        self._offsets = [block[0] for block in index["blocks"]]
+        self._starts = [block[1] for block in index["blocks"]]
+        self._firsts = [block[2] or "" for block in index["blocks"]]
+        self._lock = threading.Lock()
+        self._count_cache = OrderedDict()
+
+    def _member(self, i: int) -> list:
+        key = (self.path, i)
+        with _MEMBERS_LOCK:
+            entries = _MEMBERS.get(key)
+            if entries is not None:
+                _MEMBERS.move_to_end(key)
+                return entries
+        entries = []
+        with open(self.path, "rb") as f:
+            for lines in log_archive._decompress_members(f, self._offsets[i], 1):
+                for line in lines:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        entries.append({})
+        with _MEMBERS_LOCK:
+            _MEMBERS[key] = entries
+            while len(_MEMBERS) > MEMBER_CACHE_SIZE:
+                _MEMBERS.popitem(last=False)
+        return entries
+
+    def read(self, start: int, count: int) -> list:
+        count = min(count, self.lines - start)
+        if count <= 0 or start < 0:
+            return []
+        entries = []
+        i = bisect.bisect_right(self._starts, start) - 1
+        while len(entries) < count and i < len(self._starts):
+            member = self._member(i)
+            entries.extend(member[max(0, start - self._starts[i]):][:count - len(entries)])
+            i += 1
+        return entries
+
+    def bisect_time(self, ts: str, right: bool = False) -> int:
+        find = bisect.bisect_right if right else bisect.bisect_left
+        i = max(find(self._firsts, ts) - 1, 0)
+        keys = [entry.get("timestamp", "") for entry in self._member(i)]
+        return min(self._starts[i] + find(keys, ts), self.lines)
+
+    def count_range(self, filters: dict, lo: int, hi: int) -> int:
+        if hi <= lo:
+            return 0
+        whole = lo == 0 and hi == self.lines
+        key = _filter_key(filters)
+        if whole:
+            with self._lock:
+                if key in self._count_cache:
+                    self._count_cache.move_to_end(key)
+                    return self._count_cache[key]
+        count = sum(1 for entry in self.read(lo, hi - lo) if matches(entry, filters))
+        if whole:
+            with self._lock:
+                self._count_cache[key] = count
+                while len(self._count_cache) > COUNT_CACHE_SIZE:
+                    self._count_cache.popitem(last=False)
+        return count
+
+    def iter_filtered_reversed(self, filters: dict, lo: int, hi: int, skip: int = 0):
+        if hi <= lo:
+            return
+        for i in range(bisect.bisect_right(self._starts, hi - 1) - 1, -1, -1):
+            m_lo = max(self._starts[i], lo)
+            if m_lo >= hi:
+                continue
+            matched = [e for e in reversed(self.read(m_lo, hi - m_lo)) if matches(e, filters)]
+            hi = m_lo
+            if skip >= len(matched):
+                skip -= len(matched)
+            else:
+                yield from matched[skip:]
+                skip = 0
+            if hi <= lo:
+                return
+
+
+class LogChain(_LineSource):
+    """按时间顺序拼接的一个日志的全部内容：归档段、待压缩文件、当前文件，行号连续编排"""
+
+    def __init__(self, parts: list):
+        self.parts = [part for part in parts if part.lines]
+        self.bases = []
+        self.lines = 0
+        for part in self.parts:
+            self.bases.append(self.lines)
+            self.lines += part.lines
+
+    def _pieces(self, lo: int, hi: int):
+        """与 [lo, hi) 相交的各部分，产出 (part, 部分内的 lo, 部分内的 hi)，从旧到新"""
+        for part, base in zip(self.parts, self.bases):
+            p_lo, p_hi = max(lo - base, 0), min(hi - base, part.lines)
+            if p_lo < p_hi:
+                yield part, p_lo, p_hi
+
+    def read(self, start: int, count: int) -> list:
+        entries = []
+        for part, p_lo, p_hi in self._pieces(start, start + max(count, 0)):
+            entries.extend(part.read(p_lo, p_hi - p_lo))
+        return entries
+
+    def bisect_time(self, ts: str, right: bool = False) -> int:
+        for part, base in zip(self.parts, self.bases):
+            last = part.timestamp_at(part.lines - 1)
+            if (last > ts) if right else (last >= ts):
+                return base + part.bisect_time(ts, right)
+        return self.lines
+
+    def count_range(self, filters: dict, lo: int, hi: int) -> int:
+        return sum(part.count_range(filters, p_lo, p_hi) for part, p_lo, p_hi in self._pieces(lo, hi))
+
+    def iter_filtered_reversed(self, filters: dict, lo: int, hi: int, skip: int = 0):
+        for part, p_lo, p_hi in reversed(list(self._pieces(lo, hi))):
+            if skip:
+                count = part.count_range(filters, p_lo, p_hi)
+                if count <= skip:
+                    skip -= count
+                    continue
+            yield from part.iter_filtered_reversed(filters, p_lo, p_hi, skip)
+            skip = 0
+
+
+_INDEXES = {}
+_SEGMENTS = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def get_file_index(path: str) -> SparseLogIndex:
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(path)
+        if index is None:
+            index = _INDEXES[path] = SparseLogIndex(path)
+    index.refresh()
+    return index
+
+
+def get_index(path: str) -> LogChain:
+    """日志 path 连同已轮转的部分：归档段、待压缩文件和当前文件"""
+    segments = log_archive.list_segments(path)
+    pending = log_archive.pending_files(path)
+    with _INDEXES_LOCK:
+        parts = []
+        for index in segments:
+            segment = _SEGMENTS.get(index["path"])
+            if segment is None:
+                segment = _SEGMENTS[index["path"]] = SegmentLogIndex(index)
+            parts.append(segment)
+        # 已压缩完的待压缩文件、已删除的归档段不再保留索引
+        for stale in [p for p in _INDEXES if p.startswith(f"{path}.") and p not in pending]:
+            del _INDEXES[stale]
+        prefix = os.path.join(log_archive.archive_dir(path), os.path.basename(path) + ".")
+        listed = {index["path"] for index in segments}
+        for stale in [p for p in _SEGMENTS if p.startswith(prefix) and p not in listed]:
+            del _SEGMENTS[stale]
+    return LogChain(parts + [get_file_index(p) for p in pending + [path]])
+
+
+def _split(a: tuple, b: tuple, k: int) -> int:
+    """两个从新到旧的序列合并后，前 k 条里有多少条来自 a（时间相同时 a 在前）"""
+    index_a, lo_a, hi_a = a
+    index_b, lo_b, hi_b = b
+    len_a, len_b = hi_a - lo_a, hi_b - lo_b
+    ts_a = lambda i: index_a.timestamp_at(hi_a - 1 - i)
+    ts_b = lambda i: index_b.timestamp_at(hi_b - 1 - i)
+    low, high = max(0, k - len_b), min(k, len_a)
+    while low <= high:
+        take_a = (low + high) // 2
+        take_b = k - take_a
+        if take_a > 0 and take_b < len_b and ts_a(take_a - 1) < ts_b(take_b):
+            high = take_a - 1
+        elif take_b > 0 and take_a < len_a and ts_a(take_a) >= ts_b(take_b - 1):
+            low = take_a + 1
+        else:
+            return take_a
+    return low
+
+
+def query(paths: list, limit: int = 50, offset: int = 0, **filters) -> tuple:
+    """在一个或两个 JSONL 日志（含已轮转的部分）上分页查询（从新到旧），返回 (条目列表, 总数)"""
+    key = lambda x: x.get("timestamp", "")
+    start, end = filters.get("start"), filters.get("end")
+    value_filters = {k: v for k, v in filters.items()
+                     if k not in ("start", "end") and v is not None and v != ""}
+    sequences = []
+    for path in paths:
+        index = get_index(path)
+        lo, hi = index.line_range(start, end)
+        sequences.append((index, lo, hi))
+
+    if not value_filters:
+        total = sum(hi - lo for _, lo, hi in sequences)
+        if len(sequences) == 1:
+            index, lo, hi = sequences[0]
+            return index.read_reversed(lo, hi, offset, limit), total
+        (index_a, lo_a, hi_a), (index_b, lo_b, hi_b) = sequences
+        take_a = _split(sequences[0], sequences[1], min(offset, total))
+        page_a = index_a.read_reversed(lo_a, hi_a, take_a, limit)
+        page_b = index_b.read_reversed(lo_b, hi_b, offset - take_a, limit)
+        return list(islice(heapq.merge(page_a, page_b, key=key, reverse=True), limit)), total
+
+    total = sum(index.count_range(value_filters, lo, hi) for index, lo, hi in sequences)
+    if len(sequences) == 1:
+        index, lo, hi = sequences[0]
+        return list(islice(index.iter_filtered_reversed(value_filters, lo, hi, offset), limit)), total
+    # 两个文件都要过滤时按时间归并，翻页代价与 offset 成正比
+    streams = [index.iter_filtered_reversed(value_filters, lo, hi) for index, lo, hi in sequences]
+    merged = heapq.merge(*streams, key=key, reverse=True)
+    return list(islice(merged, offset, offset + limit)), total
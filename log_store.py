@@ -0,0 +1,238 @@
+# log_store.py
+# 可选的 SQLite 日志库：把访问/提交事件同步写入带索引的表，支持按条件过滤和分页查询
+#
+# 设置环境变量 LOG_STORE_PATH 启用，例如 LOG_STORE_PATH=/opt/nav-fronted/logs/logs.db；
+# 已有的 JSONL 日志可用 `python log_store.py import` 导入（可重复执行，已导入的行会被跳过）。
+# 每条事件按 LogWriter 分配的 event_id 去重；没有 event_id 的旧日志行按内容哈希加上
+# 同一内容在文件中第几次出现去重，同一秒内内容相同的两次提交不会被合并成一条。
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Optional
+
+LOG_STORE_PATH = os.getenv("LOG_STORE_PATH", "")
+ENABLED = bool(LOG_STORE_PATH)
+
+# 表中单独成列的字段，其余字段放在 extra 里
+_COLUMNS = ("timestamp", "type", "user", "user_agent", "scene", "model", "mode", "prompt", "result")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    line_hash TEXT NOT NULL UNIQUE, -- 事件标识：event_id，旧日志行为内容哈希[:序号]
+    timestamp TEXT NOT NULL,
+    type TEXT NOT NULL,
+    user TEXT,
+    user_agent TEXT,
+    scene TEXT,
+    model TEXT,
+    mode TEXT,
+    prompt TEXT,
+    result TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_type_timestamp ON events(type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_user_timestamp ON events(user, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_scene_timestamp ON events(scene, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_model_timestamp ON events(model, timestamp);
+CREATE INDEX IF NOT EXISTS idx_events_result_timestamp ON events(result, timestamp);
+"""
+
+
+class LogStore:
+    """SQLite(WAL) 事件库，每个线程使用自己的连接"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row(entry: dict, key: str = None) -> tuple:
+        values = {
+            "timestamp": entry.get("timestamp", ""),
+            "type": entry.get("type", "unknown"),
+            "user": entry.get("user_ip") if entry.get("type") == "access" else entry.get("user"),
+            "user_agent": entry.get("user_agent"),
+            "scene": entry.get("scene"),
+            "model": entry.get("model"),
+            "mode": entry.get("mode"),
+            "prompt": entry.get("prompt"),
+            "result": entry.get("res"),
+        }
+        known = {"timestamp", "type", "user", "user_ip", "user_agent", "scene", "model", "mode", "prompt", "res",
+                 "event_id"}
+        extra = {k: v for k, v in entry.items() if k not in known}
+        return (entry.get("event_id") or key or line_hash(entry),
+                *(values[c] for c in _COLUMNS),
+                json.dumps(extra) if extra else None)
+
+    def insert(self, entries: list, keys: list = None) -> int:
+        """批量写入事件，返回新插入的条数（已写入过的事件跳过）。
+        keys 为没有 event_id 的条目指定标识，默认用内容哈希"""
+        rows = [self._row(e, k) for e, k in zip(entries, keys or [None] * len(entries))]
+        conn = self._conn()
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO events (line_hash, {', '.join(_COLUMNS)}, extra) "
+                f"VALUES ({', '.join('?' * (len(_COLUMNS) + 2))})",
+                rows
+            )
+        return conn.total_changes - before
+
+    def query(self, log_type: str = "all", user: str = None, scene: str = None, model: str = None,
+              mode: str = None, result: str = None, failed: Optional[bool] = None,
+              start=None, end=None, limit: int = 50, offset: int = 0) -> tuple:
+        """按条件查询事件（新到旧），返回 (条目列表, 满足条件的总数)
+
+        result 精确匹配 res 字段；failed=True 只要提交失败的记录（res 不是 success）。
+        start/end 可以是 datetime 或 "YYYY-MM-DD HH:MM:SS" 字符串。
+        """
+        where, params = [], []
+        if log_type in ("access", "submission"):
+            where.append("type = ?")
+            params.append(log_type)
+        for column, value in (("user", user), ("scene", scene), ("model", model),
+                              ("mode", mode), ("result", result)):
+            if value:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if failed is not None:
+            where.append("type = 'submission'")
+            where.append("result != 'success'" if failed else "result = 'success'")
+        if start:
+            where.append("timestamp >= ?")
+            params.append(_timestamp_key(start))
+        if end:
+            where.append("timestamp <= ?")
+            params.append(_timestamp_key(end))
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        conn = self._conn()
+        total = conn.execute(f"SELECT COUNT(*) FROM events {clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM events {clause} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+            params + [limit, offset]
+        ).fetchall()
+        return [_to_entry(row) for row in rows], total
+
+    def on_logs_written(self, path: str, entries: list):
+        self.insert(entries)
+
+
+def line_hash(entry: dict) -> str:
+    # 与写入 JSONL 时的序列化方式一致，同一行无论实时写入还是导入都得到相同哈希
+    return hashlib.sha1(json.dumps(entry).encode("utf-8")).hexdigest()
+
+
+def _timestamp_key(value) -> str:
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return str(value)
+
+
+def _to_entry(row: sqlite3.Row) -> dict:
+    """把表中的一行还原成与 JSONL 日志相同结构的条目，便于复用 format_logs_for_display"""
+    entry = {"timestamp": row["timestamp"], "type": row["type"]}
+    if row["type"] == "access":
+        entry["user_ip"] = row["user"]
+        entry["user_agent"] = row["user_agent"]
+    else:
+        entry["user"] = row["user"]
+        for column in ("scene", "prompt", "model", "mode"):
+            if row[column] is not None:
+                entry[column] = row[column]
+        entry["res"] = row["result"]
+    if row["extra"]:
+        entry.update(json.loads(row["extra"]))
+    return entry
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> Optional[LogStore]:
+    global _STORE
+    if not ENABLED:
+        return None
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = LogStore(LOG_STORE_PATH)
+    return _STORE
+
+
+def import_jsonl(store: LogStore, path: str, batch_size: int = 10000) -> int:
+    """导入一个 JSONL 日志（含其已轮转的归档段），返回新插入的条数。
+    没有 event_id 的行以内容哈希加出现序号为标识（第一次出现不加序号，与旧版本导入的记录一致），
+    重复导入同一文件得到相同的标识"""
+    import log_archive
+    inserted = 0
+    entries, keys = [], []
+    seen = {}
+    for entry in log_archive.iter_range(path):
+        key = None
+        if not entry.get("event_id"):
+            key = line_hash(entry)
+            n = seen.get(key, 0)
+            seen[key] = n + 1
+            if n:
+                key = f"{key}:{n}"
+        entries.append(entry)
+        keys.append(key)
+        if len(entries) >= batch_size:
+            inserted += store.insert(entries, keys)
+            entries, keys = [], []
+    if entries:
+        inserted += store.insert(entries, keys)
+    return inserted
+
+
+if __name__ == "__main__":
+    import argparse
+    from logging_utils import ACCESS_LOG, SUBMISSION_LOG
+
+    parser = argparse.ArgumentParser(description="SQLite store for nav-fronted access/submission logs")
+    parser.add_argument("--db", default=LOG_STORE_PATH or os.path.join(os.path.dirname(ACCESS_LOG), "logs.db"))
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_parser = sub.add_parser("import", help="import JSONL logs (and their archives) into the store")
+    import_parser.add_argument("logs", nargs="*", default=[ACCESS_LOG, SUBMISSION_LOG])
+    query_parser = sub.add_parser("query", help="print matching events as JSON lines")
+    query_parser.add_argument("--type", default="all", choices=["all", "access", "submission"])
+    for name in ("user", "scene", "model", "mode", "result", "start", "end"):
+        query_parser.add_argument(f"--{name}")
+    query_parser.add_argument("--failed", action="store_true", help="only failed submissions")
+    query_parser.add_argument("--limit", type=int, default=50)
+    query_parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args()
+
+    store = LogStore(args.db)
+    if args.command == "import":
+        for log in args.logs:
+            print(f"{log}: {import_jsonl(store, log)} new events")
+    else:
+        entries, total = store.query(
+            args.type, user=args.user, scene=args.scene, model=args.model, mode=args.mode,
+            result=args.result, failed=True if args.failed else None,
+            start=args.start, end=args.end, limit=args.limit, offset=args.offset
+        )
+        for entry in entries:
+            print(json.dumps(entry, ensure_ascii=False))
+        print(f"-- {len(entries)} of {total} matching events")
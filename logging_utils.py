@@ -1,89 +1,424 @@
-# logging_utils.py
-# 日志相关工具
-import os
-import json
-from datetime import datetime,timedelta
-from collections import defaultdict
-
-LOG_DIR = "/opt/nav-fronted/logs"
-ACCESS_LOG = os.path.join(LOG_DIR, "access.log")
-SUBMISSION_LOG = os.path.join(LOG_DIR, "submissions.log")
-
-os.makedirs(LOG_DIR, exist_ok=True)
-
-IP_REQUEST_RECORDS = defaultdict(list)
-IP_LIMIT = 5
-
-def is_request_allowed(ip: str) -> bool:
-    now = datetime.now()
-    IP_REQUEST_RECORDS[ip] = [t for t in IP_REQUEST_RECORDS[ip] if now - t < timedelta(minutes=1)]
-    if len(IP_REQUEST_RECORDS[ip]) < IP_LIMIT:
-        IP_REQUEST_RECORDS[ip].append(now)
-        return True
-    return False
-
-def log_access(user_ip: str = None, user_agent: str = None):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "type": "access",
-        "user_ip": user_ip or "unknown",
-        "user_agent": user_agent or "unknown"
-    }
-    with open(ACCESS_LOG, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
-
-def log_submission(scene: str, prompt: str, model: str, user: str = "anonymous", res: str = "unknown"):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = {
-        "timestamp": timestamp,
-        "type": "submission",
-        "user": user,
-        "scene": scene,
-        "prompt": prompt,
-        "model": model,
-        "res": res
-    }
-    with open(SUBMISSION_LOG, "a") as f:
-        f.write(json.dumps(log_entry) + "\n")
-
-def read_logs(log_type: str = "all", max_entries: int = 50) -> list:
-    logs = []
-    if log_type in ["all", "access"]:
-        try:
-            with open(ACCESS_LOG, "r") as f:
-                for line in f:
-                    logs.append(json.loads(line.strip()))
-        except FileNotFoundError:
-            pass
-    if log_type in ["all", "submission"]:
-        try:
-            with open(SUBMISSION_LOG, "r") as f:
-                for line in f:
-                    logs.append(json.loads(line.strip()))
-        except FileNotFoundError:
-            pass
-    logs.sort(key=lambda x: x["timestamp"], reverse=True)
-    return logs[:max_entries]
-
-def format_logs_for_display(logs: list) -> str:
-    if not logs:
-        return "No log record"
-    markdown = "### System Access Log\n\n"
-    markdown += "| Time | Type | User/IP | Details |\n"
-    markdown += "|------|------|---------|----------|\n"
-    for log in logs:
-        timestamp = log.get("timestamp", "unknown")
-        log_type = "Access" if log.get("type") == "access" else "Submission"
-        if log_type == "Access":
-            user = log.get("user_ip", "unknown")
-            details = f"User-Agent: {log.get('user_agent', 'unknown')}"
-        else:
-            user = log.get("user", "anonymous")
-            result = log.get('res', 'unknown')
-            if result != "success":
-                if len(result) > 40:
-                    result = f"{result[:20]}...{result[-20:]}"
-            details = f"Scene: {log.get('scene', 'unknown')}, Prompt: {log.get('prompt', '')}, Model: {log.get('model', 'unknown')}, result: {result}"
-        markdown += f"| {timestamp} | {log_type} | {user} | {details} |\n"
-    return markdown
+# logging_utils.py
+# 日志相关工具
+import os
+import json
+import uuid
+import queue
+import atexit
+import threading
+import time
+import heapq
+from datetime import datetime
+from itertools import islice
+import log_archive
+import log_store
+import log_index
+from analytics import USAGE_ANALYTICS
+from state_store import STATE_STORE
+
+LOG_DIR = "/opt/nav-fronted/logs"
+ACCESS_LOG = os.path.join(LOG_DIR, "access.log")
+SUBMISSION_LOG = os.path.join(LOG_DIR, "submissions.log")
+
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# 后台写日志的队列容量、每批最多行数、最长攒批时间(秒)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "0.5"))
+# 每个日志文件最多隔多久检查一次是否需要轮转，轮转后延迟多久开始压缩(秒)
+ROTATE_CHECK_INTERVAL = float(os.getenv("LOG_ROTATE_CHECK_INTERVAL", "10"))
+ROTATE_COMPRESS_DELAY = 2.0
+# 倒序读取日志时每次读入的块大小
+READ_BLOCK_SIZE = 64 * 1024
+
+# 每个 IP 每分钟最多提交次数；压测时可通过环境变量放开
+IP_LIMIT = int(os.getenv("IP_LIMIT", "5"))
+
+
+class LogWriter:
+    """后台日志写入：请求线程只负责入队，由单个线程批量追加写入文件。
+
+    每个日志文件只保持一个 O_APPEND 句柄，每批数据用一次 write 写完整行，
+    多个 worker/进程并发写也不会出现半行交错。队列满时丢弃并计数。
+    每条日志写入前分配一个随机的 event_id，内容完全相同的两条事件也能区分开。
+    """
+
+    _STOP = object()
+
+    def __init__(self, queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._fds = {}
+        self._rotate_checked = {}
+        self._listeners = []
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0
+        self.written = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, path: str, entry: dict) -> bool:
+        entry.setdefault("event_id", uuid.uuid4().hex)
+        if self._closed:
+            self._write(path, [entry])
+            return True
+        self.start()
+        try:
+            self._queue.put_nowait((path, entry))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待此前入队的日志全部落盘"""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: float = 5.0):
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.put(self._STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        for fd in self._fds.values():
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds.clear()
+
+    def _run(self):
+        pending = {}
+        count = 0
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            waiters = []
+            stop = False
+            if item is self._STOP:
+                stop = True
+            elif isinstance(item, threading.Event):
+                waiters.append(item)
+            elif item is not None:
+                path, entry = item
+                pending.setdefault(path, []).append(entry)
+                count += 1
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            # 攒满一批、超时、需要 flush 或退出时落盘
+            if count and (count >= self.batch_size or item is None or waiters or stop
+                          or time.monotonic() >= deadline):
+                for path, entries in pending.items():
+                    self._write(path, entries)
+                pending = {}
+                count = 0
+                deadline = None
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                break
+
+    def _open(self, path: str) -> int:
+        fd = self._fds.get(path)
+        if fd is not None:
+            # 文件被（本进程或其他进程）轮转改名后需要重新打开
+            try:
+                stale = os.fstat(fd).st_ino != os.stat(path).st_ino
+            except FileNotFoundError:
+                stale = True
+            if stale:
+                os.close(fd)
+                fd = None
+        now = time.monotonic()
+        if now - self._rotate_checked.get(path, 0) >= ROTATE_CHECK_INTERVAL:
+            if path not in self._rotate_checked:
+                # 首次写入该日志时顺带压缩上次退出前遗留的轮转文件
+                threading.Thread(target=log_archive.compress_pending, args=(path,), daemon=True).start()
+            self._rotate_checked[path] = now
+            if log_archive.should_rotate(path):
+                pending = log_archive.detach(path)
+                if fd is not None:
+                    os.close(fd)
+                    fd = None
+                if pending:
+                    # 稍等片刻再压缩，让其他进程把已打开句柄上的最后一批写完
+                    timer = threading.Timer(ROTATE_COMPRESS_DELAY, log_archive.compress_segment, args=(pending,))
+                    timer.daemon = True
+                    timer.start()
+        if fd is None:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fds[path] = fd
+        return fd
+
+    def add_listener(self, listener):
+        """注册写入回调 listener(path, entries)，在写入线程中每批落盘后调用"""
+        self._listeners.append(listener)
+
+    def _write(self, path: str, entries: list):
+        data = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+        try:
+            fd = self._open(path)
+            while data:
+                written = os.write(fd, data)
+                data = data[written:]
+            self.written += len(entries)
+        except OSError:
+            self.dropped += len(entries)
+            return
+        for listener in self._listeners:
+            try:
+                listener(path, entries)
+            except Exception:
+                pass
+
+
+LOG_WRITER = LogWriter()
+atexit.register(LOG_WRITER.close)
+if log_store.ENABLED:
+    LOG_WRITER.add_listener(log_store.get_store().on_logs_written)
+
+def is_request_allowed(ip: str) -> bool:
+    # 限流记录放在共享状态存储里，多个前端进程共用同一个计数
+    return STATE_STORE.allow_request(f"ip:{ip}", IP_LIMIT, 60)
+
+def log_access(user_ip: str = None, user_agent: str = None):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = {
+        "timestamp": timestamp,
+        "type": "access",
+        "user_ip": user_ip or "unknown",
+        "user_agent": user_agent or "unknown"
+    }
+    LOG_WRITER.submit(ACCESS_LOG, log_entry)
+
+def log_submission(scene: str, prompt: str, model: str, user: str = "anonymous", res: str = "unknown",
+                   mode: str = None, **fields):
+    """fields 为附加的结构化字段（如 timeline、counters），原样写入日志条目"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_entry = {
+        "timestamp": timestamp,
+        "type": "submission",
+        "user": user,
+        "scene": scene,
+        "prompt": prompt,
+        "model": model,
+        "res": res
+    }
+    if mode is not None:
+        log_entry["mode"] = mode
+    log_entry.update(fields)
+    USAGE_ANALYTICS.record(log_entry)
+    LOG_WRITER.submit(SUBMISSION_LOG, log_entry)
+
+def _read_lines_reversed(path: str, block_size: int = READ_BLOCK_SIZE, size: int = None):
+    """从文件末尾（或第 size 字节处）按块倒着读，逐行产出（最新的一行最先）"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        if size is not None:
+            pos = min(pos, size)
+        tail = b""
+        while pos > 0:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + tail).split(b"\n")
+            tail = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line
+        if tail.strip():
+            yield tail
+
+def _iter_entries_reversed(path: str, include_archive: bool = True, size: int = None):
+    for line in _read_lines_reversed(path, size=size):
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+    if include_archive:
+        # 当前文件读完后接着读轮转出去的旧日志（先待压缩文件，再压缩段，均从新到旧）
+        for pending in reversed(log_archive.pending_files(path)):
+            yield from _iter_entries_reversed(pending, include_archive=False)
+        for index in reversed(log_archive.list_segments(path)):
+            yield from log_archive.iter_segment_reversed(index)
+
+def read_logs(log_type: str = "all", max_entries: int = 50, sizes: dict = None) -> list:
+    """sizes 为 {日志路径: 字节数}，只读取当前文件的前这么多字节（与之后的增量读取衔接）"""
+    # 两个日志文件各自按时间追加，倒序读取后做堆归并，只解析需要的条目
+    sizes = sizes or {}
+    streams = []
+    if log_type in ["all", "access"]:
+        streams.append(_iter_entries_reversed(ACCESS_LOG, size=sizes.get(ACCESS_LOG)))
+    if log_type in ["all", "submission"]:
+        streams.append(_iter_entries_reversed(SUBMISSION_LOG, size=sizes.get(SUBMISSION_LOG)))
+    merged = heapq.merge(*streams, key=lambda x: x.get("timestamp", ""), reverse=True)
+    return list(islice(merged, max_entries))
+
+def query_logs(log_type: str = "all", limit: int = 50, offset: int = 0, **filters) -> tuple:
+    """按条件分页查询日志（新到旧），返回 (条目列表, 总数)
+
+    可用条件: user, scene, model, mode, result, failed, start, end。
+    启用 SQLite 日志库时走数据库查询，否则使用 JSONL 日志的稀疏偏移索引，已轮转的归档段也在查询范围内。
+    """
+    store = log_store.get_store()
+    if store is not None:
+        return store.query(log_type, limit=limit, offset=offset, **filters)
+    paths = []
+    submission_only = any(filters.get(k) not in (None, "") for k in log_index.SUBMISSION_FIELDS)
+    if log_type in ["all", "access"] and not submission_only:
+        paths.append(ACCESS_LOG)
+    if log_type in ["all", "submission"]:
+        paths.append(SUBMISSION_LOG)
+    if not paths:
+        return [], 0
+    return log_index.query(paths, limit=limit, offset=offset, **filters)
+
+LOG_TABLE_HEADER = (
+    "### System Access Log\n\n"
+    "| Time | Type | User/IP | Details |\n"
+    "|------|------|---------|----------|\n"
+)
+
+def format_log_row(log: dict) -> str:
+    timestamp = log.get("timestamp", "unknown")
+    log_type = "Access" if log.get("type") == "access" else "Submission"
+    if log_type == "Access":
+        user = log.get("user_ip", "unknown")
+        details = f"User-Agent: {log.get('user_agent', 'unknown')}"
+    else:
+        user = log.get("user", "anonymous")
+        result = log.get('res', 'unknown')
+        if result != "success":
+            if len(result) > 40:
+                result = f"{result[:20]}...{result[-20:]}"
+        details = f"Scene: {log.get('scene', 'unknown')}, Prompt: {log.get('prompt', '')}, Model: {log.get('model', 'unknown')}, result: {result}"
+    return f"| {timestamp} | {log_type} | {user} | {details} |\n"
+
+def format_logs_for_display(logs: list) -> str:
+    if not logs:
+        return "No log record"
+    return LOG_TABLE_HEADER + "".join(format_log_row(log) for log in logs)
+
+def _file_state(path: str):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _complete_size(path: str, size: int, block_size: int = READ_BLOCK_SIZE) -> int:
+    """文件前 size 字节中最后一个完整行的结束位置"""
+    try:
+        with open(path, "rb") as f:
+            pos = size
+            while pos > 0:
+                step = min(block_size, pos)
+                f.seek(pos - step)
+                end = f.read(step).rfind(b"\n")
+                if end >= 0:
+                    return pos - step + end + 1
+                pos -= step
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+class LogRenderCache:
+    """日志面板渲染缓存：按两个日志文件的 (inode, size, mtime) 判断是否变化。
+
+    文件未变直接返回上次的 markdown；只是追加了新行时只解析新增部分并插到表格最前面；
+    轮转或被截断时（inode 变化或文件变小）整体重建。
+    """
+
+    def __init__(self, max_entries: int = 50):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._states = None
+        self._offsets = {}
+        self._entries = []
+        self._rows = []
+        self._markdown = None
+
+    def render(self) -> str:
+        paths = (ACCESS_LOG, SUBMISSION_LOG)
+        with self._lock:
+            states = {path: _file_state(path) for path in paths}
+            if states == self._states and self._markdown is not None:
+                return self._markdown
+            new_entries = self._read_appended(states) if self._states is not None else None
+            if new_entries is None:
+                # 只读到 stat 时的最后一个完整行，之后追加的行留给下次增量读取，不会重复显示
+                self._offsets = {path: _complete_size(path, state[1]) if state else 0
+                                 for path, state in states.items()}
+                self._entries = read_logs("all", self.max_entries, sizes=self._offsets)
+                self._rows = [format_log_row(entry) for entry in self._entries]
+            elif new_entries:
+                new_entries.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+                self._entries = new_entries[:self.max_entries] + self._entries
+                self._rows = [format_log_row(entry) for entry in new_entries[:self.max_entries]] + self._rows
+                del self._entries[self.max_entries:]
+                del self._rows[self.max_entries:]
+            self._states = states
+            self._markdown = LOG_TABLE_HEADER + "".join(self._rows) if self._rows else "No log record"
+            return self._markdown
+
+    def _read_appended(self, states: dict):
+        """只读取上次之后追加的完整行；无法增量时返回 None 触发重建"""
+        appended = []
+        for path, state in states.items():
+            old = self._states.get(path)
+            if state == old:
+                continue
+            if state is None or (old is not None and state[0] != old[0]):
+                return None
+            offset = self._offsets.get(path, 0) if old is not None else 0
+            if state[1] < offset:
+                return None
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(state[1] - offset)
+            # 只消费到最后一个换行，残缺的行留到下次
+            end = data.rfind(b"\n") + 1
+            self._offsets[path] = offset + end
+            for line in data[:end].splitlines():
+                try:
+                    appended.append(json.loads(line))
+                except ValueError:
+                    continue
+        return appended
+
+
+LOG_RENDER_CACHE = LogRenderCache()
@@ -1,269 +1,656 @@
-# main.py
-# 主入口文件，负责启动 Gradio UI
-import gradio as gr
-from config import SCENE_CONFIGS, MODEL_CHOICES, MODE_CHOICES
-from backend_api import submit_to_backend, get_task_status, get_task_result
-from logging_utils import log_access, log_submission, is_request_allowed
-from simulation import stream_simulation_results, convert_to_h264
-from ui_components import update_history_display, update_scene_display, update_log_display, get_scene_instruction
-import os
-from datetime import datetime
-
-SESSION_TASKS = {}
-
-def run_simulation(scene, model, mode, prompt, history, request: gr.Request):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    scene_desc = SCENE_CONFIGS.get(scene, {}).get("description", scene)
-    user_ip = request.client.host if request else "unknown"
-    session_id = request.session_hash
-    if not is_request_allowed(user_ip):
-        log_submission(scene, prompt, model, user_ip, "IP blocked temporarily")
-        raise gr.Error("Too many requests from this IP. Please wait and try again one minute later.")
-    # 传递model和mode给后端
-    #submission_result = submit_to_backend(scene, prompt, user=model)  # 可根据后端接口调整
-    submission_result = submit_to_backend(scene, prompt, mode, model, user_ip)
-    if submission_result.get("status") != "pending":
-        log_submission(scene, prompt, model, user_ip, "Submission failed")
-        raise gr.Error(f"Submission failed: {submission_result.get('message', 'unknown issue')}")
-    try:
-        task_id = submission_result["task_id"]
-        SESSION_TASKS[session_id] = task_id
-        gr.Info(f"Simulation started, task_id: {task_id}")
-        import time
-        time.sleep(5)
-        status = get_task_status(task_id)
-        result_folder = status.get("result", "")
-    except Exception as e:
-        log_submission(scene, prompt, model, user_ip, str(e))
-        raise gr.Error(f"error occurred when parsing submission result from backend: {str(e)}")
-    if not os.path.exists(result_folder):
-        log_submission(scene, prompt, model, user_ip, "Result folder provided by backend doesn't exist")
-        raise gr.Error(f"Result folder provided by backend doesn't exist: <PATH>{result_folder}")
-    try:
-        for video_path in stream_simulation_results(result_folder, task_id):
-            if video_path:
-                yield video_path, history
-    except Exception as e:
-        log_submission(scene, prompt, model, user_ip, str(e))
-        raise gr.Error(f"流式输出过程中出错: {str(e)}")
-    status = get_task_status(task_id)
-    if status.get("status") == "completed":
-        video_path = os.path.join(status.get("result"), "output.mp4")
-        video_path = convert_to_h264(video_path)
-        new_entry = {
-            "timestamp": timestamp,
-            "scene": scene,
-            "model": model,
-            "mode": mode,
-            "prompt": prompt,
-            "video_path": video_path
-        }
-        updated_history = history + [new_entry]
-        if len(updated_history) > 10:
-            updated_history = updated_history[:10]
-        log_submission(scene, prompt, model, user_ip, "success")
-        gr.Info("Simulation completed successfully!")
-        yield None, updated_history
-    elif status.get("status") == "failed":
-        log_submission(scene, prompt, model, user_ip, status.get('result', 'backend error'))
-        raise gr.Error(f"任务执行失败: {status.get('result', 'backend 未知错误')}")
-        yield None, history
-    elif status.get("status") == "terminated":
-        log_submission(scene, prompt, model, user_ip, "terminated")
-        video_path = os.path.join(result_folder, "output.mp4")
-        if os.path.exists(video_path):
-            return f"⚠️ 任务 {task_id} 被终止，已生成部分结果", video_path, history
-        else:
-            return f"⚠️ 任务 {task_id} 被终止，未生成结果", None, history
-    else:
-        log_submission(scene, prompt, model, user_ip, "missing task's status from backend")
-        raise gr.Error("missing task's status from backend")
-        yield None, history
-
-def cleanup_session(request: gr.Request):
-    session_id = request.session_hash
-    task_id = SESSION_TASKS.pop(session_id, None)
-    from config import BACKEND_URL
-    import requests
-    if task_id:
-        try:
-            requests.post(f"{BACKEND_URL}/predict/terminate/{task_id}", timeout=3)
-        except Exception:
-            pass
-
-def record_access(request: gr.Request):
-    user_ip = request.client.host if request else "unknown"
-    user_agent = request.headers.get("user-agent", "unknown")
-    log_access(user_ip, user_agent)
-    return update_log_display()
-
-
-
-custom_css = """
-#simulation-panel {
-    border-radius: 8px;
-    padding: 20px;
-    background: #f9f9f9;
-    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-}
-#result-panel {
-    border-radius: 8px;
-    padding: 20px;
-    background: #f0f8ff;
-}
-.dark #simulation-panel { background: #2a2a2a; }
-.dark #result-panel { background: #1a2a3a; }
-.history-container {
-    max-height: 600px;
-    overflow-y: auto;
-    margin-top: 20px;
-}
-.history-accordion {
-    margin-bottom: 10px;
-}
-"""
-
-header_html = """
-<div style="display: flex; justify-content: space-between; align-items: center; width: 100%; margin-bottom: 20px; padding: 20px; background: linear-gradient(135deg, #e0e5ec 0%, #a7b5d0 100%); border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
-    <div style="display: flex; align-items: center;">
-        <img src="https://www.shlab.org.cn/static/img/index_14.685f6559.png" alt="Institution Logo" style="height: 60px; margin-right: 20px;">
-        <div>
-            <h1 style="margin: 0; color: #2c3e50; font-weight: 600;">🤖 InternManip Model Inference Demo</h1>
-            <p style="margin: 4px 0 0 0; color: #5d6d7e; font-size: 0.9em;">Model trained on InternManip framework</p>
-        </div>
-    </div>
-    <div style="display: flex; gap: 15px; align-items: center;">
-        <a href="https://github.com/OpenRobotLab" target="_blank" style="text-decoration: none; transition: transform 0.2s;" onmouseover="this.style.transform='scale(1.1)'" onmouseout="this.style.transform='scale(1)'">
-            <img src="https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png" alt="GitHub" style="height: 30px;">
-        </a>
-        <a href="https://huggingface.co/OpenRobotLab" target="_blank" style="text-decoration: none; transition: transform 0.2s;" onmouseover="this.style.transform='scale(1.1)'" onmouseout="this.style.transform='scale(1)'">
-            <img src="https://huggingface.co/front/assets/huggingface_logo-noborder.svg" alt="HuggingFace" style="height: 30px;">
-        </a>
-        <a href="http://123.57.187.96:55004/" target="_blank">
-            <button style="padding: 8px 15px; background: #3498db; color: white; border: none; border-radius: 4px; cursor: pointer; font-weight: 500; transition: all 0.2s;" 
-                    onmouseover="this.style.backgroundColor='#2980b9'; this.style.transform='scale(1.05)'" 
-                    onmouseout="this.style.backgroundColor='#3498db'; this.style.transform='scale(1)'">
-                Go to InternManip Demo
-            </button>
-        </a>
-    </div>
-</div>
-"""
-
-
-
-with gr.Blocks(title="InternNav Model Inference Demo", css=custom_css) as demo:
-    gr.HTML(header_html)
-    
-    history_state = gr.State([])
-    with gr.Row():
-        with gr.Column(elem_id="simulation-panel"):
-            gr.Markdown("### Simulation Settings")
-            scene_dropdown = gr.Dropdown(
-                label="Choose a scene",
-                choices=list(SCENE_CONFIGS.keys()),
-                value="demo1",
-                interactive=True
-            )
-            scene_description = gr.Markdown("")
-            scene_preview = gr.Image(
-                label="Scene Preview",
-                elem_classes=["scene-preview"],
-                interactive=False
-            )
-            prompt_input = gr.Textbox(
-                label="Navigation Prompt",
-                value="Walk past the left side of the bed and stop in the doorway.",
-                placeholder="e.g.: 'Walk past the left side of the bed and stop in the doorway.'",
-                lines=2,
-                max_lines=4
-            )
-            model_dropdown = gr.Dropdown(
-                label="Chose a pretrained model",
-                choices=MODEL_CHOICES,
-                value=MODEL_CHOICES[0],
-                interactive=True
-            )
-            mode_dropdown = gr.Dropdown(
-                label="Select Mode",
-                choices=MODE_CHOICES,
-                value=MODE_CHOICES[0],
-                interactive=True
-            )
-            scene_dropdown.change(
-                fn=lambda scene: [update_scene_display(scene)[0], update_scene_display(scene)[1], get_scene_instruction(scene)],
-                inputs=scene_dropdown,
-                outputs=[scene_description, scene_preview, prompt_input]
-            )
-            
-            submit_btn = gr.Button("Start Navigation Simulation", variant="primary")
-        with gr.Column(elem_id="result-panel"):
-            gr.Markdown("### Latest Simulation Result")
-            video_output = gr.Video(
-                label="Live",
-                interactive=False,
-                format="mp4",
-                autoplay=True,
-                streaming=True
-            )
-            with gr.Column() as history_container:
-                gr.Markdown("### History")
-                gr.Markdown("#### History will be reset after refresh")
-                history_slots = []
-                for i in range(10):
-                    with gr.Column(visible=False) as slot:
-                        with gr.Accordion(visible=False, open=False) as accordion:
-                            video = gr.Video(interactive=False)
-                            detail_md = gr.Markdown()
-                    history_slots.append((slot, accordion, video, detail_md))
-    with gr.Accordion("查看系统访问日志(DEV ONLY)", open=False):
-        logs_display = gr.Markdown()
-        refresh_logs_btn = gr.Button("刷新日志", variant="secondary")
-        refresh_logs_btn.click(
-            update_log_display,
-            outputs=logs_display
-        )
-    gr.Examples(
-        examples=[
-            ["demo1", "rdp", "vlnPE", "Walk past the left side of the bed and stop in the doorway."],
-            ["demo2", "rdp", "vlnPE", "Walk through the bathroom, past the sink and toilet. Stop in front of the counter with the two suitcase."],
-            ["demo3", "rdp", "vlnPE", "Do a U-turn. Walk forward through the kitchen, heading to the black door. Walk out of the door and take a right onto the deck. Walk out on to the deck and stop."],
-            ["demo4", "rdp", "vlnPE", "Walk out of bathroom and stand on white bath mat."],
-            ["demo5", "rdp", "vlnPE", "Walk straight through the double wood doors, follow the red carpet straight to the next doorway and stop where the carpet splits off."]
-        ],
-        inputs=[scene_dropdown, model_dropdown, mode_dropdown, prompt_input],
-        label="Navigation Task Examples"
-    )
-    submit_btn.click(
-        fn=run_simulation,
-        inputs=[scene_dropdown, model_dropdown, mode_dropdown, prompt_input, history_state],
-        outputs=[video_output, history_state],
-        queue=True,
-        api_name="run_simulation"
-    ).then(
-        fn=update_history_display,
-        inputs=history_state,
-        outputs=[comp for slot in history_slots for comp in slot],
-        queue=True
-    ).then(
-        fn=update_log_display,
-        outputs=logs_display,
-    )
-    demo.load(
-        fn=lambda: update_scene_display("demo1"),
-        outputs=[scene_description, scene_preview]
-    ).then(
-        fn=update_log_display,
-        outputs=logs_display
-    )
-    demo.load(
-        fn=record_access,
-        inputs=None,
-        outputs=logs_display,
-        queue=False
-    )
-    demo.queue(default_concurrency_limit=8)
-    demo.unload(fn=cleanup_session)
-
-if __name__ == "__main__":
-    demo.launch(server_name="0.0.0.0", server_port=55005, share=False, debug=True, allowed_paths=["/opt"])
\ No newline at end of file
+# main.py
+# 主入口文件，负责启动 Gradio UI
+import gradio as gr
+from config import SCENE_CONFIGS, MODEL_CHOICES, MODE_CHOICES, EXAMPLES
+from backend_api import submit_to_backend, get_task_status, get_task_result, terminate_task
+from backend_pool import BACKEND_POOL
+from logging_utils import log_access, log_submission, is_request_allowed, SUBMISSION_LOG, LOG_WRITER
+from analytics import USAGE_ANALYTICS
+from simulation import stream_simulation_results, convert_to_h264, stall_timeout, SimulationCancelled, SimulationStalled
+from ui_components import update_history_display, update_scene_display, update_log_display, update_log_viewer, update_analytics_display, update_profiler_display, toggle_profiler, update_backend_status, get_scene_instruction
+from metrics import counter, gauge, histogram, REGISTRY, CONTENT_TYPE
+from task_stats import TaskStats
+from tracing import TRACER
+from job_registry import JOB_REGISTRY
+from profiler import PROFILER
+from session_registry import SESSIONS, SESSION_HEARTBEAT_INTERVAL
+from inflight import INFLIGHT, DRAINING, RESUME_GRACE, install_drain
+from broadcast import BROADCAST
+from admission import ADMISSION, is_example, ADMISSION_MAX_CAPACITY, ADMISSION_MAX_QUEUE, ADMISSION_SHED, ADMISSION_TARGET_START, format_queue_status
+import os
+import time
+import asyncio
+from datetime import datetime
+
+# 心跳超时的会话由后台线程终止其后端任务
+SESSIONS.start_reaper(terminate_task)
+BACKEND_POOL.start()
+ADMISSION.poll_backend_capacity()
+
+RUN_STARTED = counter("nav_simulations_started_total", "Simulations submitted to the backend", ("scene", "model"))
+RATE_LIMIT_REJECTIONS = counter("nav_rate_limit_rejections_total", "Requests rejected by the per-IP rate limit")
+ACTIVE_SIMULATIONS = gauge("nav_active_simulations", "run_simulation calls currently in progress")
+TIME_TO_FIRST_FRAME = histogram("nav_time_to_first_frame_seconds", "Time from request (including queueing) to the first streamed segment", ("scene", "model"))
+CANCELLED_TASKS = counter("nav_simulations_cancelled_total", "Running backend tasks terminated early on stop, disconnect or stall", ("reason",))
+STALLED_TASKS = counter("nav_simulations_stalled_total", "Tasks terminated by the stall watchdog", ("scene", "mode"))
+GPU_SECONDS_SAVED = counter("nav_cancel_gpu_seconds_saved_total", "Estimated backend GPU seconds saved by terminating cancelled tasks", ("reason",))
+RESUMED_STREAMS = counter("nav_resumed_streams_total", "Streams reattached to an in-flight task via ?task=")
+END_TO_END_SECONDS = histogram("nav_simulation_seconds", "End-to-end time of successful simulations, from request (including queueing) to the final video", ("scene", "model"))
+gauge("nav_draining", "1 while the process is draining before shutdown").set_function(lambda: int(DRAINING.is_set()))
+gauge("nav_session_tasks", "Backend tasks tracked for cleanup by session").set_function(SESSIONS.task_count)
+gauge("nav_log_queue_length", "Log entries waiting to be written").set_function(LOG_WRITER.qsize)
+gauge("nav_log_dropped", "Log entries dropped because the writer queue was full").set_function(lambda: LOG_WRITER.dropped)
+
+# 启动时从提交日志重建使用统计，之后随 log_submission 增量更新
+USAGE_ANALYTICS.rebuild_async(SUBMISSION_LOG)
+
+def run_simulation(scene, model, mode, prompt, history, request: gr.Request):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 从收到请求开始计时，首帧时间和端到端耗时包含排队时间
+    stats = TaskStats()
+    scene_desc = SCENE_CONFIGS.get(scene, {}).get("description", scene)
+    user_ip = request.client.host if request else "unknown"
+    session_id = request.session_hash
+    SESSIONS.heartbeat(session_id)
+    if DRAINING.is_set():
+        raise gr.Error("The server is restarting. Please try again in a minute.")
+    if not is_request_allowed(user_ip):
+        RATE_LIMIT_REJECTIONS.inc()
+        log_submission(scene, prompt, model, user_ip, "IP blocked temporarily", mode=mode)
+        raise gr.Error("Too many requests from this IP. Please wait and try again one minute later.")
+    if BACKEND_POOL.unavailable():
+        # 所有后端都熔断时直接失败，不进入排队
+        log_submission(scene, prompt, model, user_ip, "Rejected: backend circuit open", mode=mode)
+        raise gr.Error(BACKEND_POOL.describe())
+    ticket = ADMISSION.try_enqueue(user_ip, priority=is_example(scene, model, mode, prompt))
+    if ticket is None:
+        # 队列已满：有历史结果就返回历史结果，否则直接拒绝
+        cached, exact = ADMISSION.cached_result(scene, model, mode, prompt)
+        ADMISSION_SHED.labels("yes" if cached else "no").inc()
+        log_submission(scene, prompt, model, user_ip, "Rejected: admission queue full", mode=mode)
+        if cached is None:
+            raise gr.Error("The service is busy right now. Please try again in a few minutes.")
+        source = "an identical earlier run" if exact else f"an earlier run in {scene}"
+        gr.Warning(f"The service is busy right now, showing the result of {source} instead.")
+        yield cached, history, f"⚠️ Service busy, showing the result of {source}."
+        return
+    # Stop 按钮和页面关闭通过 scope 通知本次运行尽快结束
+    scope = SESSIONS.open_scope(session_id)
+    try:
+        waited = False
+        while not ticket.wait(1):
+            if scope.cancelled:
+                break
+            waited = True
+            yield gr.skip(), gr.skip(), format_queue_status(ADMISSION, max(0, ADMISSION.position(ticket)))
+        if waited:
+            yield gr.skip(), gr.skip(), ""
+    except BaseException:
+        # 排队期间出错或客户端断开
+        ADMISSION.cancel(ticket)
+        SESSIONS.close_scope(session_id, scope)
+        raise
+    if scope.cancelled:
+        ADMISSION.cancel(ticket)
+        SESSIONS.close_scope(session_id, scope)
+        log_submission(scene, prompt, model, user_ip, f"Cancelled while queued ({scope.reason})", mode=mode)
+        yield gr.skip(), gr.skip(), "⏹️ Simulation stopped."
+        return
+    RUN_STARTED.labels(scene, model).inc()
+    ACTIVE_SIMULATIONS.inc()
+    stats.mark("admitted")
+    # 同一会话重复提交相同请求时复用进行中任务（或上次结果不确定的提交）的 job_id，后端不会再启动一个新任务。
+    # 按会话而不是 IP 区分，同一 NAT/代理后的不同用户（以及压测客户端）不会被合并
+    job_id = JOB_REGISTRY.acquire((session_id, scene, model, mode, prompt.strip()))
+    trace = TRACER.start_trace()
+    task_id, task_finished = None, False
+    try:
+        # 传递model和mode给后端
+        #submission_result = submit_to_backend(scene, prompt, user=model)  # 可根据后端接口调整
+        with stats.measure("submit"), trace.span("backend.submit", scene=scene, model=model, mode=mode) as attrs:
+            submission_result = submit_to_backend(scene, prompt, mode, model, user_ip, job_id=job_id)
+            attrs["status"] = submission_result.get("status")
+            attrs["deduplicated"] = bool(submission_result.get("deduplicated"))
+        stats.mark("submitted")
+        if submission_result.get("status") != "pending":
+            ADMISSION.release(ticket, overloaded=bool(submission_result.get("overloaded")))
+            log_submission(scene, prompt, model, user_ip, "Submission failed", mode=mode, **stats.to_dict())
+            raise gr.Error(f"Submission failed: {submission_result.get('message', 'unknown issue')}")
+        try:
+            task_id = submission_result["task_id"]
+            TRACER.bind(trace, task_id)
+            SESSIONS.add_task(session_id, task_id)
+            if submission_result.get("deduplicated"):
+                gr.Info(f"Same request is already running, following task_id: {task_id}")
+            else:
+                gr.Info(f"Simulation started, task_id: {task_id}")
+            with trace.span("wait_for_start"):
+                scope.wait(5)
+            with trace.span("backend.status_poll") as attrs:
+                status = get_task_status(task_id)
+                attrs["status"] = status.get("status")
+            result_folder = status.get("result", "")
+        except Exception as e:
+            log_submission(scene, prompt, model, user_ip, str(e), mode=mode, **stats.to_dict())
+            raise gr.Error(f"error occurred when parsing submission result from backend: {str(e)}")
+        if not os.path.exists(result_folder):
+            log_submission(scene, prompt, model, user_ip, "Result folder provided by backend doesn't exist", mode=mode, **stats.to_dict())
+            raise gr.Error(f"Result folder provided by backend doesn't exist: <PATH>{result_folder}")
+        stats.mark("result_folder")
+        # 记录进行中的任务，页面刷新或进程重启后可以重新连接；跟随已有任务的请求不重复记录
+        recording = not submission_result.get("deduplicated")
+        if recording:
+            resume_key = INFLIGHT.start(task_id, scene=scene, model=model, mode=mode, prompt=prompt, user=user_ip,
+                                        result_folder=result_folder, trace_id=trace.trace_id)
+        else:
+            resume_key = INFLIGHT.resume_key(task_id)
+        try:
+            first_frame = True
+            stream = stream_simulation_results(result_folder, task_id, stats=stats, trace=trace, cancel=scope,
+                                               stall_after=stall_timeout(scene, mode))
+            for video_path in PROFILER.wrap_generator(stream, trace.trace_id):
+                if video_path:
+                    if first_frame:
+                        # 用户看到第一段视频的时间
+                        TIME_TO_FIRST_FRAME.labels(scene, model).observe(stats.elapsed())
+                        first_frame = False
+                    if recording:
+                        INFLIGHT.add_segment(task_id, video_path)
+                    yield video_path, history, stream_status(task_id, resume_key)
+        except SimulationStalled as e:
+            # 后端任务卡住：按取消处理，finally 中立即终止任务并释放名额
+            STALLED_TASKS.labels(scene, mode).inc()
+            scope.cancel("stall")
+            log_submission(scene, prompt, model, user_ip, "stalled", mode=mode, stall_seconds=round(e.stalled_for, 1),
+                           stall_last_status=e.last_status, **stats.to_dict())
+            raise gr.Error(f"The simulation stopped making progress for {e.stalled_for:.0f}s and was terminated.")
+        except Exception as e:
+            log_submission(scene, prompt, model, user_ip, str(e), mode=mode, **stats.to_dict())
+            raise gr.Error(f"流式输出过程中出错: {str(e)}")
+        if scope.cancelled:
+            log_submission(scene, prompt, model, user_ip, cancel_result(scope), mode=mode, **stats.to_dict())
+            yield gr.skip(), gr.skip(), "⏹️ Simulation stopped."
+            return
+        stats.mark("completed")
+        with trace.span("backend.status_poll") as attrs:
+            status = get_task_status(task_id)
+            attrs["status"] = status.get("status")
+        task_finished = status.get("status") in ("completed", "failed", "terminated")
+        # 后端任务已结束，先归还名额再做最终转码；提交后迟迟不出帧说明后端在排队
+        submitted = stats.marks.get("submitted", 0.0)
+        start_delay = stats.marks.get("first_frame", stats.elapsed()) - submitted
+        ADMISSION.release(ticket, overloaded=start_delay > ADMISSION_TARGET_START,
+                          service_seconds=stats.elapsed() - submitted)
+        if status.get("status") == "completed":
+            video_path = os.path.join(status.get("result"), "output.mp4")
+            try:
+                with stats.measure("finalize"), PROFILER.attach(trace.trace_id):
+                    video_path = convert_to_h264(video_path, stats=stats, trace=trace, cancel=scope)
+                if recording:
+                    INFLIGHT.complete(task_id, video_path)
+            except SimulationCancelled:
+                log_submission(scene, prompt, model, user_ip, cancel_result(scope), mode=mode, **stats.to_dict())
+                yield gr.skip(), gr.skip(), "⏹️ Simulation stopped."
+                return
+            stats.mark("finalized")
+            new_entry = {
+                "timestamp": timestamp,
+                "scene": scene,
+                "model": model,
+                "mode": mode,
+                "prompt": prompt,
+                "video_path": video_path,
+                "trace_id": trace.trace_id
+            }
+            updated_history = history + [new_entry]
+            if len(updated_history) > 10:
+                updated_history = updated_history[:10]
+            log_submission(scene, prompt, model, user_ip, "success", mode=mode, **stats.to_dict())
+            END_TO_END_SECONDS.labels(scene, model).observe(stats.elapsed())
+            ADMISSION.remember_result(scene, model, mode, prompt, video_path)
+            gr.Info("Simulation completed successfully!")
+            yield None, updated_history, ""
+        elif status.get("status") == "failed":
+            log_submission(scene, prompt, model, user_ip, status.get('result', 'backend error'), mode=mode, **stats.to_dict())
+            raise gr.Error(f"任务执行失败: {status.get('result', 'backend 未知错误')}")
+            yield None, history, ""
+        elif status.get("status") == "terminated":
+            log_submission(scene, prompt, model, user_ip, "terminated", mode=mode, **stats.to_dict())
+            video_path = os.path.join(result_folder, "output.mp4")
+            if os.path.exists(video_path):
+                return f"⚠️ 任务 {task_id} 被终止，已生成部分结果", video_path, history
+            else:
+                return f"⚠️ 任务 {task_id} 被终止，未生成结果", None, history
+        else:
+            log_submission(scene, prompt, model, user_ip, "missing task's status from backend", mode=mode, **stats.to_dict())
+            raise gr.Error("missing task's status from backend")
+            yield None, history, ""
+    except GeneratorExit:
+        # 客户端断开，Gradio 关闭了生成器
+        scope.cancel("disconnect")
+        raise
+    finally:
+        ACTIVE_SIMULATIONS.dec()
+        PROFILER.finish(trace.trace_id)
+        last_user = JOB_REGISTRY.release(job_id)
+        ADMISSION.cancel(ticket)
+        SESSIONS.close_scope(session_id, scope)
+        if task_id:
+            release_task(session_id, task_id, scope, task_finished, last_user)
+
+
+def resume_simulation(history, request: gr.Request):
+    """页面带 ?task=<task_id>&key=<resume_key> 打开时接上仍在运行的任务：先重放已推送过的片段，再从之后的帧继续推流。
+    只凭 task_id（观看链接里公开的）不能接管任务"""
+    task_id = (request.query_params.get("task") or "").strip() if request else ""
+    resume_key = (request.query_params.get("key") or "").strip() if request else ""
+    record = INFLIGHT.get_for_resume(task_id, resume_key) if task_id else None
+    if record is None:
+        if task_id:
+            gr.Warning(f"Task {task_id} has already finished or can no longer be resumed.")
+        yield gr.skip(), gr.skip(), gr.skip()
+        return
+    if record.get("final_video"):
+        yield record["final_video"], gr.skip(), "✅ This simulation has already finished."
+        return
+    session_id = request.session_hash
+    scene, model, mode, prompt = record["scene"], record["model"], record["mode"], record["prompt"]
+    SESSIONS.heartbeat(session_id)
+    SESSIONS.claim_task(task_id, session_id)
+    scope = SESSIONS.open_scope(session_id)
+    RESUMED_STREAMS.inc()
+    ACTIVE_SIMULATIONS.inc()
+    task_finished = False
+    gr.Info(f"Reconnected to task {task_id}")
+    try:
+        for segment in INFLIGHT.segments(task_id):
+            yield segment, gr.skip(), stream_status(task_id, resume_key)
+        try:
+            stream = stream_simulation_results(record["result_folder"], task_id, cancel=scope,
+                                               stall_after=stall_timeout(scene, mode),
+                                               skip_segments=len(record["segments"]))
+            for video_path in stream:
+                if video_path:
+                    INFLIGHT.add_segment(task_id, video_path)
+                    yield video_path, gr.skip(), stream_status(task_id, resume_key)
+        except SimulationStalled as e:
+            STALLED_TASKS.labels(scene, mode).inc()
+            scope.cancel("stall")
+            log_submission(scene, prompt, model, record["user"], "stalled", mode=mode, resumed=True,
+                           stall_seconds=round(e.stalled_for, 1), stall_last_status=e.last_status)
+            raise gr.Error(f"The simulation stopped making progress for {e.stalled_for:.0f}s and was terminated.")
+        if scope.cancelled:
+            yield gr.skip(), gr.skip(), "⏹️ Simulation stopped."
+            return
+        status = get_task_status(task_id)
+        task_finished = status.get("status") in ("completed", "failed", "terminated")
+        if status.get("status") != "completed":
+            log_submission(scene, prompt, model, record["user"], status.get("status", "unknown"), mode=mode, resumed=True)
+            raise gr.Error(f"Task {task_id} ended with status: {status.get('status', 'unknown')}")
+        try:
+            video_path = convert_to_h264(os.path.join(status.get("result"), "output.mp4"), cancel=scope)
+            INFLIGHT.complete(task_id, video_path)
+        except SimulationCancelled:
+            yield gr.skip(), gr.skip(), "⏹️ Simulation stopped."
+            return
+        new_entry = {
+            "timestamp": datetime.fromtimestamp(record["started"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "scene": scene,
+            "model": model,
+            "mode": mode,
+            "prompt": prompt,
+            "video_path": video_path,
+            "trace_id": record.get("trace_id")
+        }
+        log_submission(scene, prompt, model, record["user"], "success", mode=mode, resumed=True)
+        ADMISSION.remember_result(scene, model, mode, prompt, video_path)
+        gr.Info("Simulation completed successfully!")
+        yield None, (history + [new_entry])[:10], ""
+    except GeneratorExit:
+        scope.cancel("disconnect")
+        raise
+    finally:
+        ACTIVE_SIMULATIONS.dec()
+        SESSIONS.close_scope(session_id, scope)
+        release_task(session_id, task_id, scope, task_finished)
+
+
+async def watch_simulation(request: gr.Request):
+    """页面带 ?watch=<task_id> 打开时观看该任务：只读取运行方已编码的片段，不重复解码和编码。
+    异步生成器，等待新片段时不占用工作线程"""
+    task_id = (request.query_params.get("watch") or "").strip() if request else ""
+    if not task_id:
+        yield gr.skip(), gr.skip()
+        return
+    if await asyncio.to_thread(INFLIGHT.get, task_id) is None:
+        gr.Warning(f"Task {task_id} has ended or is not available for watching.")
+        yield gr.skip(), gr.skip()
+        return
+    session_id = request.session_hash
+    scope = SESSIONS.open_scope(session_id)
+    try:
+        async for kind, path in BROADCAST.watch(task_id, cancel=scope, viewer_id=session_id):
+            if kind == "done":
+                yield path, "✅ Simulation finished."
+                return
+            viewers = await asyncio.to_thread(BROADCAST.viewers, task_id)
+            yield path, f"📺 Watching task `{task_id}` · 👀 {viewers} watching"
+        yield gr.skip(), "⏹️ The simulation has ended."
+    finally:
+        SESSIONS.close_scope(session_id, scope)
+
+def stream_status(task_id: str, resume_key: str = None) -> str:
+    """推流时的状态行：分享观看的链接、观看人数和（仅本人可见的）重新连接链接"""
+    parts = [f"📺 Share [watch link](?watch={task_id})"]
+    viewers = BROADCAST.viewers(task_id)
+    if viewers:
+        parts.append(f"👀 {viewers} watching")
+    if RESUME_GRACE > 0 and resume_key:
+        parts.append(f"🔗 Closed the page by accident? Open [this link](?task={task_id}&key={resume_key}) within {RESUME_GRACE:.0f}s to reconnect.")
+    return " · ".join(parts)
+
+def is_detached(scope) -> bool:
+    """页面关闭但允许重新连接：后端任务留给重新连接的页面继续，不算取消"""
+    return scope.reason == "disconnect" and RESUME_GRACE > 0
+
+def cancel_result(scope) -> str:
+    # 交给重新连接的运行记为 detached，接上后的运行会另记最终结果
+    return "detached" if is_detached(scope) else f"cancelled ({scope.reason})"
+
+def release_task(session_id: str, task_id: str, scope, finished: bool, last_user: bool = True):
+    """一次运行结束时处理它的后端任务：已结束的注销；被取消的立即终止（其他相同请求仍在跟随该任务时除外）；
+    页面关闭且允许重新连接的保留记录，宽限期内没有重新连接再由清理线程终止；其余的留给页面关闭或心跳超时时终止"""
+    detached = is_detached(scope)
+    if finished or (scope.cancelled and not detached):
+        INFLIGHT.finish(task_id)
+    if finished or (scope.cancelled and last_user and not detached):
+        entry = SESSIONS.finish_task(session_id, task_id)
+        if entry is not None and not finished:
+            cancel_task(task_id, scope.reason, entry["started"])
+
+def cancel_task(task_id: str, reason: str, started: float):
+    """立即终止后端任务，按任务平均占用时长估算节省的 GPU 时间"""
+    if terminate_task(task_id):
+        CANCELLED_TASKS.labels(reason).inc()
+        GPU_SECONDS_SAVED.labels(reason).inc(max(0.0, ADMISSION.service_seconds - (time.time() - started)))
+
+def stop_simulation(request: gr.Request):
+    if SESSIONS.cancel(request.session_hash, "stop"):
+        gr.Info("Stopping the simulation...")
+
+def cleanup_session(request: gr.Request):
+    session_id = request.session_hash
+    SESSIONS.cancel(session_id, "disconnect")
+    if RESUME_GRACE > 0:
+        # 可能只是刷新页面：留一段时间重新连接，到期仍未接管的任务由清理线程终止
+        SESSIONS.detach(session_id, RESUME_GRACE)
+        return
+    for entry in SESSIONS.end_session(session_id):
+        cancel_task(entry["task_id"], "disconnect", entry["started"])
+
+def session_heartbeat(request: gr.Request):
+    SESSIONS.heartbeat(request.session_hash)
+
+def record_access(request: gr.Request):
+    user_ip = request.client.host if request else "unknown"
+    user_agent = request.headers.get("user-agent", "unknown")
+    log_access(user_ip, user_agent)
+    return update_log_display()
+
+
+
+custom_css = """
+#simulation-panel {
+    border-radius: 8px;
+    padding: 20px;
+    background: #f9f9f9;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+}
+#result-panel {
+    border-radius: 8px;
+    padding: 20px;
+    background: #f0f8ff;
+}
+.dark #simulation-panel { background: #2a2a2a; }
+.dark #result-panel { background: #1a2a3a; }
+.history-container {
+    max-height: 600px;
+    overflow-y: auto;
+    margin-top: 20px;
+}
+.history-accordion {
+    margin-bottom: 10px;
+}
+"""
+
+header_html = """
+<div style="display: flex; justify-content: space-between; align-items: center; width: 100%; margin-bottom: 20px; padding: 20px; background: linear-gradient(135deg, #e0e5ec 0%, #a7b5d0 100%); border-radius: 8px; box-shadow: 0 2px 8px rgba(0,0,0,0.1);">
+    <div style="display: flex; align-items: center;">
+        <img src="https://www.shlab.org.cn/static/img/index_14.685f6559.png" alt="Institution Logo" style="height: 60px; margin-right: 20px;">
+        <div>
+            <h1 style="margin: 0; color: #2c3e50; font-weight: 600;">🤖 InternManip Model Inference Demo</h1>
+            <p style="margin: 4px 0 0 0; color: #5d6d7e; font-size: 0.9em;">Model trained on InternManip framework</p>
+        </div>
+    </div>
+    <div style="display: flex; gap: 15px; align-items: center;">
+        <a href="https://github.com/OpenRobotLab" target="_blank" style="text-decoration: none; transition: transform 0.2s;" onmouseover="this.style.transform='scale(1.1)'" onmouseout="this.style.transform='scale(1)'">
+            <img src="https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png" alt="GitHub" style="height: 30px;">
+        </a>
+        <a href="https://huggingface.co/OpenRobotLab" target="_blank" style="text-decoration: none; transition: transform 0.2s;" onmouseover="this.style.transform='scale(1.1)'" onmouseout="this.style.transform='scale(1)'">
+            <img src="https://huggingface.co/front/assets/huggingface_logo-noborder.svg" alt="HuggingFace" style="height: 30px;">
+        </a>
+        <a href="http://123.57.187.96:55004/" target="_blank">
+            <button style="padding: 8px 15px; background: #3498db; color: white; border: none; border-radius: 4px; cursor: pointer; font-weight: 500; transition: all 0.2s;" 
+                    onmouseover="this.style.backgroundColor='#2980b9'; this.style.transform='scale(1.05)'" 
+                    onmouseout="this.style.backgroundColor='#3498db'; this.style.transform='scale(1)'">
+                Go to InternManip Demo
+            </button>
+        </a>
+    </div>
+</div>
+"""
+
+
+
+with gr.Blocks(title="InternNav Model Inference Demo", css=custom_css) as demo:
+    gr.HTML(header_html)
+    backend_status = gr.Markdown()
+    gr.Timer(5).tick(fn=update_backend_status, outputs=backend_status)
+    gr.Timer(SESSION_HEARTBEAT_INTERVAL).tick(fn=session_heartbeat, queue=False)
+    
+    history_state = gr.State([])
+    with gr.Row():
+        with gr.Column(elem_id="simulation-panel"):
+            gr.Markdown("### Simulation Settings")
+            scene_dropdown = gr.Dropdown(
+                label="Choose a scene",
+                choices=list(SCENE_CONFIGS.keys()),
+                value="demo1",
+                interactive=True
+            )
+            scene_description = gr.Markdown("")
+            scene_preview = gr.Image(
+                label="Scene Preview",
+                elem_classes=["scene-preview"],
+                interactive=False
+            )
+            prompt_input = gr.Textbox(
+                label="Navigation Prompt",
+                value="Walk past the left side of the bed and stop in the doorway.",
+                placeholder="e.g.: 'Walk past the left side of the bed and stop in the doorway.'",
+                lines=2,
+                max_lines=4
+            )
+            model_dropdown = gr.Dropdown(
+                label="Chose a pretrained model",
+                choices=MODEL_CHOICES,
+                value=MODEL_CHOICES[0],
+                interactive=True
+            )
+            mode_dropdown = gr.Dropdown(
+                label="Select Mode",
+                choices=MODE_CHOICES,
+                value=MODE_CHOICES[0],
+                interactive=True
+            )
+            scene_dropdown.change(
+                fn=lambda scene: [update_scene_display(scene)[0], update_scene_display(scene)[1], get_scene_instruction(scene)],
+                inputs=scene_dropdown,
+                outputs=[scene_description, scene_preview, prompt_input]
+            )
+            
+            with gr.Row():
+                submit_btn = gr.Button("Start Navigation Simulation", variant="primary")
+                stop_btn = gr.Button("Stop", variant="stop")
+        with gr.Column(elem_id="result-panel"):
+            gr.Markdown("### Latest Simulation Result")
+            queue_status = gr.Markdown()
+            video_output = gr.Video(
+                label="Live",
+                interactive=False,
+                format="mp4",
+                autoplay=True,
+                streaming=True
+            )
+            with gr.Column() as history_container:
+                gr.Markdown("### History")
+                gr.Markdown("#### History will be reset after refresh")
+                history_slots = []
+                for i in range(10):
+                    with gr.Column(visible=False) as slot:
+                        with gr.Accordion(visible=False, open=False) as accordion:
+                            video = gr.Video(interactive=False)
+                            detail_md = gr.Markdown()
+                            with gr.Accordion("Trace", open=False):
+                                trace_md = gr.Markdown()
+                    history_slots.append((slot, accordion, video, detail_md, trace_md))
+    with gr.Accordion("查看系统访问日志(DEV ONLY)", open=False):
+        with gr.Row():
+            log_type_filter = gr.Dropdown(label="Type", choices=["all", "access", "submission"], value="all")
+            log_ip_filter = gr.Textbox(label="User/IP", placeholder="e.g. 114.94.17.242")
+            log_scene_filter = gr.Dropdown(label="Scene", choices=[""] + list(SCENE_CONFIGS.keys()), value="")
+            log_model_filter = gr.Dropdown(label="Model", choices=[""] + MODEL_CHOICES, value="")
+            log_result_filter = gr.Dropdown(label="Result", choices=["", "success", "failed"], value="")
+        with gr.Row():
+            log_start_filter = gr.Textbox(label="From", placeholder="YYYY-MM-DD HH:MM:SS")
+            log_end_filter = gr.Textbox(label="To", placeholder="YYYY-MM-DD HH:MM:SS")
+            log_page = gr.Number(label="Page", value=1, precision=0, minimum=1)
+        logs_display = gr.Markdown()
+        with gr.Row():
+            prev_logs_btn = gr.Button("上一页", variant="secondary")
+            log_page_info = gr.Markdown()
+            next_logs_btn = gr.Button("下一页", variant="secondary")
+        refresh_logs_btn = gr.Button("刷新日志", variant="secondary")
+        log_filters = [log_type_filter, log_ip_filter, log_scene_filter, log_model_filter,
+                       log_result_filter, log_start_filter, log_end_filter]
+        log_viewer_outputs = [logs_display, log_page_info, log_page]
+        refresh_logs_btn.click(
+            lambda *args: update_log_viewer(*args[:-1], 1),
+            inputs=log_filters + [log_page],
+            outputs=log_viewer_outputs
+        )
+        log_page.submit(update_log_viewer, inputs=log_filters + [log_page], outputs=log_viewer_outputs)
+        prev_logs_btn.click(
+            lambda *args: update_log_viewer(*args[:-1], max(1, int(args[-1] or 1) - 1)),
+            inputs=log_filters + [log_page],
+            outputs=log_viewer_outputs
+        )
+        next_logs_btn.click(
+            lambda *args: update_log_viewer(*args[:-1], int(args[-1] or 1) + 1),
+            inputs=log_filters + [log_page],
+            outputs=log_viewer_outputs
+        )
+    with gr.Accordion("使用情况统计(DEV ONLY)", open=False):
+        analytics_display = gr.Markdown()
+        refresh_analytics_btn = gr.Button("刷新统计", variant="secondary")
+        refresh_analytics_btn.click(update_analytics_display, outputs=analytics_display)
+        # 供外部拉取原始统计数据的 API：/usage_stats
+        analytics_json = gr.JSON(visible=False)
+        usage_api_btn = gr.Button(visible=False)
+        usage_api_btn.click(USAGE_ANALYTICS.snapshot, outputs=analytics_json, api_name="usage_stats")
+    with gr.Accordion("性能采样(DEV ONLY)", open=False):
+        with gr.Row():
+            profiler_enabled = gr.Checkbox(label="Enable sampling profiler", value=PROFILER.running)
+            profiler_task = gr.Textbox(label="Trace ID", placeholder="empty for the current time window")
+        profiler_display = gr.Markdown()
+        refresh_profiler_btn = gr.Button("刷新采样", variant="secondary")
+        profiler_enabled.change(toggle_profiler, inputs=profiler_enabled, outputs=profiler_display)
+        refresh_profiler_btn.click(update_profiler_display, inputs=profiler_task, outputs=profiler_display)
+    gr.Examples(
+        examples=EXAMPLES,
+        inputs=[scene_dropdown, model_dropdown, mode_dropdown, prompt_input],
+        label="Navigation Task Examples"
+    )
+    submit_btn.click(
+        fn=run_simulation,
+        inputs=[scene_dropdown, model_dropdown, mode_dropdown, prompt_input, history_state],
+        outputs=[video_output, history_state, queue_status],
+        queue=True,
+        # 排队由 ADMISSION 控制，这里只需容纳正在运行和正在前端排队的请求
+        concurrency_limit=ADMISSION_MAX_CAPACITY + ADMISSION_MAX_QUEUE,
+        api_name="run_simulation"
+    ).then(
+        fn=update_history_display,
+        inputs=history_state,
+        outputs=[comp for slot in history_slots for comp in slot],
+        queue=True
+    ).then(
+        fn=update_log_display,
+        outputs=logs_display,
+    )
+    stop_btn.click(fn=stop_simulation, queue=False)
+    demo.load(
+        fn=lambda: update_scene_display("demo1"),
+        outputs=[scene_description, scene_preview]
+    ).then(
+        fn=update_log_display,
+        outputs=logs_display
+    )
+    demo.load(
+        fn=resume_simulation,
+        inputs=history_state,
+        outputs=[video_output, history_state, queue_status],
+        # 数量受进行中的任务数约束，不应排在默认并发上限后面
+        concurrency_limit=None
+    ).then(
+        fn=update_history_display,
+        inputs=history_state,
+        outputs=[comp for slot in history_slots for comp in slot]
+    )
+    demo.load(
+        fn=watch_simulation,
+        outputs=[video_output, queue_status],
+        # 观看者不限人数
+        concurrency_limit=None
+    )
+    demo.load(
+        fn=record_access,
+        inputs=None,
+        outputs=logs_display,
+        queue=False
+    )
+    demo.queue(default_concurrency_limit=8)
+    demo.unload(fn=cleanup_session)
+
+# Gradio 队列中等待执行的事件数（读取内部结构，版本不兼容时导出 NaN）
+gauge("nav_gradio_queue_length", "Events waiting in the Gradio queue").set_function(
+    lambda: sum(len(q.queue) for q in demo._queue.event_queue_per_concurrency_id.values())
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    from fastapi import FastAPI
+    from fastapi.responses import PlainTextResponse
+
+    # 在同一端口上提供 Gradio 页面和 /metrics
+    app = FastAPI()
+
+    @app.get("/metrics")
+    def metrics_endpoint():
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    app = gr.mount_gradio_app(app, demo, path="/", allowed_paths=["/opt"])
+    # 收到 SIGTERM 后先排空：拒绝新任务，等进行中的任务结束再退出
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=55005))
+    install_drain(server, ACTIVE_SIMULATIONS.get)
+    server.run()
\ No newline at end of file
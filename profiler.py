@@ -0,0 +1,214 @@
+# profiler.py
+# 采样式性能剖析：按固定频率采样正在驱动仿真流的线程调用栈，按任务和时间窗口聚合，
+# 导出 flamegraph.pl / speedscope 可直接读取的 collapsed stacks（每行 "栈;栈;叶子 次数"）。
+# 默认关闭；关闭时调用方每一步只多一次布尔判断，不启动采样线程。
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+PROFILE_ENABLED = os.getenv("NAV_PROFILE", "0") == "1"
+# 采样间隔、时间窗口长度(秒)
+PROFILE_INTERVAL = float(os.getenv("NAV_PROFILE_INTERVAL", "0.005"))
+PROFILE_WINDOW = float(os.getenv("NAV_PROFILE_WINDOW", "60"))
+PROFILE_DIR = os.getenv("NAV_PROFILE_DIR", "/opt/nav-fronted/logs/profiles")
+MAX_STACK_DEPTH = 64
+# 内存里最多保留多少个已结束任务的采样结果
+MAX_TASK_PROFILES = 50
+
+_LINE_NUMBER = re.compile(r":\d+\)$")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def write_collapsed(path: str, samples: Counter):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+
+
+def read_collapsed(path: str) -> Counter:
+    samples = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack:
+                samples[stack] += int(count)
+    return samples
+
+
+def function_summary(samples: Counter, top: int = 20) -> list:
+    """按函数汇总：self 为处于栈顶的采样数，total 为出现在栈中的采样数。返回 [(函数, self, total)]"""
+    own, total = Counter(), Counter()
+    for stack, count in samples.items():
+        functions = [_LINE_NUMBER.sub(")", label) for label in stack.split(";")]
+        own[functions[-1]] += count
+        for function in set(functions):
+            total[function] += count
+    return sorted(((f, own[f], total[f]) for f in total), key=lambda x: (-x[1], -x[2]))[:top]
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL, window: float = PROFILE_WINDOW,
+                 output_dir: str = PROFILE_DIR):
+        self.interval = interval
+        self.window = window
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        # 线程 ident -> 任务 id，只采样登记过的线程
+        self._threads = {}
+        self._tasks = {}
+        self._finished = OrderedDict()
+        self._window = Counter()
+        self._last_window = Counter()
+        self._window_started = time.time()
+        self._stop = threading.Event()
+        self._thread = None
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._window_started = time.time()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join()
+        self._thread = None
+        self.dump_window()
+
+    def attach(self, task_id: str):
+        """在 with 块内采样当前线程并计入 task_id；未开启时返回空上下文"""
+        return self._attach(task_id) if self.running else nullcontext()
+
+    @contextmanager
+    def _attach(self, task_id: str):
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] = task_id
+            self._tasks.setdefault(task_id, Counter())
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads.pop(ident, None)
+
+    def wrap_generator(self, gen, task_id: str):
+        """逐步驱动生成器，只在 next() 执行期间采样（Gradio 每一步可能在不同的工作线程上运行）"""
+        try:
+            while True:
+                with self.attach(task_id):
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                yield item
+        finally:
+            gen.close()
+
+    def finish(self, task_id: str):
+        """任务结束：把它的采样写到 <output_dir>/task-<task_id>.collapsed"""
+        with self._lock:
+            samples = self._tasks.pop(task_id, None)
+            if samples:
+                self._finished[task_id] = samples
+                while len(self._finished) > MAX_TASK_PROFILES:
+                    self._finished.popitem(last=False)
+        if samples:
+            write_collapsed(os.path.join(self.output_dir, f"task-{task_id}.collapsed"), samples)
+
+    def dump_window(self):
+        """把当前时间窗口的采样写到 <output_dir>/window-<开始时间>.collapsed 并开始新窗口"""
+        with self._lock:
+            samples, started = self._window, self._window_started
+            self._window, self._window_started = Counter(), time.time()
+            if samples:
+                self._last_window = samples
+        if samples:
+            name = datetime.fromtimestamp(started).strftime("window-%Y%m%d-%H%M%S.collapsed")
+            write_collapsed(os.path.join(self.output_dir, name), samples)
+
+    def snapshot(self, task_id: str = None) -> Counter:
+        """某个任务（进行中或最近结束）的采样；不指定时为当前窗口，当前窗口为空则取上一个窗口"""
+        with self._lock:
+            if task_id:
+                return Counter(self._tasks.get(task_id) or self._finished.get(task_id) or {})
+            return Counter(self._window or self._last_window)
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self._threads.items())
+        for ident, task_id in threads:
+            frame = frames.get(ident)
+            labels = []
+            # 从栈顶往下走到 wrap_generator 为止，去掉 Gradio/anyio 线程池的公共栈底
+            while frame is not None and len(labels) < MAX_STACK_DEPTH and frame.f_code is not _WRAP_CODE:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            if not labels:
+                continue
+            stack = ";".join(reversed(labels))
+            with self._lock:
+                samples = self._tasks.get(task_id)
+                if samples is not None:
+                    samples[stack] += 1
+                self._window[stack] += 1
+                self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+            if time.time() - self._window_started >= self.window:
+                self.dump_window()
+
+
+_WRAP_CODE = SamplingProfiler.wrap_generator.__code__
+
+
+def format_profile_for_display(samples: Counter, top: int = 20) -> str:
+    total = sum(samples.values())
+    if not total:
+        return "No samples collected"
+    lines = [
+        f"{total} samples\n",
+        "| Function | Self | Total |",
+        "|------|------|------|",
+    ]
+    for function, own, cumulative in function_summary(samples, top):
+        lines.append(f"| `{function}` | {own / total * 100:.1f}% | {cumulative / total * 100:.1f}% |")
+    return "\n".join(lines)
+
+
+PROFILER = SamplingProfiler()
+if PROFILE_ENABLED:
+    PROFILER.start()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize collapsed stacks written by the sampling profiler")
+    parser.add_argument("path", help="a .collapsed file under " + PROFILE_DIR)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+    print(format_profile_for_display(read_collapsed(args.path), args.top))
@@ -0,0 +1,150 @@
+# session_registry.py
+# 会话登记：记录每个会话提交过的所有后端任务（不再一个会话只记一个、新任务覆盖旧任务），
+# 页面通过 gr.Timer 定期发心跳，本进程内仍在运行（排队、推流）的会话由清理线程代为发心跳，
+# 不会运行 Timer 的 API 客户端不会被误判为已离开。页面关闭时 unload 终止该会话的任务；
+# 浏览器崩溃、断网等不触发 unload 的情况，由后台清理线程在心跳超时后终止任务，尽早释放 GPU。
+# 数据放在共享状态存储里，多个前端进程都能登记、发心跳和清理，同一任务只会被一个进程取出并终止。
+# 本进程内正在运行的仿真各有一个取消信号(CancelScope)，Stop 按钮或页面关闭时设置，仿真循环尽快退出。
+import os
+import time
+import threading
+from collections import defaultdict
+from typing import Callable, List, Optional
+
+from metrics import counter
+from state_store import STATE_STORE, StateStore
+
+# 页面发心跳的间隔、多久没有心跳视为会话已离开(秒)
+SESSION_HEARTBEAT_INTERVAL = float(os.getenv("SESSION_HEARTBEAT_INTERVAL", "15"))
+SESSION_TIMEOUT = float(os.getenv("SESSION_TIMEOUT", "120"))
+# 清理线程的检查间隔(秒)
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "30"))
+# 登记的任务最多保留多久(秒)，兜底防止记录堆积
+SESSION_TASK_TTL = 6 * 3600
+
+TASKS_NAMESPACE = "session_tasks"
+HEARTBEAT_NAMESPACE = "session_heartbeat"
+
+REAPED_TASKS = counter("nav_session_reaped_tasks_total", "Backend tasks of timed-out sessions the reaper terminated",
+                       ("terminated",))
+
+
+class CancelScope:
+    def __init__(self):
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float) -> bool:
+        """代替 sleep：等待 timeout 秒，期间被取消则立即返回 True"""
+        return self._event.wait(timeout)
+
+
+class SessionRegistry:
+    def __init__(self, store: StateStore = STATE_STORE, timeout: float = SESSION_TIMEOUT):
+        self.store = store
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._scopes = defaultdict(list)
+
+    def open_scope(self, session_id: str) -> CancelScope:
+        scope = CancelScope()
+        with self._lock:
+            self._scopes[session_id].append(scope)
+        return scope
+
+    def close_scope(self, session_id: str, scope: CancelScope):
+        with self._lock:
+            scopes = self._scopes.get(session_id)
+            if scopes and scope in scopes:
+                scopes.remove(scope)
+                if not scopes:
+                    del self._scopes[session_id]
+
+    def cancel(self, session_id: str, reason: str) -> int:
+        """取消该会话在本进程内正在运行的仿真，返回取消的个数"""
+        with self._lock:
+            scopes = list(self._scopes.get(session_id, ()))
+        for scope in scopes:
+            scope.cancel(reason)
+        return len(scopes)
+
+    def heartbeat(self, session_id: str):
+        self.store.set(HEARTBEAT_NAMESPACE, session_id, time.time(), ttl=self.timeout * 2)
+
+    def heartbeat_running(self):
+        """为本进程内有未取消的运行的会话发心跳；已取消的（如页面关闭后等待重新连接）不再续期"""
+        with self._lock:
+            running = [session_id for session_id, scopes in self._scopes.items()
+                       if any(not scope.cancelled for scope in scopes)]
+        for session_id in running:
+            self.heartbeat(session_id)
+
+    def add_task(self, session_id: str, task_id: str):
+        self.store.set(TASKS_NAMESPACE, f"{session_id}/{task_id}",
+                       {"session": session_id, "task_id": task_id, "started": time.time()},
+                       ttl=SESSION_TASK_TTL)
+
+    def finish_task(self, session_id: str, task_id: str) -> Optional[dict]:
+        """取出任务的登记，之后不再由 unload 或清理线程终止；已被别处取出时返回 None"""
+        return self.store.pop(TASKS_NAMESPACE, f"{session_id}/{task_id}")
+
+    def claim_task(self, task_id: str, session_id: str):
+        """重新连接：把任务的登记转到新会话名下，保留原来的开始时间"""
+        started = time.time()
+        for key, entry in self.store.items(TASKS_NAMESPACE).items():
+            if entry["task_id"] == task_id and self.store.pop(TASKS_NAMESPACE, key) is not None:
+                started = entry["started"]
+        self.store.set(TASKS_NAMESPACE, f"{session_id}/{task_id}",
+                       {"session": session_id, "task_id": task_id, "started": started}, ttl=SESSION_TASK_TTL)
+
+    def detach(self, session_id: str, grace: float):
+        """页面已关闭但允许重新连接：grace 秒后由清理线程终止该会话仍未被接管的任务"""
+        self.store.set(HEARTBEAT_NAMESPACE, session_id, time.time() - self.timeout + grace, ttl=self.timeout * 2)
+
+    def task_count(self) -> int:
+        return self.store.count(TASKS_NAMESPACE)
+
+    def end_session(self, session_id: str) -> List[dict]:
+        """会话结束：取出该会话全部任务的登记并返回，由调用方终止"""
+        self.store.pop(HEARTBEAT_NAMESPACE, session_id)
+        taken = []
+        for key, entry in self.store.items(TASKS_NAMESPACE).items():
+            if entry["session"] == session_id and self.store.pop(TASKS_NAMESPACE, key) is not None:
+                taken.append(entry)
+        return taken
+
+    def reap(self, now: float = None) -> List[str]:
+        """取出心跳超时的会话的任务并返回；从未发过心跳的会话从任务开始时算起"""
+        now = time.time() if now is None else now
+        self.heartbeat_running()
+        heartbeats = self.store.items(HEARTBEAT_NAMESPACE)
+        taken = []
+        for key, entry in self.store.items(TASKS_NAMESPACE).items():
+            last_seen = heartbeats.get(entry["session"], entry["started"])
+            if now - last_seen > self.timeout and self.store.pop(TASKS_NAMESPACE, key) is not None:
+                taken.append(entry["task_id"])
+        return taken
+
+    def start_reaper(self, terminate: Callable[[str], bool], interval: float = SESSION_REAP_INTERVAL):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    for task_id in self.reap():
+                        REAPED_TASKS.labels("yes" if terminate(task_id) else "no").inc()
+                except Exception:
+                    pass
+
+        threading.Thread(target=run, name="session-reaper", daemon=True).start()
+
+
+SESSIONS = SessionRegistry()
@@ -1,115 +1,227 @@
-# simulation.py
-# 仿真与视频相关
-import os
-import time
-import uuid
-import cv2
-import numpy as np
-from typing import List
-import gradio as gr
-from backend_api import get_task_status
-
-def stream_simulation_results(result_folder: str, task_id: str, fps: int = 6):
-    result_folder = os.path.join(result_folder, "images")
-    os.makedirs(result_folder, exist_ok=True)
-    frame_buffer: List[np.ndarray] = []
-    frames_per_segment = fps * 2
-    processed_files = set()
-    width, height = 0, 0
-    last_status_check = 0
-    status_check_interval = 5
-    max_time = 240
-    while max_time > 0:
-        max_time -= 1
-        current_time = time.time()
-        if current_time - last_status_check > status_check_interval:
-            status = get_task_status(task_id)
-            if status.get("status") == "completed":
-                process_remaining_images(result_folder, processed_files, frame_buffer)
-                if frame_buffer:
-                    yield create_video_segment(frame_buffer, fps, width, height)
-                break
-            elif status.get("status") == "failed":
-                raise gr.Error(f"任务执行失败: {status.get('result', '未知错误')}")
-            elif status.get("status") == "terminated":
-                break
-            last_status_check = current_time
-        current_files = sorted(
-            [f for f in os.listdir(result_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-            key=lambda x: os.path.splitext(x)[0]
-        )
-        new_files = [f for f in current_files if f not in processed_files]
-        has_new_frames = False
-        for filename in new_files:
-            try:
-                img_path = os.path.join(result_folder, filename)
-                frame = cv2.imread(img_path)
-                if frame is not None:
-                    if width == 0:
-                        height, width = frame.shape[:2]
-                    frame_buffer.append(frame)
-                    processed_files.add(filename)
-                    has_new_frames = True
-            except Exception:
-                pass
-        if has_new_frames and len(frame_buffer) >= frames_per_segment:
-            segment_frames = frame_buffer[:frames_per_segment]
-            frame_buffer = frame_buffer[frames_per_segment:]
-            yield create_video_segment(segment_frames, fps, width, height)
-        time.sleep(1)
-    if max_time <= 0:
-        raise gr.Error("timeout 240s")
-
-def create_video_segment(frames: List[np.ndarray], fps: int, width: int, height: int) -> str:
-    os.makedirs("/opt/gradio_demo/tasks/video_chunk", exist_ok=True)
-    segment_name = f"/opt/gradio_demo/tasks/video_chunk/output_{uuid.uuid4()}.mp4"
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(segment_name, fourcc, fps, (width, height))
-    for frame in frames:
-        out.write(frame)
-    out.release()
-    return segment_name
-
-def process_remaining_images(result_folder: str, processed_files: set, frame_buffer: List[np.ndarray]):
-    current_files = sorted(
-        [f for f in os.listdir(result_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-        key=lambda x: os.path.splitext(x)[0]
-    )
-    new_files = [f for f in current_files if f not in processed_files]
-    for filename in new_files:
-        try:
-            img_path = os.path.join(result_folder, filename)
-            frame = cv2.imread(img_path)
-            if frame is not None:
-                frame_buffer.append(frame)
-                processed_files.add(filename)
-        except Exception:
-            pass
-
-def convert_to_h264(video_path):
-    import shutil
-    base, ext = os.path.splitext(video_path)
-    video_path_h264 = f"{base}_h264.mp4"
-    ffmpeg_bin = "/root/anaconda3/envs/gradio/bin/ffmpeg"
-    if not os.path.exists(ffmpeg_bin):
-        ffmpeg_bin = shutil.which("ffmpeg")
-    if ffmpeg_bin is None:
-        raise RuntimeError("❌ 找不到 ffmpeg，请确保其已安装并在 PATH 中")
-    ffmpeg_cmd = [
-        ffmpeg_bin,
-        "-i", video_path,
-        "-c:v", "libx264",
-        "-preset", "slow",
-        "-crf", "23",
-        "-c:a", "aac",
-        "-movflags", "+faststart",
-        video_path_h264
-    ]
-    import subprocess
-    try:
-        result = subprocess.run(ffmpeg_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if not os.path.exists(video_path_h264):
-            raise FileNotFoundError(f"⚠️ H.264 文件未生成: {video_path_h264}")
-        return video_path_h264
-    except Exception as e:
-        raise
+# simulation.py
+# 仿真与视频相关
+import os
+import time
+import uuid
+import cv2
+import numpy as np
+from typing import List, Optional
+import gradio as gr
+from backend_api import get_task_status
+from config import STALL_TIMEOUT, STALL_TIMEOUTS
+from metrics import counter, gauge, histogram
+from task_stats import TaskStats
+from tracing import Trace, span
+from session_registry import CancelScope
+
+FRAMES_DECODED = counter("nav_frames_decoded_total", "Result frames read from disk")
+SEGMENTS_WRITTEN = counter("nav_segments_written_total", "Video segments encoded for streaming")
+SEGMENT_ENCODE_SECONDS = histogram("nav_segment_encode_seconds", "Time to encode one streamed video segment")
+FFMPEG_QUEUE = gauge("nav_ffmpeg_queue_length", "ffmpeg H.264 conversions currently running")
+FFMPEG_SECONDS = histogram("nav_ffmpeg_convert_seconds", "Duration of the final ffmpeg H.264 conversion")
+
+VIDEO_CHUNK_DIR = "/opt/gradio_demo/tasks/video_chunk"
+FRAME_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# 最终 H.264 转码的 x264 参数
+H264_PRESET = os.getenv("H264_PRESET", "slow")
+H264_CRF = int(os.getenv("H264_CRF", "23"))
+
+# 任务还在后端排队或加载时不做卡住检测，排队多久由后端负载决定
+WAITING_STATUSES = ("pending", "queued", "loading")
+
+class SimulationCancelled(Exception):
+    pass
+
+class SimulationStalled(Exception):
+    def __init__(self, stalled_for: float, last_status: Optional[str]):
+        super().__init__(f"no new frames or status change for {stalled_for:.0f}s (last status: {last_status})")
+        self.stalled_for = stalled_for
+        self.last_status = last_status
+
+def stall_timeout(scene: str, mode: str) -> float:
+    for key in (f"{scene}/{mode}", scene, mode):
+        if key in STALL_TIMEOUTS:
+            return float(STALL_TIMEOUTS[key])
+    return STALL_TIMEOUT
+
+def _record_frame(stats: Optional[TaskStats], img_path: str):
+    FRAMES_DECODED.inc()
+    if stats is not None:
+        stats.mark("first_frame")
+        stats.add("frames_decoded")
+        stats.add("bytes_read", os.path.getsize(img_path))
+
+def list_frame_files(result_folder: str) -> List[str]:
+    """结果目录下的帧文件名，按去掉扩展名后的文件名排序"""
+    return sorted(
+        [f for f in os.listdir(result_folder) if f.lower().endswith(FRAME_EXTENSIONS)],
+        key=lambda x: os.path.splitext(x)[0]
+    )
+
+def stream_simulation_results(result_folder: str, task_id: str, fps: int = 6, stats: Optional[TaskStats] = None,
+                              trace: Optional[Trace] = None, cancel: Optional[CancelScope] = None,
+                              stall_after: Optional[float] = None, skip_segments: int = 0):
+    """cancel 被设置后在下一轮循环开始前结束，不再轮询状态和编码剩余的帧；
+    任务开始运行（状态离开排队/加载，或已出现帧）后，超过 stall_after 秒帧数和 status 字段都没有变化时
+    抛出 SimulationStalled；状态查询失败（status 为 error）不算变化。
+    重新连接时 skip_segments 为已推送过的片段数，跳过这些片段包含的帧"""
+    result_folder = os.path.join(result_folder, "images")
+    os.makedirs(result_folder, exist_ok=True)
+    frame_buffer: List[np.ndarray] = []
+    frames_per_segment = fps * 2
+    processed_files = set(list_frame_files(result_folder)[:skip_segments * frames_per_segment])
+    width, height = 0, 0
+    last_status_check = 0
+    status_check_interval = 5
+    max_time = 240
+    last_status = None
+    last_frames = len(processed_files)
+    last_progress = time.monotonic()
+    while max_time > 0:
+        if cancel is not None and cancel.cancelled:
+            return
+        max_time -= 1
+        current_time = time.time()
+        if current_time - last_status_check > status_check_interval:
+            with span(trace, "backend.status_poll") as attrs:
+                status = get_task_status(task_id)
+                attrs["status"] = status.get("status")
+            if status.get("status") not in (None, "error", last_status):
+                last_status = status.get("status")
+                last_progress = time.monotonic()
+            if status.get("status") == "completed":
+                process_remaining_images(result_folder, processed_files, frame_buffer, stats, trace)
+                if frame_buffer:
+                    yield create_video_segment(frame_buffer, fps, width, height, stats, trace)
+                break
+            elif status.get("status") == "failed":
+                raise gr.Error(f"任务执行失败: {status.get('result', '未知错误')}")
+            elif status.get("status") == "terminated":
+                break
+            last_status_check = current_time
+        discover_start = time.monotonic()
+        current_files = list_frame_files(result_folder)
+        new_files = [f for f in current_files if f not in processed_files]
+        has_new_frames = False
+        for filename in new_files:
+            try:
+                img_path = os.path.join(result_folder, filename)
+                frame = cv2.imread(img_path)
+                if frame is not None:
+                    _record_frame(stats, img_path)
+                    if width == 0:
+                        height, width = frame.shape[:2]
+                    frame_buffer.append(frame)
+                    processed_files.add(filename)
+                    has_new_frames = True
+            except Exception:
+                pass
+        if has_new_frames and trace is not None:
+            # 只记录发现了新帧的轮询，空轮询不产生 span
+            trace.record("frames.discover", discover_start, time.monotonic(),
+                         files=len(current_files), new_frames=len(new_files))
+        if has_new_frames and len(frame_buffer) >= frames_per_segment:
+            segment_frames = frame_buffer[:frames_per_segment]
+            frame_buffer = frame_buffer[frames_per_segment:]
+            yield create_video_segment(segment_frames, fps, width, height, stats, trace)
+        if len(processed_files) != last_frames:
+            last_frames = len(processed_files)
+            last_progress = time.monotonic()
+        started = last_frames > 0 or (last_status is not None and last_status not in WAITING_STATUSES)
+        if stall_after and started and time.monotonic() - last_progress > stall_after:
+            raise SimulationStalled(time.monotonic() - last_progress, last_status)
+        if cancel is not None:
+            cancel.wait(1)
+        else:
+            time.sleep(1)
+    if max_time <= 0:
+        raise gr.Error("timeout 240s")
+
+def create_video_segment(frames: List[np.ndarray], fps: int, width: int, height: int,
+                         stats: Optional[TaskStats] = None, trace: Optional[Trace] = None) -> str:
+    os.makedirs(VIDEO_CHUNK_DIR, exist_ok=True)
+    segment_name = os.path.join(VIDEO_CHUNK_DIR, f"output_{uuid.uuid4()}.mp4")
+    cpu_start = time.thread_time()
+    with SEGMENT_ENCODE_SECONDS.time(), span(trace, "segment.encode", frames=len(frames)):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(segment_name, fourcc, fps, (width, height))
+        for frame in frames:
+            out.write(frame)
+        out.release()
+    SEGMENTS_WRITTEN.inc()
+    if stats is not None:
+        stats.mark("first_segment")
+        stats.add("segments_written")
+        stats.add("bytes_written", os.path.getsize(segment_name))
+        stats.add("encode_cpu_seconds", time.thread_time() - cpu_start)
+    return segment_name
+
+def process_remaining_images(result_folder: str, processed_files: set, frame_buffer: List[np.ndarray],
+                             stats: Optional[TaskStats] = None, trace: Optional[Trace] = None):
+    with span(trace, "frames.discover_remaining") as attrs:
+        current_files = list_frame_files(result_folder)
+        new_files = [f for f in current_files if f not in processed_files]
+        attrs["new_frames"] = len(new_files)
+        for filename in new_files:
+            try:
+                img_path = os.path.join(result_folder, filename)
+                frame = cv2.imread(img_path)
+                if frame is not None:
+                    _record_frame(stats, img_path)
+                    frame_buffer.append(frame)
+                    processed_files.add(filename)
+            except Exception:
+                pass
+
+def convert_to_h264(video_path, stats: Optional[TaskStats] = None, trace: Optional[Trace] = None,
+                    preset: Optional[str] = None, crf: Optional[int] = None, cancel: Optional[CancelScope] = None):
+    """cancel 被设置时结束 ffmpeg 进程、删除未完成的输出并抛出 SimulationCancelled"""
+    import shutil
+    base, ext = os.path.splitext(video_path)
+    video_path_h264 = f"{base}_h264.mp4"
+    ffmpeg_bin = "/root/anaconda3/envs/gradio/bin/ffmpeg"
+    if not os.path.exists(ffmpeg_bin):
+        ffmpeg_bin = shutil.which("ffmpeg")
+    if ffmpeg_bin is None:
+        raise RuntimeError("❌ 找不到 ffmpeg，请确保其已安装并在 PATH 中")
+    ffmpeg_cmd = [
+        ffmpeg_bin,
+        "-i", video_path,
+        "-c:v", "libx264",
+        "-preset", preset or H264_PRESET,
+        "-crf", str(H264_CRF if crf is None else crf),
+        "-c:a", "aac",
+        "-movflags", "+faststart",
+        video_path_h264
+    ]
+    import subprocess
+    import tempfile
+    try:
+        with FFMPEG_QUEUE.track_inprogress(), FFMPEG_SECONDS.time(), span(trace, "ffmpeg.convert"), \
+                tempfile.TemporaryFile() as stderr:
+            # 用 wait4 回收子进程，拿到 ffmpeg 自己消耗的 CPU 时间
+            proc = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=stderr)
+            while True:
+                pid, wait_status, rusage = os.wait4(proc.pid, 0 if cancel is None else os.WNOHANG)
+                if pid:
+                    break
+                if cancel.wait(0.2):
+                    proc.kill()
+                    os.wait4(proc.pid, 0)
+                    proc.returncode = -9
+                    if os.path.exists(video_path_h264):
+                        os.remove(video_path_h264)
+                    raise SimulationCancelled(cancel.reason)
+            proc.returncode = os.waitstatus_to_exitcode(wait_status)
+            if stats is not None:
+                stats.add("encode_cpu_seconds", rusage.ru_utime + rusage.ru_stime)
+            if proc.returncode != 0:
+                stderr.seek(0)
+                raise subprocess.CalledProcessError(proc.returncode, ffmpeg_cmd, stderr=stderr.read())
+        if not os.path.exists(video_path_h264):
+            raise FileNotFoundError(f"⚠️ H.264 文件未生成: {video_path_h264}")
+        if stats is not None:
+            stats.add("bytes_written", os.path.getsize(video_path_h264))
+        return video_path_h264
+    except Exception as e:
+        raise
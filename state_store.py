@@ -0,0 +1,389 @@
+# state_store.py
+# 可替换的共享状态存储：会话→任务映射、IP 限流记录等原本是进程内的 dict，
+# 放到这里后多个 main.py 进程（同机多核或多台机器）可以共享同一份状态。
+#
+# 由 STATE_STORE_URL 选择实现：
+#   memory://                      进程内（默认，与原先行为一致）
+#   sqlite:///opt/nav-fronted/state.db   同一台机器上的多个进程，SQLite(WAL) 加文件锁
+#   redis://[:password@]host:6379/0      多台机器，任何兼容 Redis 协议的服务都可以
+#
+# 需要在前端重启后保留的数据（进行中的任务、任务所在的后端）放在 DURABLE_STORE：
+# STATE_STORE 是 memory:// 时改用 DURABLE_STORE_URL 指定的 SQLite 文件，否则与 STATE_STORE 相同。
+#
+# 过期的键读到时删除，另外每隔 PURGE_INTERVAL 秒在写入时顺带清理一次（Redis 用键自身的过期时间），
+# 只写不读的键（如任务所在的后端）不会一直堆积。
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlparse, unquote
+
+STATE_STORE_URL = os.getenv("STATE_STORE_URL", "memory://")
+DURABLE_STORE_URL = os.getenv("DURABLE_STORE_URL", "sqlite:///opt/nav-fronted/logs/state.db")
+REDIS_PREFIX = "nav:"
+# 两次清理过期键之间的最短间隔(秒)
+PURGE_INTERVAL = 60
+
+
+class StateStore:
+    """按命名空间组织的键值存储。值按 JSON 保存，可带过期时间（以墙钟时间计，跨机器一致）"""
+
+    _last_purge = 0.0
+
+    def get(self, namespace: str, key: str, default=None):
+        raw = self._get(namespace, key)
+        if raw is None:
+            return default
+        value, alive = self._decode(raw)
+        if not alive:
+            self._delete(namespace, key)
+            return default
+        return value
+
+    def set(self, namespace: str, key: str, value, ttl: float = None):
+        now = time.time()
+        expires = now + ttl if ttl else None
+        self._set(namespace, key, json.dumps({"v": value, "e": expires}), ttl)
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            self.purge_expired(now)
+
+    def purge_expired(self, now: float = None):
+        """删除已过期的键和已滑出窗口的限流记录"""
+
+    def pop(self, namespace: str, key: str, default=None):
+        raw = self._pop(namespace, key)
+        if raw is None:
+            return default
+        value, alive = self._decode(raw)
+        return value if alive else default
+
+    def items(self, namespace: str) -> dict:
+        result = {}
+        for key, raw in self._items(namespace).items():
+            value, alive = self._decode(raw)
+            if alive:
+                result[key] = value
+            else:
+                self._delete(namespace, key)
+        return result
+
+    def count(self, namespace: str) -> int:
+        return len(self.items(namespace))
+
+    @staticmethod
+    def _decode(raw: str) -> tuple:
+        data = json.loads(raw)
+        return data["v"], data["e"] is None or data["e"] > time.time()
+
+    def allow_request(self, key: str, limit: int, window: float) -> bool:
+        """滑动窗口限流：window 秒内记录少于 limit 次时记一次并返回 True"""
+        raise NotImplementedError
+
+    def _get(self, namespace, key):
+        raise NotImplementedError
+
+    def _set(self, namespace, key, raw, ttl):
+        raise NotImplementedError
+
+    def _pop(self, namespace, key):
+        raise NotImplementedError
+
+    def _delete(self, namespace, key):
+        self._pop(namespace, key)
+
+    def _items(self, namespace) -> dict:
+        raise NotImplementedError
+
+
+class MemoryStore(StateStore):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = defaultdict(dict)
+        self._events = defaultdict(deque)
+        self._max_window = 0.0
+
+    def _get(self, namespace, key):
+        with self._lock:
+            return self._data[namespace].get(key)
+
+    def _set(self, namespace, key, raw, ttl):
+        with self._lock:
+            self._data[namespace][key] = raw
+
+    def _pop(self, namespace, key):
+        with self._lock:
+            return self._data[namespace].pop(key, None)
+
+    def _items(self, namespace):
+        with self._lock:
+            return dict(self._data[namespace])
+
+    def purge_expired(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for data in self._data.values():
+                for key in [k for k, raw in data.items() if (json.loads(raw)["e"] or now + 1) <= now]:
+                    del data[key]
+            for key in list(self._events):
+                events = self._events[key]
+                while events and now - events[0] >= self._max_window:
+                    events.popleft()
+                if not events:
+                    del self._events[key]
+
+    def allow_request(self, key, limit, window):
+        now = time.time()
+        with self._lock:
+            self._max_window = max(self._max_window, window)
+            events = self._events[key]
+            while events and now - events[0] >= window:
+                events.popleft()
+            if len(events) < limit:
+                events.append(now)
+                return True
+            return False
+
+
+class SQLiteStore(StateStore):
+    """同一台机器上多进程共享；每个线程一个连接，限流用 BEGIN IMMEDIATE 保证检查和记录是原子的"""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS kv (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (namespace, key)
+    );
+    CREATE TABLE IF NOT EXISTS rate_events (
+        key TEXT NOT NULL,
+        ts REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_rate_events_key_ts ON rate_events(key, ts);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._max_window = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(self._SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, namespace, key):
+        row = self._conn().execute("SELECT value FROM kv WHERE namespace = ? AND key = ?",
+                                   (namespace, key)).fetchone()
+        return row[0] if row else None
+
+    def _set(self, namespace, key, raw, ttl):
+        self._conn().execute("INSERT OR REPLACE INTO kv (namespace, key, value) VALUES (?, ?, ?)",
+                             (namespace, key, raw))
+
+    def _pop(self, namespace, key):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM kv WHERE namespace = ? AND key = ?", (namespace, key)).fetchone()
+            conn.execute("DELETE FROM kv WHERE namespace = ? AND key = ?", (namespace, key))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def _items(self, namespace):
+        rows = self._conn().execute("SELECT key, value FROM kv WHERE namespace = ?", (namespace,)).fetchall()
+        return dict(rows)
+
+    def purge_expired(self, now=None):
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE json_extract(value, '$.e') <= ?", (now,))
+        if self._max_window:
+            conn.execute("DELETE FROM rate_events WHERE ts <= ?", (now - self._max_window,))
+
+    def allow_request(self, key, limit, window):
+        now = time.time()
+        self._max_window = max(self._max_window, window)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM rate_events WHERE key = ? AND ts <= ?", (key, now - window))
+            (count,) = conn.execute("SELECT COUNT(*) FROM rate_events WHERE key = ?", (key,)).fetchone()
+            allowed = count < limit
+            if allowed:
+                conn.execute("INSERT INTO rate_events (key, ts) VALUES (?, ?)", (key, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisStore(StateStore):
+    """用最小的 RESP 客户端访问 Redis 协议服务。每个键单独存放（nav:<namespace>:<key>），
+    带 TTL 的键用 Redis 自身的过期时间，不需要额外清理；每个线程一个连接"""
+
+    # 原子地清理过期记录、检查次数并记录本次请求
+    _RATE_LIMIT_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[1]) - tonumber(ARGV[2]))
+    if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+        redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2])))
+        return 1
+    end
+    return 0
+    """
+    # 取出并删除，多个进程同时 pop 只有一个拿到值
+    _POP_SCRIPT = """
+    local value = redis.call('GET', KEYS[1])
+    redis.call('DEL', KEYS[1])
+    return value
+    """
+    # 连接断开时可以在新连接上安全重发的命令；EVAL 等不可重发，直接报错
+    _IDEMPOTENT = {"GET", "SET", "DEL", "MGET", "SCAN", "AUTH", "SELECT"}
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.file = sock.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", self.db)
+
+    def _disconnect(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def execute(self, *args):
+        """发送一条命令并返回解析后的回复。连接出错时丢弃该连接（状态未知）；
+        幂等命令在新连接上重发一次，其余命令直接报错，避免重复执行"""
+        for attempt in range(2):
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            try:
+                return self._send(*args)
+            except (OSError, EOFError) as e:
+                self._disconnect()
+                if attempt or str(args[0]).upper() not in self._IDEMPOTENT:
+                    raise RedisError(f"connection lost during {args[0]}: {e}") from e
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._local.sock.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._local.file.readline()
+        if not line:
+            raise EOFError("connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._local.file.read(length + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f"unexpected reply {line!r}")
+
+    @staticmethod
+    def _name(namespace, key=""):
+        return f"{REDIS_PREFIX}{namespace}:{key}"
+
+    def _get(self, namespace, key):
+        return self.execute("GET", self._name(namespace, key))
+
+    def _set(self, namespace, key, raw, ttl):
+        if ttl:
+            self.execute("SET", self._name(namespace, key), raw, "PX", max(1, int(ttl * 1000)))
+        else:
+            self.execute("SET", self._name(namespace, key), raw)
+
+    def _pop(self, namespace, key):
+        return self.execute("EVAL", self._POP_SCRIPT, 1, self._name(namespace, key))
+
+    def _delete(self, namespace, key):
+        self.execute("DEL", self._name(namespace, key))
+
+    def _items(self, namespace):
+        prefix = self._name(namespace)
+        names, cursor = [], "0"
+        while True:
+            cursor, batch = self.execute("SCAN", cursor, "MATCH", prefix + "*", "COUNT", 500)
+            names.extend(batch)
+            if cursor == "0":
+                break
+        if not names:
+            return {}
+        values = self.execute("MGET", *names)
+        return {name[len(prefix):]: value for name, value in zip(names, values) if value is not None}
+
+    def allow_request(self, key, limit, window):
+        now = time.time()
+        return bool(self.execute("EVAL", self._RATE_LIMIT_SCRIPT, 1, REDIS_PREFIX + "rate:" + key,
+                                 now, window, limit, f"{now}:{uuid.uuid4().hex}"))
+
+
+def create_store(url: str = STATE_STORE_URL) -> StateStore:
+    scheme = url.split("://", 1)[0]
+    if scheme == "memory":
+        return MemoryStore()
+    if scheme == "sqlite":
+        return SQLiteStore(url[len("sqlite://"):])
+    if scheme == "redis":
+        return RedisStore(url)
+    raise ValueError(f"unsupported STATE_STORE_URL: {url}")
+
+
+def create_durable_store(url: str = DURABLE_STORE_URL) -> StateStore:
+    """进程内的 STATE_STORE 重启后就丢了，改用 url 指定的存储；共享存储本身已经持久"""
+    return create_store(url) if isinstance(STATE_STORE, MemoryStore) else STATE_STORE
+
+
+STATE_STORE = create_store()
+DURABLE_STORE = create_durable_store()
@@ -0,0 +1,53 @@
+# task_stats.py
+# 单个仿真任务的阶段耗时和资源计数，随提交记录一起写入 submissions.log
+import time
+import threading
+from contextlib import contextmanager
+
+# 阶段时间点均为相对 run_simulation 开始（收到请求）的秒数，admitted 之前是在前端排队的时间
+STAGES = ("admitted", "submitted", "result_folder", "first_frame", "first_segment", "completed", "finalized")
+
+
+class TaskStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self.marks = {}
+        self.durations = {}
+        self.counters = {
+            "frames_decoded": 0,
+            "bytes_read": 0,
+            "segments_written": 0,
+            "bytes_written": 0,
+            "encode_cpu_seconds": 0.0,
+        }
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def mark(self, stage: str):
+        """记录阶段首次到达的时间，重复调用不覆盖"""
+        with self._lock:
+            self.marks.setdefault(stage, self.elapsed())
+
+    def add(self, counter: str, amount=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    @contextmanager
+    def measure(self, name: str):
+        """累计一段操作的墙钟耗时，记为 durations[name]"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.durations[name] = self.durations.get(name, 0.0) + time.monotonic() - start
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            timeline = {stage: round(self.marks[stage], 3) for stage in STAGES if stage in self.marks}
+            timeline.update({f"{name}_seconds": round(value, 3) for name, value in self.durations.items()})
+            timeline["total_seconds"] = round(self.elapsed(), 3)
+            counters = {k: round(v, 3) if isinstance(v, float) else v for k, v in self.counters.items()}
+        return {"timeline": timeline, "counters": counters}
@@ -0,0 +1,119 @@
+# tracing.py
+# 轻量的进程内追踪：记录一次仿真各阶段的 span（提交、状态轮询、发现新帧、编码分段、最终转码），
+# 供历史记录里展开查看单次运行的耗时分布。每次运行有自己的随机 trace id（不是 job_id：相同参数的
+# 请求共用一个 job 和后端任务，但各自是一次运行），提交后再以 task_id 作为别名，按 task_id 查到最近一次运行。
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import Optional
+
+# 内存中最多保留多少条 trace
+MAX_TRACES = 500
+# 单条 trace 最多记录多少个 span，超出后只计数
+MAX_SPANS = 2000
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.aliases = []
+        self.started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self.spans = []
+        self.dropped = 0
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """记录一个 span；attrs 可在 with 块内继续补充（yield 出来的就是这个 dict）"""
+        start = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = type(e).__name__
+            raise
+        finally:
+            self.record(name, start, time.monotonic(), **attrs)
+
+    def record(self, name: str, start: float, end: float, **attrs):
+        """直接记录一个已结束的 span，start/end 为 time.monotonic() 的值"""
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append((name, start - self._start, end - start, attrs))
+            else:
+                self.dropped += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "aliases": list(self.aliases),
+            "started_at": self.started_at,
+            "spans": [{"name": n, "start": round(s, 3), "duration": round(d, 3), **a} for n, s, d, a in spans],
+            "dropped_spans": self.dropped,
+        }
+
+
+class Tracer:
+    def __init__(self, max_traces: int = MAX_TRACES):
+        self.max_traces = max_traces
+        self._traces = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_trace(self, trace_id: Optional[str] = None) -> Trace:
+        """开始一条 trace，不指定 trace_id 时随机生成"""
+        trace = Trace(trace_id)
+        self._put(trace.trace_id, trace)
+        return trace
+
+    def bind(self, trace: Trace, trace_id: str):
+        """给 trace 增加一个可查询的 id（例如提交后拿到的 task_id）"""
+        trace.aliases.append(trace_id)
+        self._put(trace_id, trace)
+
+    def _put(self, key: str, trace: Trace):
+        with self._lock:
+            self._traces[key] = trace
+            self._traces.move_to_end(key)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(trace_id)
+
+
+def span(trace: Optional[Trace], name: str, **attrs):
+    """trace 为 None 时返回空上下文，调用方不必判断"""
+    return trace.span(name, **attrs) if trace is not None else nullcontext(attrs)
+
+
+def format_trace_for_display(trace: Optional[Trace]) -> str:
+    if trace is None:
+        return "No trace recorded"
+    data = trace.to_dict()
+    spans = data["spans"]
+    total = max((s["start"] + s["duration"] for s in spans), default=0) or 1
+    lines = [
+        f"Trace `{data['trace_id']}`" + (f" (task {', '.join(data['aliases'])})" if data["aliases"] else ""),
+        f"started at {data['started_at']}, {len(spans)} spans\n",
+        "| Span | Start (s) | Duration (s) | Timeline | Details |",
+        "|------|------|------|------|------|",
+    ]
+    for s in spans:
+        # 20 格的简易甘特条
+        offset = int(s["start"] / total * 20)
+        width = max(1, int(s["duration"] / total * 20))
+        bar = "·" * offset + "█" * min(width, 20 - offset)
+        details = ", ".join(f"{k}={v}" for k, v in s.items() if k not in ("name", "start", "duration"))
+        lines.append(f"| {s['name']} | {s['start']:.2f} | {s['duration']:.3f} | `{bar}` | {details.replace('|', '/')} |")
+    if data["dropped_spans"]:
+        lines.append(f"\n{data['dropped_spans']} more spans not recorded")
+    return "\n".join(lines)
+
+
+TRACER = Tracer()
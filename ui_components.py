@@ -1,43 +1,95 @@
-# ui_components.py
-# Gradio界面相关和辅助函数
-import gradio as gr
-from config import SCENE_CONFIGS
-from logging_utils import read_logs, format_logs_for_display
-
-def update_history_display(history: list) -> list:
-    updates = []
-    for i in range(10):
-        if i < len(history):
-            entry = history[i]
-            label_text = f"Simulation {i+1}  scene: {entry['scene']}, model: {entry.get('model','')}, mode: {entry.get('mode','')}, prompt: {entry['prompt']}"
-            updates.extend([
-                gr.update(visible=True),
-                gr.update(visible=True, label=label_text, open=False),
-                gr.update(value=entry['video_path'], visible=True),
-                gr.update(value=f"{entry['timestamp']}")
-            ])
-        else:
-            updates.extend([
-                gr.update(visible=False),
-                gr.update(visible=False),
-                gr.update(value=None, visible=False),
-                gr.update(value="")
-            ])
-    return updates
-
-def update_scene_display(scene: str):
-    config = SCENE_CONFIGS.get(scene, {})
-    desc = config.get("description", "No Description")
-    objects = "、".join(config.get("objects", []))
-    image = config.get("preview_image", None)
-    markdown = f"**{desc}**  \nPlaces Included: {objects}"
-    return markdown, image
-
-def get_scene_instruction(scene: str):
-    """根据场景获取默认指令"""
-    config = SCENE_CONFIGS.get(scene, {})
-    return config.get("default_instruction", "")
-
-def update_log_display():
-    logs = read_logs()
-    return format_logs_for_display(logs)
+# ui_components.py
+# Gradio界面相关和辅助函数
+import math
+import gradio as gr
+from config import SCENE_CONFIGS
+from logging_utils import query_logs, format_logs_for_display, LOG_RENDER_CACHE
+from analytics import USAGE_ANALYTICS, format_analytics_for_display
+from tracing import TRACER, format_trace_for_display
+from profiler import PROFILER, PROFILE_DIR, format_profile_for_display
+from backend_pool import BACKEND_POOL, format_pool_status
+
+def update_history_display(history: list) -> list:
+    updates = []
+    for i in range(10):
+        if i < len(history):
+            entry = history[i]
+            label_text = f"Simulation {i+1}  scene: {entry['scene']}, model: {entry.get('model','')}, mode: {entry.get('mode','')}, prompt: {entry['prompt']}"
+            updates.extend([
+                gr.update(visible=True),
+                gr.update(visible=True, label=label_text, open=False),
+                gr.update(value=entry['video_path'], visible=True),
+                gr.update(value=f"{entry['timestamp']}"),
+                gr.update(value=format_trace_for_display(TRACER.get(entry.get('trace_id', ''))))
+            ])
+        else:
+            updates.extend([
+                gr.update(visible=False),
+                gr.update(visible=False),
+                gr.update(value=None, visible=False),
+                gr.update(value=""),
+                gr.update(value="")
+            ])
+    return updates
+
+def update_scene_display(scene: str):
+    config = SCENE_CONFIGS.get(scene, {})
+    desc = config.get("description", "No Description")
+    objects = "、".join(config.get("objects", []))
+    image = config.get("preview_image", None)
+    markdown = f"**{desc}**  \nPlaces Included: {objects}"
+    return markdown, image
+
+def get_scene_instruction(scene: str):
+    """根据场景获取默认指令"""
+    config = SCENE_CONFIGS.get(scene, {})
+    return config.get("default_instruction", "")
+
+def update_log_display(log_type: str = "all", page: int = 1, page_size: int = 50, **filters):
+    if log_type == "all" and page == 1 and page_size == LOG_RENDER_CACHE.max_entries and not any(filters.values()):
+        return LOG_RENDER_CACHE.render()
+    logs, _ = query_logs(log_type, limit=page_size, offset=(page - 1) * page_size, **filters)
+    return format_logs_for_display(logs)
+
+
+LOG_PAGE_SIZE = 50
+
+def update_log_viewer(log_type: str, user_ip: str, scene: str, model: str, result: str,
+                      start: str, end: str, page):
+    """日志查看器：按条件过滤并分页，返回 (表格, 页码信息, 实际页码)"""
+    filters = {
+        "user": (user_ip or "").strip() or None,
+        "scene": scene or None,
+        "model": model or None,
+        "start": (start or "").strip() or None,
+        "end": (end or "").strip() or None,
+    }
+    if result == "success":
+        filters["result"] = "success"
+    elif result == "failed":
+        filters["failed"] = True
+    page = max(1, int(page or 1))
+    logs, total = query_logs(log_type or "all", limit=LOG_PAGE_SIZE, offset=(page - 1) * LOG_PAGE_SIZE, **filters)
+    pages = max(1, math.ceil(total / LOG_PAGE_SIZE))
+    if page > pages:
+        page = pages
+        logs, total = query_logs(log_type or "all", limit=LOG_PAGE_SIZE, offset=(page - 1) * LOG_PAGE_SIZE, **filters)
+    return format_logs_for_display(logs), f"Page {page} / {pages} · {total} entries", page
+
+def update_analytics_display():
+    return format_analytics_for_display(USAGE_ANALYTICS.snapshot())
+
+def update_profiler_display(task_id: str = ""):
+    """task_id 为空时显示当前时间窗口的采样；任务按历史记录里 Trace 的 id 区分"""
+    status = f"Profiler {'running' if PROFILER.running else 'stopped'}, collapsed stacks in `{PROFILE_DIR}`\n\n"
+    return status + format_profile_for_display(PROFILER.snapshot((task_id or "").strip() or None))
+
+def toggle_profiler(enabled: bool):
+    if enabled:
+        PROFILER.start()
+    else:
+        PROFILER.stop()
+    return update_profiler_display()
+
+def update_backend_status():
+    return format_pool_status(BACKEND_POOL)